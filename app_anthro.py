@@ -1,11 +1,37 @@
 import os
+import re
+import sys
+import csv
+import io
+import json
+import zipfile
+from xml.sax.saxutils import escape as xml_escape
+import click
+import numpy as np
 import psycopg2
+import psycopg2.errors
 import psycopg2.extras
 from datetime import datetime, timedelta, timezone
-from flask import Flask, render_template, request, redirect, session, url_for, jsonify
+from flask import Flask, Response, g, render_template, request, redirect, session, url_for, jsonify
+from flask import before_render_template, has_request_context, template_rendered
 from functools import wraps
+from urllib.parse import parse_qsl, urlsplit
+from werkzeug.utils import secure_filename
 import secrets
 import math
+import base64
+import hashlib
+import hmac
+import atexit
+import contextlib
+import contextvars
+import functools
+import queue
+import select
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 
 app = Flask(__name__)
 # Security: Change this in production settings on Render
@@ -15,19 +41,1405 @@ app.secret_key = os.environ.get('SECRET_KEY', 'ritik_crafted_this_securely')
 app.permanent_session_lifetime = timedelta(days=365)
 
 # --- Configurations ---
-CLASS_NAME = 'Practical 4th Sem'
+DEFAULT_CLASS = os.environ.get('DEFAULT_CLASS', 'Practical 4th Sem')  # login pages; controllers start here
 GEOFENCE_RADIUS = 80  
+GEOFENCE_EDGE_BAND = 10        # metres inside the radius that count as "at the edge" in audits
+GPS_SHARED_GRID = 2e-6         # degrees (~0.2 m, the resolution of the REAL lat/lon columns)
+GPS_SHARED_MIN = 3             # this many students on one grid cell in a session looks like a spoofed fix
 
 DATABASE_URL = os.environ.get('DATABASE_URL')
+# NOTIFY channels are database-wide. A DATABASE_URL that pins a schema (options=-csearch_path=..., like the
+# benchmarks' schema_url()) gets channels of its own, so an app on another schema of the same database
+# neither hears its events and cache invalidations nor sends it any.
+_search_path = re.search(r'-c\s*search_path=([^\s,]+)', dict(parse_qsl(urlsplit(DATABASE_URL or '').query)).get('options', ''))
+CHANNEL_PREFIX = f'{_search_path.group(1).lower()}_' if _search_path else ''
 CONTROLLER_USER = os.environ.get('CONTROLLER_USER', 'anthro_admin')
 CONTROLLER_PASS = os.environ.get('CONTROLLER_PASS', 'admin_123')
 
+# Pool sizing is per gunicorn worker: the provider's connection limit is shared by every worker process.
+# Each worker's share also covers its LISTEN connection (PgListener), which is not part of the pool.
+DB_CONN_LIMIT = int(os.environ.get('DB_CONN_LIMIT', 20))
+WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY', 1))
+DB_WORKER_CONNS = max(3, DB_CONN_LIMIT // WEB_CONCURRENCY)
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', DB_WORKER_CONNS - 1))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 5))      # seconds to wait for a free connection
+DB_CONN_MAX_AGE = float(os.environ.get('DB_CONN_MAX_AGE', 1800))   # recycle connections older than this
+DB_CONN_CHECK_IDLE = float(os.environ.get('DB_CONN_CHECK_IDLE', 30))  # ping connections idle longer than this
+DB_QUERY_COUNT_HEADER = os.environ.get('DB_QUERY_COUNT_HEADER', '0') == '1'  # X-DB-Queries on responses (load tests)
+# Instrumentation, served on /metrics in Prometheus text format. Off by default; when off the hooks are a flag check.
+METRICS = os.environ.get('METRICS', '0') == '1'
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')  # bearer token for scrapers (controllers can always read /metrics)
+METRICS_DIR = os.environ.get('METRICS_DIR')      # shared dir: each gunicorn worker answers /metrics for all of them
+METRICS_FLUSH = 5                                # seconds between a worker's snapshots into METRICS_DIR
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 200))  # log statements slower than this (with METRICS on)
+CACHE_TTL = float(os.environ.get('CACHE_TTL', 300))                  # class id + roster
+ACTIVE_SESSION_TTL = float(os.environ.get('ACTIVE_SESSION_TTL', 10))  # safety net if a NOTIFY is missed
+CACHE_CHANNEL = f'{CHANNEL_PREFIX}cache_invalidate'
+EXPORT_CHUNK = int(os.environ.get('EXPORT_CHUNK', 500))  # rows per server-side cursor fetch / streamed chunk
+REPORT_CACHE_TTL = float(os.environ.get('REPORT_CACHE_TTL', 600))     # rendered reports; versioned, so this is how long an unused window is kept
+CACHE_SWEEP_INTERVAL = 60  # seconds between sweeps of expired cache entries (done on put)
+REPORT_VERSION_TTL = float(os.environ.get('REPORT_VERSION_TTL', 10))  # safety net if a NOTIFY is missed
+REPORT_WEEKS = int(os.environ.get('REPORT_WEEKS', 4))                 # window the dashboard opens the report with
+# Signed session tokens: "kid:secret,kid:secret", the first key signs, all of them verify (rotation).
+# Unset, a single key is derived from SECRET_KEY (which may itself contain ',' or ':').
+SESSION_TOKEN_KEYS = ({kid: secret.encode() for kid, secret in (k.split(':', 1) for k in os.environ['SESSION_TOKEN_KEYS'].split(','))}
+                      if os.environ.get('SESSION_TOKEN_KEYS')
+                      else {'k0': hmac.new(app.secret_key.encode(), b'session-token', hashlib.sha256).digest()})
+SESSION_TOKEN_KID = next(iter(SESSION_TOKEN_KEYS))
+EVENTS_CHANNEL = f'{CHANNEL_PREFIX}session_events'
+SSE_HEARTBEAT = 15      # seconds between keepalive comments on an idle stream
+SSE_MAX_STREAM = 300    # streams end after this long; EventSource reconnects with Last-Event-ID
+SSE_BACKLOG = 500       # events kept per worker for Last-Event-ID replay
+# An open stream parks a request thread on sync/gthread workers, so streams are off unless the workers can
+# hold idle connections (app_async, which the procfile runs, serves them on its event loop and turns this on;
+# gunicorn -k gevent/eventlet can hold them too). Dashboards poll otherwise, and marks then skip the live count
+# (a COUNT(*) and a NOTIFY per mark, for streams nobody holds): session_live answers with it instead.
+# Keep it the same on every app sharing the database, or streams miss the counts of the others' marks.
+LIVE_STREAM = os.environ.get('LIVE_STREAM', '0') == '1'
+LIVE_POLL_INTERVAL = float(os.environ.get('LIVE_POLL_INTERVAL', 5))  # seconds between dashboard polls without a stream
+# Sessions stop accepting marks at end_time; each worker's sweeper then flips is_active and runs the end bookkeeping
+SESSION_SWEEP_INTERVAL = float(os.environ.get('SESSION_SWEEP_INTERVAL', 30))  # seconds between sweeps; 0 disables
+SESSION_SWEEP_BATCH = int(os.environ.get('SESSION_SWEEP_BATCH', 500))         # sessions closed per transaction
+# Group commit for /api/mark. Only useful with threaded workers (gunicorn --threads N / -k gthread).
+MARK_BATCHING = os.environ.get('MARK_BATCHING', '0') == '1'
+MARK_BATCH_SIZE = int(os.environ.get('MARK_BATCH_SIZE', 200))         # flush after this many marks...
+MARK_BATCH_WAIT_MS = float(os.environ.get('MARK_BATCH_WAIT_MS', 20))  # ...or this long after the first one
+MARK_QUEUE_MAX = int(os.environ.get('MARK_QUEUE_MAX', 2000))
+MARK_ACK_TIMEOUT = float(os.environ.get('MARK_ACK_TIMEOUT', 10))
+# Student passwords are scrypt hashes, computed on a small per-worker thread pool so a login storm
+# can't take every core from /api/mark
+PASSWORD_SCRYPT_N = int(os.environ.get('PASSWORD_SCRYPT_N', 2**14))               # cost: 16 MB and ~50 ms a hash at 2**14
+KDF_WORKERS = int(os.environ.get('KDF_WORKERS', max(1, (os.cpu_count() or 2) // 2)))  # hashes at once per worker
+KDF_QUEUE_MAX = int(os.environ.get('KDF_QUEUE_MAX', 8))  # logins waiting for a hash before 503s; each holds a request thread,
+                                                        # so keep KDF_WORKERS + this to about half of gunicorn --threads
+LOGIN_MAX_FAILURES = int(os.environ.get('LOGIN_MAX_FAILURES', 5))         # failed logins/registrations per enrollment on a device, or per device...
+LOGIN_THROTTLE_WINDOW = float(os.environ.get('LOGIN_THROTTLE_WINDOW', 300))  # ...in this many seconds, per worker
+LOGIN_THROTTLE_SIZE = 10000                                                # keys tracked per worker (LRU)
+
+# --- Connection Pool ---
+class Overloaded(Exception):
+    """Base for load-shedding errors; answered with 503 + Retry-After."""
+
+class PoolTimeout(Overloaded):
+    """Raised when no connection frees up within DB_POOL_TIMEOUT."""
+
+_request_stats = contextvars.ContextVar('request_stats', default=None)
+
+class RequestStats:
+    __slots__ = ('queries', 'rows', 'db_seconds')
+    def __init__(self): self.queries, self.rows, self.db_seconds = 0, 0, 0.0
+
+class InstrumentedCursorMixin:
+    def execute(self, query, vars=None):
+        stats = _request_stats.get()
+        if not METRICS:
+            if stats is not None: stats.queries += 1
+            return super().execute(query, vars)
+        start = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            record_query(self, query, time.perf_counter() - start, stats)
+
+@functools.lru_cache(maxsize=None)
+def instrumented_cursor(factory):
+    return type(f'Instrumented{factory.__name__}', (InstrumentedCursorMixin, factory), {})
+
+class PooledConnection(psycopg2.extensions.connection):
+    """Connection whose close() hands it back to its pool instead of hanging up."""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool, self.created_at, self.last_used = None, time.monotonic(), time.monotonic()
+
+    def cursor(self, *args, **kwargs):
+        if DB_QUERY_COUNT_HEADER or METRICS:
+            kwargs['cursor_factory'] = instrumented_cursor(kwargs.get('cursor_factory') or self.cursor_factory or psycopg2.extensions.cursor)
+        return super().cursor(*args, **kwargs)
+
+    def close(self):
+        if self.pool is not None: self.pool.putconn(self)
+        else: super().close()
+
+    def discard(self):
+        self.pool = None
+        if not self.closed: super().close()
+
+class ConnectionPool:
+    def __init__(self, dsn, maxconn, timeout, max_age, check_idle):
+        self.dsn, self.maxconn, self.timeout, self.max_age, self.check_idle = dsn, maxconn, timeout, max_age, check_idle
+        self._cond = threading.Condition()
+        self._idle = deque()
+        self._size = 0  # open connections, idle + in use
+        self.counters = {'created': 0, 'recycled': 0, 'timeouts': 0, 'waiting': 0}
+
+    def stats(self):
+        with self._cond:
+            return dict(self.counters, size=self._size, idle=len(self._idle), in_use=self._size - len(self._idle), max=self.maxconn)
+
+    def getconn(self):
+        deadline = time.monotonic() + self.timeout
+        with self._cond:
+            while not self._idle and self._size >= self.maxconn:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.counters['timeouts'] += 1
+                    raise PoolTimeout()
+                self.counters['waiting'] += 1
+                try: self._cond.wait(remaining)
+                finally: self.counters['waiting'] -= 1
+            conn = self._idle.pop() if self._idle else None
+            if conn is None: self._size += 1  # reserve the slot, connect outside the lock
+        try:
+            if conn is not None and not self._healthy(conn):
+                conn.discard()
+                with self._cond: self.counters['recycled'] += 1
+                conn = None
+            if conn is None: conn = self._connect()
+        except Exception:
+            self._release_slot()
+            raise
+        conn.pool = self
+        return conn
+
+    def putconn(self, conn):
+        conn.pool = None
+        try:
+            if not conn.closed and conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()  # read-only routes return with a transaction still open
+        except psycopg2.Error:
+            pass
+        if conn.closed or conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            conn.discard()
+            self._release_slot()
+            return
+        conn.last_used = time.monotonic()
+        with self._cond:
+            self._idle.append(conn)
+            self._cond.notify()
+
+    def _connect(self):
+        start = time.perf_counter()
+        conn = psycopg2.connect(self.dsn, connection_factory=PooledConnection)
+        if METRICS: metrics.observe('app_db_connect_seconds', (), time.perf_counter() - start)
+        with self._cond: self.counters['created'] += 1
+        return conn
+
+    def _release_slot(self):
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    def _healthy(self, conn):
+        now = time.monotonic()
+        if conn.closed or now - conn.created_at > self.max_age: return False
+        if now - conn.last_used < self.check_idle: return True
+        try:
+            with conn.cursor() as cur: cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+_pool, _pool_pid = None, None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    # Pools must not cross a fork: gunicorn workers each build their own on first use.
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ConnectionPool(DATABASE_URL, DB_POOL_MAX, DB_POOL_TIMEOUT, DB_CONN_MAX_AGE, DB_CONN_CHECK_IDLE)
+            _pool_pid = os.getpid()
+        return _pool
+
 def get_db():
+    start = time.perf_counter()
     try:
-        return psycopg2.connect(DATABASE_URL)
+        conn = get_pool().getconn()
+    except PoolTimeout:
+        raise
     except Exception as e:
         print(f"DB Connection Error: {e}")
         return None
+    if METRICS: metrics.observe('app_db_checkout_seconds', (), time.perf_counter() - start)
+    return conn
+
+def busy_body(path):
+    """The 503 answer to a request for `path` when the pool is exhausted (JSON for /api/, else text).
+    Backpressure: tell clients to retry shortly rather than failing the action outright."""
+    if path.startswith('/api/'): return {'success': False, 'message': 'Server busy, retrying...', 'retry': True}
+    return 'Server busy, please refresh in a moment.'
+
+@app.errorhandler(Overloaded)
+def pool_exhausted(e):
+    body = busy_body(request.path)
+    resp = jsonify(body) if isinstance(body, dict) else app.response_class(body, mimetype='text/plain')
+    resp.status_code = 503
+    resp.headers['Retry-After'] = '1'
+    return resp
+
+# --- Metrics ---
+TIME_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55)
+
+# name -> (type, help, buckets); labels are tuples of (key, value) pairs
+METRIC_DEFS = {
+    'app_requests_total': ('counter', 'Requests by endpoint, method and status.', None),
+    'app_request_duration_seconds': ('histogram', 'Time in the view and hooks (streamed bodies: until the first byte).', TIME_BUCKETS),
+    'app_request_db_queries': ('histogram', 'Statements executed per request.', COUNT_BUCKETS),
+    'app_request_db_seconds': ('histogram', 'Time spent in the database per request.', TIME_BUCKETS),
+    'app_template_render_seconds': ('histogram', 'Jinja render time per template.', TIME_BUCKETS),
+    'app_db_checkout_seconds': ('histogram', 'Wait for a pooled connection in get_db().', TIME_BUCKETS),
+    'app_db_connect_seconds': ('histogram', 'Opening a new database connection.', TIME_BUCKETS),
+    'app_db_query_duration_seconds': ('histogram', 'Statement latency by fingerprint.', TIME_BUCKETS),
+    'app_db_query_rows_total': ('counter', 'Rows returned or affected by fingerprint.', None),
+    'app_db_slow_queries_total': ('counter', 'Statements slower than SLOW_QUERY_MS by fingerprint.', None),
+}
+
+class Metrics:
+    """Per-worker counters and histograms. With METRICS_DIR set, each worker snapshots itself
+    there every METRICS_FLUSH seconds and /metrics merges every worker's file."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}     # (name, labels) -> value
+        self.histograms = {}   # (name, labels) -> [per-bucket counts..., +Inf count, sum]
+        self.statements = {}   # fingerprint id -> normalized statement
+        self._flushed = time.monotonic()
+
+    def inc(self, name, labels=(), value=1):
+        with self._lock:
+            key = (name, labels)
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        buckets = METRIC_DEFS[name][2]
+        with self._lock:
+            h = self.histograms.get((name, labels))
+            if h is None: h = self.histograms[(name, labels)] = [0] * (len(buckets) + 2)
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    h[i] += 1
+                    break
+            else:
+                h[-2] += 1
+            h[-1] += value
+
+    def snapshot(self):
+        with self._lock:
+            return {'counters': [[n, l, v] for (n, l), v in self.counters.items()],
+                    'histograms': [[n, l, list(h)] for (n, l), h in self.histograms.items()],
+                    'statements': dict(self.statements)}
+
+    def maybe_flush(self):
+        if METRICS_DIR and time.monotonic() - self._flushed > METRICS_FLUSH: self.flush()
+
+    def flush(self):
+        self._flushed = time.monotonic()
+        path = os.path.join(METRICS_DIR, f'metrics-{os.getpid()}.json')
+        try:
+            with open(path + '.tmp', 'w') as f: json.dump(self.snapshot(), f)
+            os.replace(path + '.tmp', path)
+        except OSError as e:
+            print(f"Metrics flush Error: {e}")
+
+    def collect(self):
+        """Snapshots to render: this worker's, plus the other workers' files under METRICS_DIR."""
+        if not METRICS_DIR: return [self.snapshot()]
+        self.flush()
+        snaps = []
+        for name in os.listdir(METRICS_DIR):
+            if not (name.startswith('metrics-') and name.endswith('.json')): continue
+            try:
+                with open(os.path.join(METRICS_DIR, name)) as f: snaps.append(json.load(f))
+            except (OSError, ValueError):
+                continue  # a worker mid-replace or gone; its numbers show up on the next scrape
+        return snaps
+
+metrics = Metrics()
+atexit.register(lambda: METRICS and METRICS_DIR and metrics.flush())
+
+def _label_str(labels, extra=()):
+    pairs = [(k, str(v).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')) for k, v in (*labels, *extra)]
+    return '{' + ','.join(f'{k}="{v}"' for k, v in pairs) + '}' if pairs else ''
+
+def render_metrics(snapshots, gauges):
+    counters, histograms, statements = {}, {}, {}
+    for snap in snapshots:
+        for name, labels, value in snap['counters']:
+            key = (name, tuple(map(tuple, labels)))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, h in snap['histograms']:
+            key = (name, tuple(map(tuple, labels)))
+            merged = histograms.setdefault(key, [0] * len(h))
+            for i, v in enumerate(h): merged[i] += v
+        statements.update(snap['statements'])
+    out = []
+    for name, (kind, help_text, buckets) in METRIC_DEFS.items():
+        out += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+        if kind == 'counter':
+            out += [f'{name}{_label_str(l)} {v}' for (n, l), v in sorted(counters.items()) if n == name]
+            continue
+        for (n, labels), h in sorted(histograms.items()):
+            if n != name: continue
+            cumulative = 0
+            for bound, count in zip((*buckets, '+Inf'), h[:-1]):
+                cumulative += count
+                out.append(f'{name}_bucket{_label_str(labels, [("le", bound)])} {cumulative}')
+            out += [f'{name}_sum{_label_str(labels)} {h[-1]:.6f}', f'{name}_count{_label_str(labels)} {cumulative}']
+    out += ['# HELP app_db_statement_info Normalized text of each statement fingerprint.', '# TYPE app_db_statement_info gauge']
+    out += [f'app_db_statement_info{_label_str([("query", fp), ("statement", text[:300])])} 1' for fp, text in sorted(statements.items())]
+    for name, help_text, value in gauges:
+        out += [f'# HELP {name} {help_text}', f'# TYPE {name} gauge', f'{name} {value}']
+    return '\n'.join(out) + '\n'
+
+_FINGERPRINT_SUBS = [
+    (re.compile(r"'(?:[^']|'')*'"), '?'),                     # string literals
+    (re.compile(r'%\(\w+\)s|%s|\b\d+(?:\.\d+)?\b'), '?'),     # placeholders and numbers
+    (re.compile(r'ARRAY\[[^\]]*\]'), 'ARRAY[?]'),
+    (re.compile(r'\((?:\s*\?\s*,)*\s*\?\s*\)(?:\s*,\s*\((?:\s*\?\s*,)*\s*\?\s*\))+'), '(?), ...'),  # execute_values rows
+    (re.compile(r'\s+'), ' '),
+]
+
+def normalize_statement(text):
+    for pattern, repl in _FINGERPRINT_SUBS: text = pattern.sub(repl, text)
+    return text.strip()
+
+@functools.lru_cache(maxsize=1024)
+def fingerprint(text):
+    """(id, normalized text) of a statement, so the same query with other values groups together."""
+    normalized = normalize_statement(text)
+    return hashlib.sha1(normalized.encode()).hexdigest()[:12], normalized
+
+def record_query(cur, query, elapsed, stats):
+    if isinstance(query, bytes): query = query.decode(errors='replace')
+    elif not isinstance(query, str): query = query.as_string(cur)  # psycopg2.sql.Composable
+    record_statement(query, max(cur.rowcount, 0), elapsed, stats)
+
+def record_statement(query, rows, elapsed, stats):
+    # Static SQL hits the cache; execute_values() inlines its rows, so fingerprint those fresh.
+    fp, normalized = fingerprint(query) if len(query) < 4096 else fingerprint.__wrapped__(query)
+    if stats is not None:
+        stats.queries += 1
+        stats.rows += rows
+        stats.db_seconds += elapsed
+    labels = (('query', fp),)
+    metrics.observe('app_db_query_duration_seconds', labels, elapsed)
+    metrics.inc('app_db_query_rows_total', labels, rows)
+    metrics.statements.setdefault(fp, normalized)
+    if elapsed * 1000 >= SLOW_QUERY_MS:
+        metrics.inc('app_db_slow_queries_total', labels)
+        endpoint = request.endpoint if has_request_context() else '-'
+        print(f"Slow query {elapsed * 1000:.0f} ms, {rows} rows [{fp}] {endpoint}: {normalized[:500]}")
+
+@app.before_request
+def start_request_stats():
+    if DB_QUERY_COUNT_HEADER or METRICS: _request_stats.set(RequestStats())
+    if METRICS: g.request_start = time.perf_counter()
+
+@app.after_request
+def finish_request_stats(resp):
+    stats = _request_stats.get()
+    if stats is None: return resp
+    if DB_QUERY_COUNT_HEADER: resp.headers['X-DB-Queries'] = str(stats.queries)
+    if METRICS and 'request_start' in g:
+        endpoint = request.endpoint or 'unmatched'
+        metrics.inc('app_requests_total', (('endpoint', endpoint), ('method', request.method), ('status', str(resp.status_code))))
+        labels = (('endpoint', endpoint),)
+        metrics.observe('app_request_duration_seconds', labels, time.perf_counter() - g.request_start)
+        metrics.observe('app_request_db_queries', labels, stats.queries)
+        metrics.observe('app_request_db_seconds', labels, stats.db_seconds)
+        metrics.maybe_flush()
+    return resp
+
+@before_render_template.connect_via(app)
+def _render_started(sender, template, context, **extra):
+    if METRICS: g.render_start = time.perf_counter()
+
+@template_rendered.connect_via(app)
+def _render_finished(sender, template, context, **extra):
+    if METRICS and 'render_start' in g:
+        metrics.observe('app_template_render_seconds', (('template', template.name),), time.perf_counter() - g.pop('render_start'))
+
+# --- Per-worker Cache ---
+MISSING = object()
+
+class TTLCache:
+    """Tiny read-through cache. Keys are tuples whose first item names the kind of data, which
+    is also what gets invalidated ('classes', 'roster', 'enrollment', 'active_session', 'report_version',
+    'login_index', 'terms').
+    An entry stored with a `version` is only a hit for callers asking for that same version.
+    Expired entries are dropped by a sweep on put, at most every CACHE_SWEEP_INTERVAL seconds, so keys
+    nobody asks for again (old report windows, yesterday's reports) don't pile up.
+    Every invalidate() of a kind (and every clear()) bumps its generation; a load that started before the
+    bump, and so may have read the old rows, is not stored."""
+    def __init__(self):
+        self._data = {}
+        self._generations, self._cleared = {}, 0
+        self._lock = threading.Lock()
+        self._swept = time.monotonic()
+        self.hits, self.misses = {}, {}
+
+    def get(self, key, loader, ttl, version=None):
+        value = self.lookup(key, version)
+        if value is MISSING:
+            generation = self.generation(key[0])
+            value = loader()
+            self.put(key, value, ttl, version, generation)
+        return value
+
+    def lookup(self, key, version=None):
+        """The cached value, or MISSING. get() for callers that load on their own (the asyncio app)."""
+        start_listener()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry and entry[0] > time.monotonic() and entry[2] == version:
+                self.hits[key[0]] = self.hits.get(key[0], 0) + 1
+                return entry[1]
+            self.misses[key[0]] = self.misses.get(key[0], 0) + 1
+            return MISSING
+
+    def generation(self, kind):
+        """Taken before loading, then handed to put()."""
+        with self._lock: return self._cleared, self._generations.get(kind, 0)
+
+    def put(self, key, value, ttl, version=None, generation=None):
+        if value is None: return
+        now = time.monotonic()
+        with self._lock:
+            if generation is not None and generation != (self._cleared, self._generations.get(key[0], 0)): return
+            self._data[key] = (now + ttl, value, version)
+            if now - self._swept >= CACHE_SWEEP_INTERVAL:
+                self._swept = now
+                for k in [k for k, entry in self._data.items() if entry[0] <= now]: del self._data[k]
+
+    def invalidate(self, *kinds):
+        with self._lock:
+            for kind in kinds: self._generations[kind] = self._generations.get(kind, 0) + 1
+            for key in [k for k in self._data if k[0] in kinds]: del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._cleared += 1
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {kind: {'hits': self.hits.get(kind, 0), 'misses': self.misses.get(kind, 0)} for kind in set(self.hits) | set(self.misses)}
+
+cache = TTLCache()
+
+class PgListener(threading.Thread):
+    """One LISTEN connection per worker, dispatching NOTIFY payloads to in-process handlers.
+    '__reconnect__' handlers get the (autocommit) connection itself, so what they reload doesn't wait
+    on the pool; if one of them fails the connection is dropped and the whole reconnect retried."""
+    def __init__(self):
+        super().__init__(daemon=True, name='pg-listener')
+        self.handlers = {}
+
+    def subscribe(self, channel, handler):
+        self.handlers.setdefault(channel, []).append(handler)
+
+    def run(self):
+        while True:
+            conn = None
+            try:
+                conn = psycopg2.connect(DATABASE_URL)
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cur:
+                    for channel in self.handlers: cur.execute(f"LISTEN {channel}")
+                # Anything cached before we were listening may be stale
+                if not self.dispatch('__reconnect__', conn): raise RuntimeError('reconnect handler failed')
+                while True:
+                    while conn.notifies:  # also those that arrived during a handler's or the keepalive's query
+                        n = conn.notifies.pop(0)
+                        self.dispatch(n.channel, n.payload)
+                    if select.select([conn], [], [], 60) == ([], [], []):
+                        with conn.cursor() as cur: cur.execute("SELECT 1")  # keepalive
+                        continue
+                    conn.poll()
+            except Exception as e:
+                print(f"Listener Error: {e}")
+                self.dispatch('__disconnect__', None)
+                time.sleep(5)
+            finally:
+                if conn is not None: conn.close()
+
+    def dispatch(self, channel, payload):
+        """Run the channel's handlers; False if any of them failed."""
+        ok = True
+        for handler in self.handlers.get(channel, []):
+            try: handler(payload)
+            except Exception as e:
+                print(f"Listener handler Error ({channel}): {e}")
+                ok = False
+        return ok
+
+_listener, _listener_pid = None, None
+
+def start_listener():
+    global _listener, _listener_pid
+    if _listener_pid == os.getpid() or not DATABASE_URL: return
+    with _pool_lock:
+        if _listener_pid == os.getpid(): return
+        _listener = PgListener()
+        _listener.subscribe(CACHE_CHANNEL, lambda payload: cache.invalidate(*payload.split(',')))
+        _listener.subscribe('__reconnect__', lambda payload: cache.clear())
+        _listener.subscribe(EVENTS_CHANNEL, hub.publish)
+        _listener.subscribe('__reconnect__', hub.resync)
+        _listener.subscribe(EVENTS_CHANNEL, revocations.on_event)
+        _listener.subscribe('__reconnect__', revocations.load)
+        _listener.subscribe('__disconnect__', revocations.suspend)
+        _listener.start()
+        if SESSION_SWEEP_INTERVAL > 0: SessionSweeper(SESSION_SWEEP_INTERVAL, SESSION_SWEEP_BATCH).start()
+        _listener_pid = os.getpid()
+
+class EventHub:
+    """Fans session NOTIFYs from the worker's listener out to every SSE stream open in the worker.
+    Event ids are '<boot>-<seq>'; a Last-Event-ID from another worker (or too old) gets a fresh snapshot.
+    Threads block in wait(); the asyncio app registers a waker, called on every publish, and reads since()."""
+    def __init__(self, backlog):
+        self.cond = threading.Condition()
+        self.events = deque(maxlen=backlog)
+        self.boot = secrets.token_hex(3)
+        self.seq = 0
+        self.wakers = set()
+
+    def publish(self, payload):
+        data = json.loads(payload) if isinstance(payload, str) else payload
+        with self.cond:
+            self.seq += 1
+            self.events.append((self.seq, data))
+            self.cond.notify_all()
+            for wake in self.wakers: wake()
+
+    def add_waker(self, wake):
+        with self.cond: self.wakers.add(wake)
+
+    def remove_waker(self, wake):
+        with self.cond: self.wakers.discard(wake)
+
+    def resync(self, payload=None):
+        # Notifications may have been lost while the listener was down: clients start over from a snapshot
+        self.publish({'type': 'resync'})
+
+    def parse_id(self, event_id):
+        boot, _, seq = (event_id or '').partition('-')
+        if boot != self.boot or not seq.isdigit(): return None
+        with self.cond:
+            oldest = self.events[0][0] if self.events else self.seq + 1
+            return int(seq) if oldest - 1 <= int(seq) <= self.seq else None
+
+    def since(self, seq):
+        """The events after `seq`, without waiting."""
+        with self.cond:
+            if self.events and self.events[0][0] > seq + 1: return [(self.seq, {'type': 'resync'})]  # fell behind
+            return [(i, d) for i, d in self.events if i > seq]
+
+    def wait(self, seq, timeout):
+        with self.cond:
+            self.cond.wait_for(lambda: self.seq > seq, timeout)
+            return self.since(seq)
+
+hub = EventHub(SSE_BACKLOG)
+
+def sse_visible(data, class_id, batch):
+    """Whether a hub event belongs on a stream for `class_id`; `batch` is None on a controller's stream."""
+    if data.get('class_id', class_id) != class_id: return False
+    return batch is None or data['type'] != 'start' or data['batch'] in ('ALL', batch)
+
+def sse_message(seq, kind, data):
+    return f"id: {hub.boot}-{seq}\nevent: {kind}\ndata: {json.dumps(data)}\n\n"
+
+def publish_event(cur, data):
+    """Sent to every worker's SSE streams when the caller's transaction commits."""
+    cur.execute("SELECT pg_notify(%s, %s)", (EVENTS_CHANNEL, json.dumps(data)))
+
+MARK_COUNTS_SQL = """
+    SELECT pg_notify(%s, json_build_object('type', 'count', 'class_id', s.class_id, 'session_id', s.id,
+           'marked_count', (SELECT COUNT(*) FROM attendance_records r WHERE r.session_id = s.id))::text)
+    FROM attendance_sessions s WHERE s.id = ANY(%s::int[])
+"""
+NOTIFY_SQL = "SELECT pg_notify(%s, %s)"
+
+def publish_mark_counts(cur, session_ids):
+    if LIVE_STREAM: cur.execute(MARK_COUNTS_SQL, (EVENTS_CHANNEL, list(session_ids)))
+
+def invalidate(cur, *kinds):
+    """Drop cached data locally and, once the caller's transaction commits, on every other worker."""
+    cache.invalidate(*kinds)
+    cur.execute(NOTIFY_SQL, (CACHE_CHANNEL, ','.join(kinds)))
+
+# Statements used by both this app and the asyncio one (app_async.py), which rewrites %s to $n.
+CLASSES_SQL = "SELECT id, class_name FROM classes ORDER BY class_name"
+ROSTER_SQL = """
+    SELECT s.id, s.enrollment_no, s.name, s.batch FROM enrollments e JOIN students s ON s.id = e.student_id
+    WHERE e.class_id = %s ORDER BY s.enrollment_no
+"""
+STUDENT_CLASSES_SQL = "SELECT class_id FROM enrollments WHERE student_id = %s ORDER BY class_id"
+ACTIVE_SESSIONS_SQL = """
+    SELECT id, start_time, end_time, batch_filter, session_lat, session_lon FROM attendance_sessions
+    WHERE class_id = %s AND is_active = TRUE AND end_time > NOW()
+"""
+SESSION_MARKS_SQL = "SELECT COUNT(*), COALESCE(BOOL_OR(student_id = %s), FALSE) FROM attendance_records WHERE session_id = %s"
+
+def active_session_row(r, class_id):
+    return {'id': r[0], 'class_id': class_id, 'start_time': r[1], 'end_time': r[2], 'batch_filter': r[3], 'session_lat': r[4], 'session_lon': r[5]}
+
+def get_classes(cur):
+    """Every class as (id, class_name), by name."""
+    def load():
+        cur.execute(CLASSES_SQL)
+        return [tuple(row) for row in cur.fetchall()]
+    return cache.get(('classes',), load, CACHE_TTL)
+
+def get_roster(cur, class_id):
+    """Compact list of the students enrolled in a class, by enrollment number: (id, enrollment_no, name, batch)."""
+    def load():
+        cur.execute(ROSTER_SQL, (class_id,))
+        return [tuple(row) for row in cur.fetchall()]
+    return cache.get(('roster', class_id), load, CACHE_TTL)
+
+def get_student_classes(cur, student_id):
+    def load():
+        cur.execute(STUDENT_CLASSES_SQL, (student_id,))
+        return [row[0] for row in cur.fetchall()]
+    return cache.get(('enrollment', student_id), load, CACHE_TTL)
+
+def get_active_sessions(cur, class_id):
+    def load():
+        cur.execute(ACTIVE_SESSIONS_SQL, (class_id,))
+        return [active_session_row(r, class_id) for r in cur.fetchall()]
+    return cache.get(('active_session', class_id), load, ACTIVE_SESSION_TTL)
+
+def find_active_session(cur, class_id, batch=None, session_id=None):
+    return match_session(get_active_sessions(cur, class_id), batch, session_id)
+
+def match_session(sessions, batch=None, session_id=None):
+    now = datetime.now(timezone.utc)
+    for sess in sessions:
+        if sess['end_time'] <= now: continue  # expired while cached; the sweeper will close it
+        if session_id is not None and sess['id'] != session_id: continue
+        if batch is not None and sess['batch_filter'] not in ('ALL', batch): continue
+        return sess
+    return None
+
+class ClassRefused(Exception):
+    """Raised when a request names a class that doesn't exist (404) or isn't the caller's (403)."""
+    def __init__(self, status): self.status = status
+
+def refused_body(path, e):
+    message = 'No such class.' if e.status == 404 else 'You cannot use this class.'
+    return {'success': False, 'message': message} if path.startswith('/api/') else message
+
+@app.errorhandler(ClassRefused)
+def class_refused(e):
+    return refused_body(request.path, e), e.status
+
+def requested_class_id(requested, names, allowed):
+    """The class id a request asked for, or None if it asked for none. A class it may not use is refused
+    rather than swapped for another, so starts, ends and edits never land on the wrong class."""
+    if requested is None or requested == '': return None
+    try: requested = int(requested)
+    except (TypeError, ValueError): raise ClassRefused(404)
+    if requested not in names: raise ClassRefused(404)
+    if requested not in allowed: raise ClassRefused(403)
+    return requested
+
+def choose_class(names, allowed, requested, session, live_ids=()):
+    """(id, name) of the class a request works on, out of `allowed` ids: the requested one, else the first
+    in `live_ids` (those with a session live for the caller), else the last one used (remembered in
+    `session`), else the first. No I/O: the apps (this one and app_async) look up `names` and `live_ids`."""
+    allowed = [cid for cid in allowed if cid in names]
+    class_id = requested_class_id(requested, names, allowed)
+    if not allowed: return None, None
+    if class_id is None: class_id = next((cid for cid in allowed if cid in live_ids), None)
+    if class_id is None: class_id = session.get('class_id') if session.get('class_id') in allowed else allowed[0]
+    if session.get('class_id') != class_id: session['class_id'] = class_id
+    return class_id, names[class_id]
+
+def controller_class_ids(classes):
+    """Every class id, DEFAULT_CLASS's first: a controller may work on any of them."""
+    default = next((cid for cid, name in classes if name == DEFAULT_CLASS), None)
+    return sorted((cid for cid, _ in classes), key=lambda cid: cid != default)
+
+def current_class(cur, allowed, requested=None, live_batch=None):
+    """choose_class() for a request (?class_id= unless `requested` is given); with `live_batch`, an
+    unrequested class falls to one with a session live for that batch."""
+    names = dict(get_classes(cur))
+    if requested is None: requested = request.args.get('class_id')
+    live_ids = ()
+    if live_batch is not None and requested in (None, ''):
+        live_ids = {cid for cid in allowed if cid in names and find_active_session(cur, cid, batch=live_batch)}
+    return choose_class(names, allowed, requested, session, live_ids)
+
+def controller_class(cur, requested=None):
+    return current_class(cur, controller_class_ids(get_classes(cur)), requested)
+
+def student_class(cur, requested=None, live_batch=None):
+    enrolled = get_student_classes(cur, session['student_id'])
+    if session.get('class_ids') != enrolled: session['class_ids'] = enrolled  # /api/mark checks tokens against this
+    return current_class(cur, enrolled, requested, live_batch)
+
+def session_snapshot(cur, class_id, batch=None, student_id=None):
+    """The live session as dashboards and SSE clients see it, or None."""
+    sess = find_active_session(cur, class_id, batch=batch)
+    if not sess: return None
+    cur.execute(SESSION_MARKS_SQL, (student_id, sess['id']))
+    marked_count, marked = cur.fetchone()
+    return snapshot_dict(sess, class_id, get_roster(cur, class_id), marked_count, marked)
+
+def snapshot_dict(sess, class_id, roster, marked_count, marked):
+    return {'id': sess['id'], 'end_time': sess['end_time'].isoformat(), 'batch': sess['batch_filter'],
+            'marked': marked, 'marked_count': marked_count, 'roster': sum(1 for r in roster if sess['batch_filter'] in ('ALL', r[3])),
+            'token': issue_session_token(sess, class_id)}
+
+# --- Signed Session Tokens ---
+# /api/mark trusts a valid token instead of reading attendance_sessions. Tokens carry the session id,
+# class, batch filter, geofence and expiry; end_session revokes early via the listener.
+def _b64(raw): return base64.urlsafe_b64encode(raw).rstrip(b'=').decode()
+def _unb64(text): return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+def _token_sig(key, signed): return _b64(hmac.new(key, signed.encode(), hashlib.sha256).digest())
+
+def issue_session_token(sess, class_id):
+    claims = {'sid': sess['id'], 'cid': class_id, 'b': sess['batch_filter'], 'lat': sess['session_lat'], 'lon': sess['session_lon'],
+              'r': GEOFENCE_RADIUS, 'exp': sess['end_time'].timestamp()}
+    signed = f"{SESSION_TOKEN_KID}.{_b64(json.dumps(claims, separators=(',', ':')).encode())}"
+    return f"{signed}.{_token_sig(SESSION_TOKEN_KEYS[SESSION_TOKEN_KID], signed)}"
+
+def verify_session_token(token, session_id):
+    """Session as find_active_session() returns it (plus 'radius'), or None if the token can't be trusted."""
+    if not token or not isinstance(token, str): return None
+    start_listener()
+    try:
+        kid, payload, sig = token.split('.')
+        key = SESSION_TOKEN_KEYS.get(kid)
+        if key is None or not hmac.compare_digest(sig, _token_sig(key, f"{kid}.{payload}")): return None
+        claims = json.loads(_unb64(payload))
+    except ValueError:
+        return None
+    if not isinstance(claims, dict) or claims.get('sid') != session_id or claims['exp'] <= time.time() or not revocations.allows(session_id): return None
+    return {'id': claims['sid'], 'class_id': claims['cid'], 'batch_filter': claims['b'],
+            'session_lat': claims['lat'], 'session_lon': claims['lon'], 'radius': claims['r']}
+
+class RevocationList:
+    """Ended sessions whose tokens have not expired yet. Until the listener has loaded the list
+    (or while it is disconnected) nothing is trusted and /api/mark reads the session instead."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._revoked = {}  # session id -> when its tokens expire anyway
+        self.ready = False
+
+    def revoke(self, session_ids):
+        now = time.time()
+        with self._lock:
+            self._revoked = {sid: exp for sid, exp in self._revoked.items() if exp > now}
+            for sid in session_ids: self._revoked[sid] = now + 3600  # outlives any token of the session
+
+    def allows(self, session_id):
+        with self._lock: return self.ready and session_id not in self._revoked
+
+    def on_event(self, payload):
+        data = json.loads(payload)
+        if data['type'] == 'end': self.revoke(data['ids'])
+
+    def load(self, conn):
+        """Reload on the listener's own connection (a '__reconnect__' handler) rather than the pool,
+        which is at its busiest right after a worker boots."""
+        with conn.cursor() as cur:
+            cur.execute("SELECT id, EXTRACT(EPOCH FROM end_time) FROM attendance_sessions WHERE is_active = FALSE AND end_time > NOW()")
+            rows = cur.fetchall()
+        now = time.time()
+        with self._lock:
+            self._revoked = {sid: exp for sid, exp in self._revoked.items() if exp > now}
+            self._revoked.update((sid, float(exp)) for sid, exp in rows)
+            self.ready = True
+
+    def suspend(self, payload=None):
+        self.ready = False
+
+revocations = RevocationList()
+
+# --- Attendance Rollup ---
+# daily_attendance / attendance_totals / class_days are kept in step with attendance_records inside the
+# same transaction as every write, so dashboards and the report never aggregate the raw tables.
+ROLLUP_SCHEMA = """
+CREATE TABLE IF NOT EXISTS daily_attendance (
+    student_id INT NOT NULL REFERENCES students(id) ON DELETE CASCADE,
+    class_id INT NOT NULL REFERENCES classes(id) ON DELETE CASCADE,
+    att_date DATE NOT NULL,
+    PRIMARY KEY (class_id, att_date, student_id)
+);
+CREATE INDEX IF NOT EXISTS daily_attendance_student_idx ON daily_attendance (student_id, class_id);
+CREATE TABLE IF NOT EXISTS attendance_totals (
+    student_id INT NOT NULL REFERENCES students(id) ON DELETE CASCADE,
+    class_id INT NOT NULL REFERENCES classes(id) ON DELETE CASCADE,
+    days_present INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (student_id, class_id)
+);
+CREATE TABLE IF NOT EXISTS class_days (
+    class_id INT NOT NULL REFERENCES classes(id) ON DELETE CASCADE,
+    att_date DATE NOT NULL,
+    batch_filter VARCHAR(10) NOT NULL,
+    PRIMARY KEY (class_id, att_date, batch_filter)
+);
+CREATE TABLE IF NOT EXISTS report_versions (
+    class_id INT PRIMARY KEY REFERENCES classes(id) ON DELETE CASCADE,
+    version BIGINT NOT NULL DEFAULT 1,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+"""
+
+ROLLUP_ADD_SQL = """
+    WITH day AS (
+        SELECT class_id, DATE(start_time AT TIME ZONE 'UTC') AS att_date FROM attendance_sessions WHERE id = %s
+    ), ins AS (
+        INSERT INTO daily_attendance (student_id, class_id, att_date)
+        SELECT sid, day.class_id, day.att_date FROM day, unnest(%s::int[]) AS sid
+        ON CONFLICT DO NOTHING
+        RETURNING student_id, class_id
+    )
+    INSERT INTO attendance_totals (student_id, class_id, days_present)
+    SELECT student_id, class_id, COUNT(*) FROM ins GROUP BY student_id, class_id
+    ON CONFLICT (student_id, class_id) DO UPDATE SET days_present = attendance_totals.days_present + EXCLUDED.days_present
+"""
+
+def rollup_add(cur, session_id, student_ids):
+    """Mark students present on the day of session_id, bumping totals only for newly present days."""
+    cur.execute(ROLLUP_ADD_SQL, (session_id, list(student_ids)))
+
+def rollup_remove(cur, class_id, att_date, student_ids):
+    cur.execute("""
+        WITH del AS (
+            DELETE FROM daily_attendance WHERE class_id = %s AND att_date = %s AND student_id = ANY(%s::int[])
+            RETURNING student_id, class_id
+        )
+        UPDATE attendance_totals t SET days_present = t.days_present - d.n
+        FROM (SELECT student_id, class_id, COUNT(*) AS n FROM del GROUP BY student_id, class_id) d
+        WHERE t.student_id = d.student_id AND t.class_id = d.class_id
+    """, (class_id, att_date, list(student_ids)))
+
+def rollup_close_sessions(cur, session_ids):
+    """Count the days of ended (or manually created) sessions towards class totals."""
+    cur.execute("""
+        INSERT INTO class_days (class_id, att_date, batch_filter)
+        SELECT DISTINCT class_id, DATE(start_time AT TIME ZONE 'UTC'), batch_filter FROM attendance_sessions WHERE id = ANY(%s::int[])
+        ON CONFLICT DO NOTHING
+    """, (list(session_ids),))
+
+# Source-of-truth versions of the rollup, used to rebuild and to verify it
+ROLLUP_SOURCES = {
+    'daily_attendance': """
+        SELECT DISTINCT r.student_id, s.class_id, DATE(s.start_time AT TIME ZONE 'UTC')
+        FROM attendance_records r JOIN attendance_sessions s ON r.session_id = s.id""",
+    'attendance_totals': """
+        SELECT r.student_id, s.class_id, COUNT(DISTINCT DATE(s.start_time AT TIME ZONE 'UTC'))
+        FROM attendance_records r JOIN attendance_sessions s ON r.session_id = s.id GROUP BY r.student_id, s.class_id""",
+    'class_days': """
+        SELECT DISTINCT class_id, DATE(start_time AT TIME ZONE 'UTC'), batch_filter
+        FROM attendance_sessions WHERE is_active = FALSE""",
+}
+ROLLUP_COLUMNS = {
+    'daily_attendance': 'student_id, class_id, att_date',
+    'attendance_totals': 'student_id, class_id, days_present',
+    'class_days': 'class_id, att_date, batch_filter',
+}
+
+def rollup_drift(cur):
+    """Rows missing from / extra in each rollup table compared with the raw tables."""
+    drift = {}
+    for table, source in ROLLUP_SOURCES.items():
+        cols = ROLLUP_COLUMNS[table]
+        where = " WHERE days_present > 0" if table == 'attendance_totals' else ""
+        cur.execute(f"SELECT COUNT(*) FROM (({source}) EXCEPT SELECT {cols} FROM {table}{where}) x")
+        missing = cur.fetchone()[0]
+        cur.execute(f"SELECT COUNT(*) FROM (SELECT {cols} FROM {table}{where} EXCEPT ({source})) x")
+        drift[table] = {'missing': missing, 'extra': cur.fetchone()[0]}
+    return drift
+
+def get_report_dates(cur, class_id, start=None, end=None, batch=None):
+    """Report columns, newest first: days with an ended session plus today's live one."""
+    cur.execute("""
+        SELECT DISTINCT att_date FROM class_days
+        WHERE class_id = %s AND att_date >= COALESCE(%s::date, '-infinity') AND att_date <= COALESCE(%s::date, 'infinity')
+        AND (%s::text IS NULL OR batch_filter IN ('ALL', %s))
+    """, (class_id, start, end, batch, batch))
+    days = {row[0] for row in cur.fetchall()}
+    for sess in get_active_sessions(cur, class_id):
+        day = sess['start_time'].astimezone(timezone.utc).date()
+        if (start is None or day >= start) and (end is None or day <= end) and (batch is None or sess['batch_filter'] in ('ALL', batch)):
+            days.add(day)
+    return [d.strftime('%Y-%m-%d') for d in sorted(days, reverse=True)]
+
+# --- Report Cache ---
+# The rendered report (HTML and JSON) is cached per class and window under the class's report version.
+# Every write that can change a report bumps the version in its own transaction, so a cached copy is
+# never served after the data moved on, and the version doubles as the ETag. Marks are the exception:
+# they bump right after they commit (bump_report_after_mark), see ReportBumps.
+BUMP_REPORT_SQL = """
+    INSERT INTO report_versions (class_id)
+    SELECT id FROM (SELECT unnest(%s::int[]) AS id UNION SELECT class_id FROM attendance_sessions WHERE id = ANY(%s::int[])) c
+    WHERE id IS NOT NULL ORDER BY id
+    ON CONFLICT (class_id) DO UPDATE SET version = report_versions.version + 1,
+        updated_at = GREATEST(report_versions.updated_at, clock_timestamp())
+"""
+
+def bump_report_version(cur, class_ids=(), session_ids=()):
+    """Bump the report version of the given classes and of the classes the given sessions belong to."""
+    cur.execute(BUMP_REPORT_SQL, (list(class_ids), list(session_ids)))
+    invalidate(cur, 'report_version')
+
+class ReportBumps:
+    """The classes whose report version a mark in this worker is about to bump. A mark bumps after its
+    own commit, in a short transaction of its own, so concurrent marks don't queue on their class's
+    report_versions row for the length of a mark. A mark whose class is already claimed leaves the bump
+    to the claimant, which commits after it and so covers it; the claim is released just before that
+    commit, from when on later marks bump for themselves. A failed bump is handed to fail() and rides
+    along with the worker's next claim (the next mark, of any class, or the SessionSweeper)."""
+    def __init__(self):
+        self._claimed, self._failed = set(), set()
+        self._lock = threading.Lock()
+
+    def claim(self, class_ids):
+        """The class ids the caller has to bump itself (sorted, the order bumps take row locks in)."""
+        with self._lock:
+            mine = (set(class_ids) | self._failed) - self._claimed
+            self._failed.clear()  # those already claimed are covered by their claimant's later commit
+            self._claimed |= mine
+            return sorted(mine)
+
+    def release(self, class_ids):
+        with self._lock: self._claimed.difference_update(class_ids)
+
+    def fail(self, class_ids):
+        with self._lock: self._failed.update(class_ids)
+
+    @contextlib.contextmanager
+    def bumping(self, class_ids):
+        """claim() around a bump: yields the ids to bump (none: nothing to do). An error is logged and
+        fail()s them instead of reaching the mark, which stands; either way the claim is released."""
+        mine = self.claim(class_ids)
+        try: yield mine
+        except Exception as e:
+            self.fail(mine)
+            print(f"Report Version Error (classes {mine}): {e}")
+        finally: self.release(mine)
+
+    def failed(self):
+        with self._lock: return bool(self._failed)
+
+report_bumps = ReportBumps()
+
+def bump_report_after_mark(conn, class_ids):
+    """Bump the report version of the classes of marks the caller has just committed on `conn`.
+    A failed bump is logged and retried with the next one: the mark stands, but until then cached_report
+    keeps answering 304 for the old version."""
+    with report_bumps.bumping(class_ids) as mine:
+        if not mine: return
+        try:
+            with conn.cursor() as cur:
+                bump_report_version(cur, mine)
+                report_bumps.release(mine)
+                conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+def retry_report_bumps():
+    """Failed bumps that no mark has retried since (its class went quiet). Run by the SessionSweeper."""
+    if not report_bumps.failed(): return
+    conn = get_db()
+    if not conn: return
+    try: bump_report_after_mark(conn, [])
+    finally: conn.close()
+
+def get_report_version(cur, class_id):
+    """(version, updated_at) of a class's report; (0, None) before its first write."""
+    def load():
+        cur.execute("SELECT version, updated_at FROM report_versions WHERE class_id = %s", (class_id,))
+        return tuple(cur.fetchone() or (0, None))
+    return cache.get(('report_version', class_id), load, REPORT_VERSION_TTL)
+
+def report_window(args):
+    """(start, end, batch) from ?from=&to= (YYYY-MM-DD), ?weeks= (that many weeks up to ?to= or today)
+    and ?batch=. Raises ValueError for malformed dates."""
+    start, end = [datetime.strptime(args[k], '%Y-%m-%d').date() if args.get(k) else None for k in ('from', 'to')]
+    weeks = args.get('weeks', type=int)
+    if weeks and weeks > 0:
+        end = end or datetime.now(timezone.utc).date()
+        start = end - timedelta(weeks=weeks, days=-1)
+    return start, end, args.get('batch', '').strip().upper() or None
+
+def report_pager(start, end, today):
+    """from/to of the windows before and after the current one (same length), or None at either end."""
+    if start is None or end is None: return None, None
+    span = end - start + timedelta(days=1)
+    older = {'from': (start - span).isoformat(), 'to': (start - timedelta(days=1)).isoformat()}
+    newer = {'from': (end + timedelta(days=1)).isoformat(), 'to': (end + span).isoformat()} if end < today else None
+    return older, newer
+
+def report_matrix(cur, class_id, start=None, end=None, batch=None):
+    """Report columns (newest first) and one row per enrolled student, windowed and filtered by batch."""
+    dates = get_report_dates(cur, class_id, start, end, batch)
+    # One row per student per day present, read off the (class_id, att_date) primary key for the window only
+    cur.execute("""
+        SELECT student_id, att_date FROM daily_attendance
+        WHERE class_id = %s AND att_date >= COALESCE(%s::date, '-infinity') AND att_date <= COALESCE(%s::date, 'infinity')
+    """, (class_id, start, end))
+    present_by_student = {}
+    for student_id, att_date in cur.fetchall():
+        present_by_student.setdefault(student_id, set()).add(att_date.strftime('%Y-%m-%d'))
+
+    rows = []
+    for sid, roll, name, student_batch in sorted(get_roster(cur, class_id), key=lambda r: (r[3], r[1])):
+        if batch is not None and student_batch != batch: continue
+        present_set = present_by_student.get(sid, set())
+        attendance_map = ['P' if d in present_set else 'A' for d in dates]
+        days_present = attendance_map.count('P')
+        percent = round(days_present / len(dates) * 100) if dates else 0
+        rows.append({'name': name, 'roll': roll, 'batch': student_batch,
+                     'attendance': attendance_map, 'total_present': days_present, 'percent': percent})
+    return dates, rows
+
+@functools.lru_cache(maxsize=None)
+def report_build_tag():
+    """Part of the ETag that changes when the report template is redeployed, so browsers drop old layouts."""
+    return format(int(os.path.getmtime(os.path.join(app.root_path, app.template_folder, 'attendance_report.html'))), 'x')
+
+def cached_report(cur, class_id, fmt, window, build, mimetype):
+    """Serve a report body from the cache under the class's report version, answering 304 when the
+    client's copy (If-None-Match / If-Modified-Since) is still current without building anything."""
+    version, updated_at = get_report_version(cur, class_id)
+    today = datetime.now(timezone.utc).date()
+    params = '-'.join(str(p or '') for p in (*window, today))
+    resp = Response(mimetype=mimetype)
+    resp.set_etag(f'report-{class_id}-{version}-{fmt}-{report_build_tag()}-{params}', weak=True)
+    if updated_at is not None: resp.last_modified = updated_at
+    resp.headers['Cache-Control'] = 'private, no-cache'  # always revalidate; a current copy costs a 304
+    if resp.make_conditional(request).status_code == 304: return resp
+    resp.set_data(cache.get(('report', class_id, fmt, window, today), build, REPORT_CACHE_TTL, version))
+    return resp
+
+# --- Report Export ---
+def export_rows(conn, class_id, dates, start=None, end=None, batch=None):
+    """One report row per student, read through a named (server-side) cursor EXPORT_CHUNK rows at a time."""
+    with conn.cursor(name='report_export') as cur:
+        cur.itersize = EXPORT_CHUNK
+        cur.execute("""
+            SELECT s.name, s.enrollment_no, s.batch,
+                   ARRAY(SELECT to_char(d.att_date, 'YYYY-MM-DD') FROM daily_attendance d
+                         WHERE d.student_id = s.id AND d.class_id = %s
+                         AND d.att_date >= COALESCE(%s::date, '-infinity') AND d.att_date <= COALESCE(%s::date, 'infinity'))
+            FROM enrollments e JOIN students s ON s.id = e.student_id
+            WHERE e.class_id = %s AND (%s::text IS NULL OR s.batch = %s)
+            ORDER BY s.batch, s.enrollment_no
+        """, (class_id, start, end, class_id, batch, batch))
+        for name, roll, student_batch, present_dates in cur:
+            present = set(present_dates)
+            marks = ['P' if d in present else 'A' for d in dates]
+            days_present = len(present.intersection(dates))
+            percent = round(days_present / len(dates) * 100) if dates else 0
+            yield [name, roll, student_batch, *marks, days_present, percent]
+
+def stream_csv(header, rows):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(header)
+    for i, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if i % EXPORT_CHUNK == 0:
+            yield buf.getvalue()
+            buf.seek(0); buf.truncate()
+    yield buf.getvalue()
+
+class _ChunkSink:
+    """Write-only file for ZipFile. It has no seek(), so ZipFile streams entries with data descriptors."""
+    def __init__(self): self.chunks, self.pos = [], 0
+    def write(self, data):
+        self.chunks.append(bytes(data)); self.pos += len(data)
+        return len(data)
+    def tell(self): return self.pos
+    def flush(self): pass
+    def drain(self):
+        data = b''.join(self.chunks); self.chunks.clear()
+        return data
+
+XLSX_PARTS = {
+    '[Content_Types].xml': '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>',
+    '_rels/.rels': '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+        '</Relationships>',
+    'xl/workbook.xml': '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Attendance" sheetId="1" r:id="rId1"/></sheets></workbook>',
+    'xl/_rels/workbook.xml.rels': '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+        '</Relationships>',
+}
+
+def _xlsx_col(n):
+    letters = ''
+    while n:
+        n, rem = divmod(n - 1, 26)
+        letters = chr(65 + rem) + letters
+    return letters
+
+def _xlsx_row(r, values):
+    cells = []
+    for c, v in enumerate(values, 1):
+        ref = f'{_xlsx_col(c)}{r}'
+        if isinstance(v, (int, float)): cells.append(f'<c r="{ref}"><v>{v}</v></c>')
+        else: cells.append(f'<c r="{ref}" t="inlineStr"><is><t>{xml_escape(str(v))}</t></is></c>')
+    return f'<row r="{r}">{"".join(cells)}</row>'
+
+def stream_xlsx(header, rows):
+    """Single-sheet workbook written row by row into a streamed zip; memory stays flat with the row count."""
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for name, xml in XLSX_PARTS.items(): zf.writestr(name, xml)
+        with zf.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as sheet:
+            sheet.write(b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                        b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>')
+            sheet.write(_xlsx_row(1, header).encode())
+            for r, row in enumerate(rows, 2):
+                sheet.write(_xlsx_row(r, row).encode())
+                if r % EXPORT_CHUNK == 0: yield sink.drain()
+            sheet.write(b'</sheetData></worksheet>')
+    yield sink.drain()
+
+EXPORT_FORMATS = {
+    'csv': (stream_csv, 'text/csv'),
+    'xlsx': (stream_xlsx, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+}
+
+# --- Group-commit Mark Writer ---
+class MarkQueueFull(Overloaded):
+    """Raised when the mark queue is at MARK_QUEUE_MAX."""
+
+class PendingMark:
+    __slots__ = ('session_id', 'class_id', 'student_id', 'lat', 'lon', 'done', 'ok')
+    def __init__(self, session_id, class_id, student_id, lat, lon):
+        self.session_id, self.class_id, self.student_id, self.lat, self.lon = session_id, class_id, student_id, lat, lon
+        self.done, self.ok = threading.Event(), False
+
+class MarkWriter(threading.Thread):
+    """Collects validated marks from request threads and writes them in batches: one multi-row
+    insert and one commit per batch. Each request is acknowledged once its batch has committed."""
+    def __init__(self, batch_size, wait_ms, max_queue):
+        super().__init__(daemon=True, name='mark-writer')
+        self.batch_size, self.wait = batch_size, wait_ms / 1000
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.stopping = threading.Event()
+        self.counters = {'batches': 0, 'marks': 0, 'fallbacks': 0, 'failed_batches': 0}
+
+    def submit(self, session_id, class_id, student_id, lat, lon, timeout=MARK_ACK_TIMEOUT):
+        item = PendingMark(session_id, class_id, student_id, lat, lon)
+        try: self.queue.put_nowait(item)
+        except queue.Full: raise MarkQueueFull()
+        return item.done.wait(timeout) and item.ok
+
+    def run(self):
+        while not (self.stopping.is_set() and self.queue.empty()):
+            try: batch = [self.queue.get(timeout=0.5)]
+            except queue.Empty: continue
+            deadline = time.monotonic() + self.wait
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try: batch.append(self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait())
+                except queue.Empty: break
+            self.flush(batch)
+
+    def flush(self, batch):
+        try:
+            self.write(batch)
+            self.counters['batches'] += 1
+        except (psycopg2.IntegrityError, psycopg2.DataError) as e:
+            # One bad row must not fail its neighbours: retry each mark in its own transaction
+            print(f"Mark batch Error ({len(batch)} marks): {e}")
+            self.counters['fallbacks'] += 1
+            for item in batch:
+                try: self.write([item])
+                except Exception as e: print(f"Mark Error (session {item.session_id}, student {item.student_id}): {e}")
+        except Exception as e:
+            # No connection (pool exhausted, database down): one transaction per mark would only wait
+            # out the same timeout len(batch) times, so the whole batch fails at once
+            print(f"Mark batch Error ({len(batch)} marks): {e}")
+            self.counters['failed_batches'] += 1
+        self.counters['marks'] += len(batch)
+        for item in batch: item.done.set()
+
+    def write(self, batch):
+        conn = get_db()
+        if not conn: raise RuntimeError('System unavailable')
+        try:
+            with conn.cursor() as cur:
+                psycopg2.extras.execute_values(cur, """
+                    INSERT INTO attendance_records (session_id, student_id, timestamp, latitude, longitude, ip_address)
+                    VALUES %s ON CONFLICT DO NOTHING
+                """, [(m.session_id, m.student_id, m.lat, m.lon) for m in batch], template="(%s, %s, NOW(), %s, %s, 'Mobile')", page_size=len(batch))
+                by_session = {}
+                for m in batch: by_session.setdefault(m.session_id, []).append(m.student_id)
+                for session_id, student_ids in by_session.items(): rollup_add(cur, session_id, student_ids)
+                publish_mark_counts(cur, by_session)
+                conn.commit()
+            bump_report_after_mark(conn, {m.class_id for m in batch})
+        except Exception:
+            conn.rollback()
+            raise
+        finally: conn.close()
+        for m in batch: m.ok = True
+
+    def stop(self, timeout=10):
+        """Flush whatever is queued, then stop. Runs at worker shutdown."""
+        self.stopping.set()
+        self.join(timeout)
+
+_mark_writer, _mark_writer_pid = None, None
+
+def get_mark_writer():
+    global _mark_writer, _mark_writer_pid
+    if not MARK_BATCHING: return None
+    if _mark_writer_pid != os.getpid():
+        with _pool_lock:
+            if _mark_writer_pid != os.getpid():
+                _mark_writer = MarkWriter(MARK_BATCH_SIZE, MARK_BATCH_WAIT_MS, MARK_QUEUE_MAX)
+                _mark_writer.start()
+                atexit.register(_mark_writer.stop)
+                _mark_writer_pid = os.getpid()
+    return _mark_writer
+
+# --- Session Expiry ---
+# Reads already ignore sessions past end_time; closing them (is_active = FALSE) is what moves their day
+# into the rollup, tells SSE clients and frees the class for its next session.
+EXPIRED_SESSIONS_SQL = """
+    UPDATE attendance_sessions SET is_active = FALSE WHERE id IN (
+        SELECT id FROM attendance_sessions WHERE is_active AND end_time <= NOW()
+        ORDER BY end_time LIMIT %s FOR UPDATE SKIP LOCKED
+    ) RETURNING id, class_id
+"""
+EXPIRED_CLASS_SESSION_SQL = "UPDATE attendance_sessions SET is_active = FALSE WHERE class_id = %s AND is_active AND end_time <= NOW() RETURNING id, class_id"
+
+def close_sessions(cur, ended):
+    """Bookkeeping for sessions just set inactive, as (id, class_id) rows. Revoke their tokens after the commit."""
+    if not ended: return
+    rollup_close_sessions(cur, [row[0] for row in ended])
+    for class_id in {row[1] for row in ended}:
+        publish_event(cur, {'type': 'end', 'class_id': class_id, 'ids': [row[0] for row in ended if row[1] == class_id]})
+    invalidate(cur, 'active_session')
+    bump_report_version(cur, {row[1] for row in ended})
+
+def sweep_sessions(batch=SESSION_SWEEP_BATCH):
+    """Close every session past its end_time, `batch` per transaction. Returns how many were closed."""
+    closed = 0
+    while True:
+        conn = get_db()
+        if not conn: return closed
+        try:
+            with conn.cursor() as cur:
+                cur.execute(EXPIRED_SESSIONS_SQL, (batch,))
+                ended = cur.fetchall()
+                close_sessions(cur, ended)
+            conn.commit()
+        finally: conn.close()
+        revocations.revoke([row[0] for row in ended])
+        closed += len(ended)
+        if len(ended) < batch: return closed
+
+class SessionSweeper(threading.Thread):
+    """Runs sweep_sessions() (then retry_report_bumps()) every `interval` seconds. Each worker has one;
+    SKIP LOCKED keeps concurrent sweeps on different rows, so a batch is closed (and announced) exactly once."""
+    def __init__(self, interval, batch):
+        super().__init__(daemon=True, name='session-sweeper')
+        self.interval, self.batch = interval, batch
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            try: sweep_sessions(self.batch)
+            except Exception as e: print(f"Session Sweep Error: {e}")
+            retry_report_bumps()
+
+# --- Geofence Audit ---
+def haversine_np(lat1, lon1, lat2, lon2):
+    """Vectorized haversine(); takes arrays (or scalars) in degrees and returns metres."""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(a, dtype=float)) for a in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2)**2
+    return 6371000 * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+def load_audit_records(cur, class_id, session_id=None, start=None, end=None):
+    """GPS marks of one session or a date range as column arrays, plus {session_id: date}."""
+    cur.execute("""
+        SELECT r.session_id, r.student_id, r.latitude, r.longitude, s.session_lat, s.session_lon,
+               to_char(DATE(s.start_time AT TIME ZONE 'UTC'), 'YYYY-MM-DD')
+        FROM attendance_records r JOIN attendance_sessions s ON r.session_id = s.id
+        WHERE s.class_id = %s AND (%s::int IS NULL OR s.id = %s)
+        AND DATE(s.start_time AT TIME ZONE 'UTC') >= COALESCE(%s::date, '-infinity')
+        AND DATE(s.start_time AT TIME ZONE 'UTC') <= COALESCE(%s::date, 'infinity')
+        AND r.latitude IS NOT NULL AND r.longitude IS NOT NULL AND s.session_lat IS NOT NULL
+    """, (class_id, session_id, session_id, start, end))
+    rows = cur.fetchall()
+    session_dates = {row[0]: row[6] for row in rows}
+    data = np.array([row[:6] for row in rows], dtype=float).reshape(-1, 6)
+    records = {
+        'session_id': data[:, 0].astype(np.int64), 'student_id': data[:, 1].astype(np.int64),
+        'lat': data[:, 2], 'lon': data[:, 3], 'session_lat': data[:, 4], 'session_lon': data[:, 5],
+    }
+    return records, session_dates
+
+def geofence_audit(records, radius=GEOFENCE_RADIUS, edge_band=GEOFENCE_EDGE_BAND, grid=GPS_SHARED_GRID, shared_min=GPS_SHARED_MIN):
+    """Flag, per record: outside `radius`, within `edge_band` of it, a distance outlier for its session
+    (robust z-score over the median absolute deviation) and coordinates shared by several students."""
+    n = len(records['session_id'])
+    dist = haversine_np(records['lat'], records['lon'], records['session_lat'], records['session_lon'])
+    flags = {
+        'outside': dist > radius,
+        'edge': (dist > radius - edge_band) & (dist <= radius),
+        'outlier': np.zeros(n, dtype=bool),
+        'shared_coords': np.zeros(n, dtype=bool),
+    }
+    if n == 0: return dist, flags
+    
+    # Group by session once; every per-session statistic below works on contiguous slices
+    order = np.argsort(records['session_id'], kind='stable')
+    sessions, starts = np.unique(records['session_id'][order], return_index=True)
+    bounds = np.append(starts, n)
+    for i in range(len(sessions)):
+        idx = order[bounds[i]:bounds[i + 1]]
+        d = dist[idx]
+        median = np.median(d)
+        mad = np.median(np.abs(d - median)) * 1.4826
+        if mad > 0: flags['outlier'][idx] = (d - median) / mad > 3.5
+    
+    # Near-identical fixes: snap to the grid and count records per (session, cell)
+    cells = np.stack([records['session_id'], np.round(records['lat'] / grid), np.round(records['lon'] / grid)], axis=1)
+    _, inverse, counts = np.unique(cells, axis=0, return_inverse=True, return_counts=True)
+    flags['shared_coords'] = counts[inverse.reshape(-1)] >= shared_min
+    return dist, flags
+
+def geofence_report(records, session_dates, dist, flags):
+    report = []
+    for sid in np.unique(records['session_id']):
+        mask = records['session_id'] == sid
+        d = dist[mask]
+        flagged = []
+        for i in np.flatnonzero(mask & np.logical_or.reduce(list(flags.values()))):
+            flagged.append({'student_id': int(records['student_id'][i]), 'distance_m': round(float(dist[i]), 1),
+                            'reasons': [name for name, f in flags.items() if f[i]]})
+        report.append({
+            'session_id': int(sid), 'date': session_dates[int(sid)], 'marks': int(mask.sum()),
+            'median_m': round(float(np.median(d)), 1), 'max_m': round(float(d.max()), 1),
+            **{name: int((f & mask).sum()) for name, f in flags.items()},
+            'flagged': sorted(flagged, key=lambda r: -r['distance_m']),
+        })
+    return report
 
 # --- Helpers ---
 def login_required(f):
@@ -38,6 +1450,43 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated
 
+# Student hot paths, shared with the asyncio app (app_async.py)
+LOGIN_COLUMNS = "enrollment_no, id, name, batch, can_start_session, password, device_id"
+LOGIN_INDEX_SQL = f"SELECT {LOGIN_COLUMNS} FROM students"
+STUDENT_LOGIN_SQL = f"SELECT {LOGIN_COLUMNS} FROM students WHERE enrollment_no = %s"
+PASSWORD_UPGRADE_SQL = "UPDATE students SET password = %s WHERE id = %s AND password = %s"
+DASHBOARD_STATS_SQL = """
+    SELECT (SELECT COUNT(DISTINCT att_date) FROM class_days
+            WHERE class_id = %s AND (batch_filter = 'ALL' OR batch_filter = %s)),
+           (SELECT days_present FROM attendance_totals WHERE student_id = %s AND class_id = %s)
+"""
+SESSION_BY_ID_SQL = "SELECT * FROM attendance_sessions WHERE id = %s AND is_active = TRUE AND end_time > NOW()"
+MARK_INSERT_SQL = "INSERT INTO attendance_records (session_id, student_id, timestamp, latitude, longitude, ip_address) VALUES (%s, %s, NOW(), %s, %s, 'Mobile') ON CONFLICT DO NOTHING"
+
+def check_login(student, device_id):
+    """Why a login is refused before its password is looked at, or None. The device check comes
+    first and costs a compare, so a login from a phone other than the registered one never hashes."""
+    if not student: return 'Student not found.'
+    if not student['password']: return 'Not registered yet.'
+    if not hmac.compare_digest(str(student['device_id']).encode(), str(device_id).encode()): return 'Please use your registered device.'
+    return None
+
+def student_session(student, class_ids):
+    """Session keys set by a student login."""
+    return {'student_id': student['id'], 'student_name': student['name'], 'student_batch': student['batch'],
+            'is_monitor': student.get('can_start_session', False),  # monitors can start sessions
+            'class_ids': class_ids}
+
+def check_mark(sess, enrolled, student_batch, lat, lon):
+    """Why a mark against a live session is refused, or None."""
+    if sess['class_id'] not in enrolled: return 'You are not enrolled in this class.'
+    # Security: Ensure student belongs to the batch of the session
+    if sess['batch_filter'] != 'ALL' and sess['batch_filter'] != student_batch:
+        return f"This session is for {sess['batch_filter']} students only."
+    dist = haversine(lat, lon, sess['session_lat'], sess['session_lon'])
+    if dist > sess.get('radius', GEOFENCE_RADIUS): return f'Too far ({int(dist)}m). Move closer.'
+    return None
+
 def haversine(lat1, lon1, lat2, lon2):
     R = 6371000 
     phi1, phi2 = math.radians(lat1), math.radians(lat2)
@@ -46,6 +1495,124 @@ def haversine(lat1, lon1, lat2, lon2):
     a = math.sin(dphi/2)**2 + math.cos(phi1)*math.cos(phi2)*math.sin(dlambda/2)**2
     return R * (2 * math.atan2(math.sqrt(a), math.sqrt(1 - a)))
 
+# --- Student Logins ---
+def _scrypt(password, salt, n, r, p, dklen=32):
+    return hashlib.scrypt(str(password).encode(), salt=salt, n=n, r=r, p=p, dklen=dklen, maxmem=256 * r * (n + p + 2))
+
+def hash_password(password, n=PASSWORD_SCRYPT_N):
+    """'scrypt$n$r$p$salt$hash' (the cost travels with the hash, so PASSWORD_SCRYPT_N can change)."""
+    salt = secrets.token_bytes(16)
+    return f"scrypt${n}$8$1${_b64(salt)}${_b64(_scrypt(password, salt, n, 8, 1))}"
+
+def verify_password(stored, password):
+    """(matches, needs_rehash). Students registered before hashing still have the plain password
+    stored; it is compared once and replaced by a hash on that login."""
+    if not stored or password is None: return False, False
+    if not stored.startswith('scrypt$'): return hmac.compare_digest(stored.encode(), str(password).encode()), True
+    _, n, r, p, salt, digest = stored.split('$')
+    digest = _unb64(digest)
+    matches = hmac.compare_digest(_scrypt(password, _unb64(salt), int(n), int(r), int(p), len(digest)), digest)
+    return matches, int(n) != PASSWORD_SCRYPT_N
+
+class KdfBusy(Overloaded):
+    """Raised when KDF_QUEUE_MAX logins are already waiting for a hash."""
+
+class KdfPool:
+    """Password hashing on `workers` threads. hashlib.scrypt releases the GIL, so hashes run beside
+    request threads but never on more than `workers` cores; beyond `max_queue` waiting, logins get a 503."""
+    def __init__(self, workers, max_queue):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='kdf')
+        self.slots = threading.BoundedSemaphore(workers + max_queue)
+
+    def submit(self, fn, *args):
+        if not self.slots.acquire(blocking=False): raise KdfBusy()
+        future = self.executor.submit(fn, *args)
+        future.add_done_callback(lambda f: self.slots.release())
+        return future
+
+    def run(self, fn, *args):
+        return self.submit(fn, *args).result()
+
+_kdf_pool = None
+_kdf_pool_pid = None
+
+def get_kdf_pool():
+    global _kdf_pool, _kdf_pool_pid
+    if _kdf_pool_pid != os.getpid():
+        with _pool_lock:
+            if _kdf_pool_pid != os.getpid():
+                _kdf_pool = KdfPool(KDF_WORKERS, KDF_QUEUE_MAX)
+                _kdf_pool_pid = os.getpid()
+    return _kdf_pool
+
+class LoginThrottle:
+    """Failed attempts per key (see login_keys) in fixed windows, kept in an LRU of at most `size` keys.
+    Per worker, so with N workers a key gets up to N * limit tries a window."""
+    def __init__(self, size, limit, window):
+        self.size, self.limit, self.window = size, limit, window
+        self._lock = threading.Lock()
+        self._failures = OrderedDict()  # key -> (count, window start)
+
+    def retry_after(self, *keys):
+        """Seconds until every key may try again (0 if they all may now)."""
+        now = time.monotonic()
+        with self._lock:
+            waits = [start + self.window - now for count, start in filter(None, map(self._failures.get, keys)) if count >= self.limit]
+        return max([w for w in waits if w > 0], default=0)
+
+    def failed(self, *keys):
+        now = time.monotonic()
+        with self._lock:
+            for key in keys:
+                count, start = self._failures.pop(key, (0, now))
+                self._failures[key] = (count + 1, start) if now - start < self.window else (1, now)
+            while len(self._failures) > self.size: self._failures.popitem(last=False)
+
+    def reset(self, *keys):
+        with self._lock:
+            for key in keys: self._failures.pop(key, None)
+
+login_throttle = LoginThrottle(LOGIN_THROTTLE_SIZE, LOGIN_MAX_FAILURES, LOGIN_THROTTLE_WINDOW)
+
+def login_keys(enrollment, device_id):
+    """Throttle keys of a login or registration: the enrollment on this device, and the device. Never the
+    enrollment alone, or anyone could lock a student out by failing logins under their roll number; a
+    login must come from the registered device anyway, so guessing a password means guessing it too."""
+    pair = ('login', enrollment, str(device_id or ''))
+    return (pair, ('device', str(device_id))) if device_id else (pair,)
+
+def throttle_message(wait):
+    return f'Too many attempts. Try again in {math.ceil(wait)}s.'
+
+def build_login_index(rows):
+    """({enrollment_no: student}, {registered device ids}) from LOGIN_COLUMNS rows."""
+    students = {row[0]: {'id': row[1], 'name': row[2], 'batch': row[3], 'can_start_session': row[4], 'password': row[5], 'device_id': row[6]}
+                for row in rows}
+    return students, {s['device_id'] for s in students.values() if s['device_id']}
+
+_login_index_lock = threading.Lock()
+
+def get_login_index(cur):
+    """Every student's login columns, loaded once per worker (not once per login in a storm);
+    registration invalidates it everywhere."""
+    index = cache.lookup(('login_index',))
+    if index is MISSING:
+        with _login_index_lock:
+            def load():
+                cur.execute(LOGIN_INDEX_SQL)
+                return build_login_index(cur.fetchall())
+            index = cache.get(('login_index',), load, CACHE_TTL)
+    return index
+
+def find_student(cur, enrollment):
+    """A student's login columns: from the index, else (added since it loaded) by the enrollment_no key."""
+    student = get_login_index(cur)[0].get(enrollment)
+    if student is None:
+        cur.execute(STUDENT_LOGIN_SQL, (enrollment,))
+        row = cur.fetchone()
+        student = build_login_index([row])[0][enrollment] if row else None
+    return student
+
 # --- Routes ---
 
 @app.route('/')
@@ -57,55 +1624,85 @@ def home():
 @app.route('/student/auth')
 def student_auth():
     if 'student_id' in session: return redirect(url_for('student_dashboard'))
-    return render_template('student_auth.html', class_name=CLASS_NAME)
+    return render_template('student_auth.html', class_name=DEFAULT_CLASS)
 
 @app.route('/api/student/login', methods=['POST'])
 def api_login():
     data = request.json
     enrollment, password, device_id = data.get('enrollment').strip().upper(), data.get('password'), data.get('device_id')
+    keys = login_keys(enrollment, device_id)
+    wait = login_throttle.retry_after(*keys)
+    if wait: return jsonify({'success': False, 'message': throttle_message(wait)}), 429, {'Retry-After': str(math.ceil(wait))}
     
     conn = get_db()
     if not conn: return jsonify({'success': False, 'message': 'System unavailable'})
     try:
-        with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
-            cur.execute("SELECT * FROM students WHERE enrollment_no = %s", (enrollment,))
-            student = cur.fetchone()
-            
-            if not student: return jsonify({'success': False, 'message': 'Student not found.'})
-            if not student['password']: return jsonify({'success': False, 'message': 'Not registered yet.'})
-            if student['password'] != password: return jsonify({'success': False, 'message': 'Wrong password.'})
-            if student['device_id'] != device_id: return jsonify({'success': False, 'message': 'Please use your registered device.'})
-            
-            # SET PERMANENT SESSION
-            session.permanent = True
-            session['student_id'] = student['id']
-            session['student_name'] = student['name']
-            session['student_batch'] = student['batch']
-            # Check if student is a monitor (can start sessions)
-            session['is_monitor'] = student.get('can_start_session', False)
-            
-            return jsonify({'success': True})
+        with conn.cursor() as cur:
+            student = find_student(cur, enrollment)
+            error = check_login(student, device_id)
+            class_ids = get_student_classes(cur, student['id']) if not error else None
+    finally: conn.close()  # not held while the password hashes
+    
+    if not error:
+        matches, rehash = get_kdf_pool().run(verify_password, student['password'], password)
+        if not matches: error = 'Wrong password.'
+    if error:
+        login_throttle.failed(*keys)
+        return jsonify({'success': False, 'message': error})
+    login_throttle.reset(*keys)
+    if rehash: upgrade_password(student, password)
+    
+    # SET PERMANENT SESSION
+    session.permanent = True
+    session.update(student_session(student, class_ids))
+    return jsonify({'success': True})
+
+def upgrade_password(student, password):
+    """Store a fresh hash for a plain or outdated one. The login index keeps the old value elsewhere
+    until it expires; it still verifies, so there is no need to invalidate it mid-storm."""
+    hashed = get_kdf_pool().run(hash_password, password)
+    conn = get_db()
+    if not conn: return
+    try:
+        with conn.cursor() as cur:
+            cur.execute(PASSWORD_UPGRADE_SQL, (hashed, student['id'], student['password']))
+        conn.commit()
+        student['password'] = hashed
     finally: conn.close()
 
 @app.route('/api/student/register', methods=['POST'])
 def api_register():
     data = request.json
     enrollment, password, device_id = data.get('enrollment').strip().upper(), data.get('password'), data.get('device_id')
+    keys = login_keys(enrollment, device_id)
+    wait = login_throttle.retry_after(*keys)
+    if wait: return jsonify({'success': False, 'message': throttle_message(wait)}), 429, {'Retry-After': str(math.ceil(wait))}
+    if not password or not device_id: return jsonify({'success': False, 'message': 'Password and device required.'})
     
     conn = get_db()
     if not conn: return jsonify({'success': False, 'message': 'System unavailable'})
     try:
-        with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
-            cur.execute("SELECT * FROM students WHERE enrollment_no = %s", (enrollment,))
-            student = cur.fetchone()
-            
-            if not student: return jsonify({'success': False, 'message': 'Enrollment not found.'})
-            if student['password']: return jsonify({'success': False, 'message': 'Already registered.'})
-            
-            cur.execute("SELECT id FROM students WHERE device_id = %s", (device_id,))
-            if cur.fetchone(): return jsonify({'success': False, 'message': 'Device already used.'})
-            
-            cur.execute("UPDATE students SET password = %s, device_id = %s WHERE id = %s", (password, device_id, student['id']))
+        with conn.cursor() as cur:
+            student = find_student(cur, enrollment)
+            if not student: error = 'Enrollment not found.'
+            elif student['password']: error = 'Already registered.'
+            elif device_id in get_login_index(cur)[1]: error = 'Device already used.'
+            else: error = None
+    finally: conn.close()
+    if error:
+        login_throttle.failed(*keys)
+        return jsonify({'success': False, 'message': error})
+    
+    hashed = get_kdf_pool().run(hash_password, password)
+    conn = get_db()
+    if not conn: return jsonify({'success': False, 'message': 'System unavailable'})
+    try:
+        with conn.cursor() as cur:
+            # device_id is UNIQUE: a phone registered since the index loaded is refused here
+            try: cur.execute("UPDATE students SET password = %s, device_id = %s WHERE id = %s AND password IS NULL RETURNING id", (hashed, device_id, student['id']))
+            except psycopg2.errors.UniqueViolation: return jsonify({'success': False, 'message': 'Device already used.'})
+            if cur.fetchone() is None: return jsonify({'success': False, 'message': 'Already registered.'})
+            invalidate(cur, 'roster', 'login_index')
             conn.commit()
             return jsonify({'success': True})
     finally: conn.close()
@@ -117,78 +1714,136 @@ def student_dashboard():
     
     stats = {'total': 0, 'present': 0, 'percent': 0}
     active_session = None
+    class_id, class_name, classes = None, None, []
     conn = get_db()
     
     if conn:
         try:
             with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
-                cur.execute("SELECT id FROM classes WHERE class_name = %s", (CLASS_NAME,))
-                class_id = cur.fetchone()[0]
-                
                 # Filter stats by the student's batch (BA or BSC)
                 student_batch = session.get('student_batch', 'ALL')
                 
-                cur.execute("""
-                    SELECT COUNT(DISTINCT DATE(start_time AT TIME ZONE 'UTC')) 
-                    FROM attendance_sessions 
-                    WHERE class_id = %s AND is_active = FALSE 
-                    AND (batch_filter = 'ALL' OR batch_filter = %s)
-                """, (class_id, student_batch))
-                stats['total'] = cur.fetchone()[0]
-                
-                cur.execute("""
-                    SELECT COUNT(DISTINCT DATE(s.start_time AT TIME ZONE 'UTC')) 
-                    FROM attendance_records r
-                    JOIN attendance_sessions s ON r.session_id = s.id
-                    WHERE r.student_id = %s AND s.class_id = %s
-                """, (session['student_id'], class_id))
-                stats['present'] = cur.fetchone()[0]
-                
-                if stats['total'] > 0: stats['percent'] = round((stats['present'] / stats['total']) * 100)
-                
-                # Check for active session matching student's batch
-                cur.execute("""
-                    SELECT * FROM attendance_sessions 
-                    WHERE class_id = %s AND is_active = TRUE 
-                    AND (batch_filter = 'ALL' OR batch_filter = %s)
-                """, (class_id, student_batch))
-                sess = cur.fetchone()
-                
-                if sess:
-                    active_session = {'id': sess['id'], 'end_time': sess['end_time'].isoformat(), 'batch': sess['batch_filter']}
-                    cur.execute("SELECT 1 FROM attendance_records WHERE session_id = %s AND student_id = %s", (sess['id'], session['student_id']))
-                    active_session['marked'] = cur.fetchone() is not None
+                # Opens on the class with a session live for this student unless one was picked
+                class_id, class_name = student_class(cur, live_batch=student_batch)
+                names = dict(get_classes(cur))
+                classes = [(cid, names[cid]) for cid in session['class_ids'] if cid in names]
+
+                if class_id is not None:
+                    cur.execute(DASHBOARD_STATS_SQL, (class_id, student_batch, session['student_id'], class_id))
+                    total, present = cur.fetchone()
+                    stats['total'], stats['present'] = total, present or 0
+
+                    if stats['total'] > 0: stats['percent'] = round((stats['present'] / stats['total']) * 100)
+
+                    # Check for active session matching student's batch
+                    active_session = session_snapshot(cur, class_id, batch=student_batch, student_id=session['student_id'])
         finally: conn.close()
     
-    return render_template('student_attendance.html', class_name=CLASS_NAME, stats=stats, active_session=active_session, name=session['student_name'], is_monitor=session.get('is_monitor', False))
+    return render_template('student_attendance.html', class_name=class_name, class_id=class_id, classes=classes, stats=stats, active_session=active_session, name=session['student_name'], is_monitor=session.get('is_monitor', False))
 
 @app.route('/api/mark', methods=['POST'])
 @login_required
 def mark_attendance():
     data = request.json
     lat, lon, sid = data.get('lat'), data.get('lon'), data.get('session_id')
+    try: sid = int(sid)
+    except (TypeError, ValueError): return jsonify({'success': False, 'message': 'Session expired.'})
     
+    # Fast path: a valid signed token carries everything needed to check the mark, no session read.
+    # Enrollment comes from the cookie, refreshed on every dashboard load.
+    enrolled = session.get('class_ids')
+    sess = verify_session_token(data.get('token'), sid) if enrolled is not None else None
+    writer = get_mark_writer()
+    conn = None
+    try:
+        if sess is None:
+            conn = get_db()
+            if not conn: return jsonify({'success': False})
+            with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
+                if enrolled is None: enrolled = session['class_ids'] = get_student_classes(cur, session['student_id'])
+                sess = next(filter(None, (find_active_session(cur, cid, session_id=sid) for cid in enrolled)), None)
+                if not sess:
+                    # Not cached here yet: the session may have been started on another worker a moment ago
+                    cur.execute(SESSION_BY_ID_SQL, (sid,))
+                    sess = cur.fetchone()
+            if not sess: return jsonify({'success': False, 'message': 'Session expired.'})
+        
+        error = check_mark(sess, enrolled, session.get('student_batch'), lat, lon)
+        if error: return jsonify({'success': False, 'message': error})
+        
+        if writer is None:
+            if conn is None: conn = get_db()
+            if not conn: return jsonify({'success': False})
+            with conn.cursor() as cur:
+                cur.execute(MARK_INSERT_SQL, (sid, session['student_id'], lat, lon))
+                rollup_add(cur, sid, [session['student_id']])
+                publish_mark_counts(cur, [sid])
+                conn.commit()
+            bump_report_after_mark(conn, [sess['class_id']])
+            return jsonify({'success': True})
+    finally:
+        if conn is not None: conn.close()
+    
+    # Group commit: the connection is already back in the pool while this request waits for its batch
+    if writer.submit(sid, sess['class_id'], session['student_id'], lat, lon): return jsonify({'success': True})
+    return jsonify({'success': False, 'message': 'Could not save, please try again.'})
+
+@app.context_processor
+def live_settings():
+    return {'live_poll': 0 if LIVE_STREAM else LIVE_POLL_INTERVAL}
+
+@app.route('/api/session/live')
+@login_required
+def session_live():
+    """The live session snapshot for one class (?class_id=), polled by dashboards when streams are off.
+    Between sessions it is answered from the cached active-session lookup, without a query."""
+    is_controller = session.get('role') == 'controller'
+    batch = None if is_controller else session.get('student_batch', 'ALL')
     conn = get_db()
     if not conn: return jsonify({'success': False})
     try:
-        with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
-            cur.execute("SELECT * FROM attendance_sessions WHERE id = %s AND is_active = TRUE", (sid,))
-            sess = cur.fetchone()
-            if not sess: return jsonify({'success': False, 'message': 'Session expired.'})
-            
-            # Security: Ensure student belongs to the batch of the session
-            if sess['batch_filter'] != 'ALL' and sess['batch_filter'] != session.get('student_batch'):
-                 return jsonify({'success': False, 'message': f"This session is for {sess['batch_filter']} students only."})
+        with conn.cursor() as cur:
+            class_id, _ = controller_class(cur) if is_controller else student_class(cur, live_batch=batch)
+            snapshot = class_id and session_snapshot(cur, class_id, batch=batch, student_id=session.get('student_id'))
+    finally: conn.close()
+    return jsonify({'success': True, 'session': snapshot})
 
-            dist = haversine(lat, lon, sess['session_lat'], sess['session_lon'])
-            if dist > GEOFENCE_RADIUS: 
-                return jsonify({'success': False, 'message': f'Too far ({int(dist)}m). Move closer.'})
-            
-            cur.execute("INSERT INTO attendance_records (session_id, student_id, timestamp, latitude, longitude, ip_address) VALUES (%s, %s, NOW(), %s, %s, 'Mobile') ON CONFLICT DO NOTHING",
-                       (sid, session['student_id'], lat, lon))
-            conn.commit()
-            return jsonify({'success': True})
+@app.route('/api/session/events')
+@login_required
+def session_events():
+    """Server-Sent Events: session start/end and live mark counts for one class (?class_id=)."""
+    if not LIVE_STREAM: return '', 204  # EventSource gives up on a 204; the page polls session_live instead
+    is_controller = session.get('role') == 'controller'
+    batch = None if is_controller else session.get('student_batch', 'ALL')
+    student_id = session.get('student_id')
+    start_listener()
+    
+    since = hub.parse_id(request.headers.get('Last-Event-ID'))
+    snapshot = None
+    conn = get_db()
+    if not conn: return 'System unavailable', 503
+    try:
+        with conn.cursor() as cur:
+            class_id, _ = controller_class(cur) if is_controller else student_class(cur, live_batch=batch)
+            if since is None:
+                since = hub.seq  # before the query, so nothing committed meanwhile is missed
+                snapshot = {'session': class_id and session_snapshot(cur, class_id, batch=batch, student_id=student_id)}
     finally: conn.close()
+    
+    def stream(since):
+        yield f"retry: 3000\n\n"
+        if snapshot is not None: yield sse_message(since, 'snapshot', snapshot)
+        deadline = time.monotonic() + SSE_MAX_STREAM
+        while time.monotonic() < deadline:
+            events = hub.wait(since, SSE_HEARTBEAT)
+            if not events:
+                yield ": ping\n\n"
+                continue
+            for seq, data in events:
+                since = seq
+                if sse_visible(data, class_id, batch): yield sse_message(seq, data['type'], data)
+    
+    return Response(stream(since), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 # --- Controller/Admin Routes ---
 
@@ -200,7 +1855,7 @@ def controller_login():
             session['role'] = 'controller'
             session['user_id'] = 1 
             return redirect(url_for('controller_dashboard'))
-    return render_template('student_auth.html', class_name=CLASS_NAME, is_admin=True)
+    return render_template('student_auth.html', class_name=DEFAULT_CLASS, is_admin=True)
 
 @app.route('/controller')
 def controller_dashboard():
@@ -209,21 +1864,21 @@ def controller_dashboard():
     conn = get_db()
     active_session = None
     dashboard_stats = {'total_classes': 0}
+    class_id, class_name, classes = None, None, []
     
     if conn:
-        with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
-            cur.execute("SELECT id FROM classes WHERE class_name = %s", (CLASS_NAME,))
-            res = cur.fetchone()
-            if res:
-                class_id = res[0]
-                cur.execute("SELECT id, end_time, batch_filter FROM attendance_sessions WHERE class_id = %s AND is_active = TRUE", (class_id,))
-                sess = cur.fetchone()
-                if sess: active_session = {'id': sess['id'], 'end_time': sess['end_time'].isoformat(), 'batch': sess['batch_filter']}
-                
-                cur.execute("SELECT COUNT(DISTINCT DATE(start_time AT TIME ZONE 'UTC')) FROM attendance_sessions WHERE class_id = %s AND is_active = FALSE", (class_id,))
-                dashboard_stats['total_classes'] = cur.fetchone()[0]
-        conn.close()
-    return render_template('admin_dashboard.html', class_name=CLASS_NAME, active_session=active_session, stats=dashboard_stats)
+        try:
+            with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
+                class_id, class_name = controller_class(cur)
+                if class_id:
+                    active_session = session_snapshot(cur, class_id)
+                    
+                    cur.execute("SELECT COUNT(DISTINCT att_date) FROM class_days WHERE class_id = %s", (class_id,))
+                    dashboard_stats['total_classes'] = cur.fetchone()[0]
+                # Class switcher, live classes flagged
+                classes = [(cid, name, bool(get_active_sessions(cur, cid))) for cid, name in get_classes(cur)]
+        finally: conn.close()
+    return render_template('admin_dashboard.html', class_name=class_name, class_id=class_id, classes=classes, active_session=active_session, stats=dashboard_stats, report_weeks=REPORT_WEEKS)
 
 @app.route('/api/session/start', methods=['POST'])
 def start_session():
@@ -238,34 +1893,57 @@ def start_session():
     if not admin_lat or not admin_lon: return jsonify({'success': False, 'message': 'GPS required.'})
 
     conn = get_db()
+    if not conn: return jsonify({'success': False, 'message': 'System unavailable'})
     try:
         with conn.cursor() as cur:
-            cur.execute("SELECT id FROM classes WHERE class_name = %s", (CLASS_NAME,))
-            class_id = cur.fetchone()[0]
-            
-            cur.execute("SELECT id FROM attendance_sessions WHERE is_active = TRUE")
-            if cur.fetchone(): return jsonify({'success': False, 'message': 'Session already active!'})
+            # Monitors can only start sessions for classes they are enrolled in
+            is_controller = session.get('role') == 'controller'
+            class_id, _ = controller_class(cur, data.get('class_id')) if is_controller else student_class(cur, data.get('class_id'))
+            if class_id is None: return jsonify({'success': False, 'message': 'No class selected.'})
 
             token = secrets.token_hex(4)
             # Controller ID is NULL for student monitors (anonymous start)
-            controller_id = session.get('user_id') if session.get('role') == 'controller' else None 
+            controller_id = session.get('user_id') if is_controller else None 
             
+            # A session of this class past end_time but not swept yet would hold the partial unique index
+            cur.execute(EXPIRED_CLASS_SESSION_SQL, (class_id,))
+            expired = cur.fetchall()
+            close_sessions(cur, expired)
+            # Other classes' sessions don't matter; the partial unique index refuses a second live one in this class
             cur.execute("""INSERT INTO attendance_sessions (class_id, controller_id, session_token, start_time, end_time, session_lat, session_lon, is_active, batch_filter) 
-                        VALUES (%s, %s, %s, NOW(), NOW() + interval '5 minutes', %s, %s, TRUE, %s)""", 
+                        VALUES (%s, %s, %s, NOW(), NOW() + interval '5 minutes', %s, %s, TRUE, %s)
+                        ON CONFLICT (class_id) WHERE is_active DO NOTHING
+                        RETURNING id, end_time, session_lat, session_lon""", 
                         (class_id, controller_id, token, admin_lat, admin_lon, batch_type))
+            row = cur.fetchone()
+            if row is None: return jsonify({'success': False, 'message': 'Session already active!'})
+            session_id, end_time, lat, lon = row
+            roster = sum(1 for r in get_roster(cur, class_id) if batch_type in ('ALL', r[3]))
+            signed = issue_session_token({'id': session_id, 'batch_filter': batch_type, 'session_lat': lat, 'session_lon': lon, 'end_time': end_time}, class_id)
+            publish_event(cur, {'type': 'start', 'class_id': class_id, 'id': session_id, 'end_time': end_time.isoformat(),
+                                'batch': batch_type, 'marked': False, 'marked_count': 0, 'roster': roster, 'token': signed})
+            invalidate(cur, 'active_session')
+            bump_report_version(cur, [class_id])
             conn.commit()
-            return jsonify({'success': True})
+            revocations.revoke([row[0] for row in expired])
+            return jsonify({'success': True, 'session_id': session_id})
     finally: conn.close()
 
 @app.route('/api/session/end', methods=['POST'])
 def end_session():
     # Monitors can also end session
     if session.get('role') != 'controller' and not session.get('is_monitor'): return jsonify({'success': False})
+    data = request.get_json(silent=True) or {}
     conn = get_db()
+    if not conn: return jsonify({'success': False, 'message': 'System unavailable'})
     try:
         with conn.cursor() as cur:
-            cur.execute("UPDATE attendance_sessions SET is_active = FALSE WHERE is_active = TRUE")
+            class_id, _ = controller_class(cur, data.get('class_id')) if session.get('role') == 'controller' else student_class(cur, data.get('class_id'))
+            cur.execute("UPDATE attendance_sessions SET is_active = FALSE WHERE class_id = %s AND is_active = TRUE RETURNING id, class_id", (class_id,))
+            ended = cur.fetchall()
+            close_sessions(cur, ended)
             conn.commit()
+            revocations.revoke([row[0] for row in ended])
             return jsonify({'success': True})
     finally: conn.close()
 
@@ -274,39 +1952,113 @@ def end_session():
 @app.route('/controller/edit_attendance')
 def edit_attendance_landing():
     if session.get('role') != 'controller': return redirect(url_for('controller_login'))
-    return render_template('edit_attendance_day_select.html', class_name=CLASS_NAME)
+    conn = get_db()
+    if not conn: return 'System unavailable', 503
+    try:
+        with conn.cursor() as cur: class_id, class_name = controller_class(cur)
+    finally: conn.close()
+    return render_template('edit_attendance_day_select.html', class_name=class_name, class_id=class_id)
+
+def get_archived_terms(cur):
+    """Archived terms as (name, starts, ends). Their sessions and marks have left the live tables."""
+    def load():
+        cur.execute("SELECT to_regclass('terms') IS NOT NULL")
+        if not cur.fetchone()[0]: return []  # term-archive has never run here
+        cur.execute("SELECT name, starts, ends FROM terms WHERE archived_at IS NOT NULL ORDER BY starts")
+        return [tuple(row) for row in cur.fetchall()]
+    return cache.get(('terms',), load, CACHE_TTL)
+
+def archived_term(cur, date_str):
+    """Name of the archived term a YYYY-MM-DD day falls in (its attendance is read-only), or None."""
+    try: day = datetime.strptime(date_str, '%Y-%m-%d').date()
+    except (TypeError, ValueError): return None
+    return next((name for name, starts, ends in get_archived_terms(cur) if starts <= day <= ends), None)
+
+# The DATE(start_time AT TIME ZONE 'UTC') filters match the attendance_sessions_class_day expression index
+DAY_PRESENT_SQL = """
+    SELECT DISTINCT r.student_id FROM attendance_records r
+    JOIN attendance_sessions s ON r.session_id = s.id
+    WHERE s.class_id = %s AND DATE(s.start_time AT TIME ZONE 'UTC') = %s
+"""
+DAY_SESSION_SQL = "SELECT id FROM attendance_sessions WHERE class_id = %s AND DATE(start_time AT TIME ZONE 'UTC') = %s ORDER BY id LIMIT 1"
 
 @app.route('/controller/edit_attendance/<date_str>')
 def edit_attendance_for_day(date_str):
     if session.get('role') != 'controller': return redirect(url_for('controller_login'))
     conn = get_db()
+    if not conn: return 'System unavailable', 503
     data = []
     try:
         with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
-            cur.execute("SELECT id FROM classes WHERE class_name = %s", (CLASS_NAME,))
-            class_id = cur.fetchone()[0]
-            
-            # Find all session IDs for that date
-            cur.execute("""
-                SELECT id FROM attendance_sessions 
-                WHERE class_id = %s AND DATE(start_time AT TIME ZONE 'UTC') = %s
-            """, (class_id, date_str))
-            session_ids = [row['id'] for row in cur.fetchall()]
+            class_id, class_name = controller_class(cur)
+            term = archived_term(cur, date_str)
+            if term: return f'{date_str} is in {term}, which has been archived (read-only).', 409
             
-            # Fetch students and check if they were present in ANY session on that day
-            cur.execute("""
-                SELECT s.id, s.name, s.enrollment_no, s.batch,
-                       CASE WHEN r.session_id IS NOT NULL THEN TRUE ELSE FALSE END as present
-                FROM students s
-                LEFT JOIN attendance_records r ON s.id = r.student_id AND r.session_id = ANY(%s)
-                ORDER BY s.enrollment_no
-            """, (session_ids,))
+            # Students present in ANY session of that day
+            cur.execute(DAY_PRESENT_SQL, (class_id, date_str))
+            present_ids = {row['student_id'] for row in cur.fetchall()}
             
-            students = cur.fetchall()
-            data = [{'id': s['id'], 'name': s['name'], 'roll': s['enrollment_no'], 'batch': s['batch'], 'present': s['present']} for s in students]
+            data = [{'id': sid, 'name': name, 'roll': roll, 'batch': batch, 'present': sid in present_ids} for sid, roll, name, batch in get_roster(cur, class_id)]
             
     finally: conn.close()
-    return render_template('edit_attendance_for_day.html', class_name=CLASS_NAME, attendance_date=date_str, students=data)
+    return render_template('edit_attendance_for_day.html', class_name=class_name, class_id=class_id, attendance_date=date_str, students=data)
+
+def apply_day_changes(cur, class_id, date_str, present_ids, absent_ids, controller_id):
+    """Set-based present/absent update for one day. Returns {student_id: 'added'|'removed'|'unchanged'}."""
+    # Find ANY existing session
+    cur.execute(DAY_SESSION_SQL, (class_id, date_str))
+    res = cur.fetchone()
+    
+    if res:
+        target_session_id = res[0]
+    elif present_ids:
+        # If no session existed, create a "Dummy/Manual" session so we can attach the records
+        cur.execute("""
+            INSERT INTO attendance_sessions (class_id, controller_id, session_token, start_time, end_time, is_active, batch_filter)
+            VALUES (%s, %s, %s, %s::date + interval '12 hours', %s::date + interval '12 hours', FALSE, 'ALL')
+            RETURNING id
+        """, (class_id, controller_id, f'MANUAL_EDIT_{class_id}_{date_str}', date_str, date_str))
+        target_session_id = cur.fetchone()[0]
+        rollup_close_sessions(cur, [target_session_id])
+    else:
+        return {sid: 'unchanged' for sid in absent_ids}
+    
+    results = {sid: 'unchanged' for sid in (*present_ids, *absent_ids)}
+    if present_ids:
+        cur.execute("""
+            INSERT INTO attendance_records (session_id, student_id, timestamp, ip_address)
+            SELECT %s, sid, NOW(), 'Manual Edit' FROM unnest(%s::int[]) AS sid
+            WHERE NOT EXISTS (
+                SELECT 1 FROM attendance_records r JOIN attendance_sessions s ON r.session_id = s.id
+                WHERE r.student_id = sid AND s.class_id = %s AND DATE(s.start_time AT TIME ZONE 'UTC') = %s
+            )
+            ON CONFLICT (session_id, student_id) DO NOTHING
+            RETURNING student_id
+        """, (target_session_id, list(present_ids), class_id, date_str))
+        results.update((row[0], 'added') for row in cur.fetchall())
+        rollup_add(cur, target_session_id, present_ids)
+    if absent_ids:
+        cur.execute("""
+            DELETE FROM attendance_records
+            WHERE student_id = ANY(%s::int[]) AND session_id IN (
+                SELECT id FROM attendance_sessions WHERE class_id = %s AND DATE(start_time AT TIME ZONE 'UTC') = %s
+            )
+            RETURNING student_id
+        """, (list(absent_ids), class_id, date_str))
+        results.update((row[0], 'removed') for row in cur.fetchall())
+        rollup_remove(cur, class_id, date_str, absent_ids)
+    return results
+
+def parse_day_changes(items):
+    """Validate [{'date', 'present': [...], 'absent': [...]}, ...] into {date_str: (present_ids, absent_ids)}."""
+    days = {}
+    for item in items:
+        date_str = datetime.strptime(item['date'], '%Y-%m-%d').strftime('%Y-%m-%d')
+        present, absent = days.setdefault(date_str, (set(), set()))
+        present.update(int(sid) for sid in item.get('present', []))
+        absent.update(int(sid) for sid in item.get('absent', []))
+        if present & absent: raise ValueError(f'Student listed as both present and absent on {date_str}')
+    return {d: (sorted(p), sorted(a)) for d, (p, a) in days.items()}
 
 @app.route('/api/update_daily_attendance', methods=['POST'])
 def update_daily_attendance():
@@ -315,99 +2067,152 @@ def update_daily_attendance():
     date_str, student_id, is_present = data.get('date'), data.get('student_id'), data.get('is_present')
     
     conn = get_db()
+    if not conn: return jsonify({'success': False, 'message': 'System unavailable'})
     try:
         with conn.cursor() as cur:
-            cur.execute("SELECT id FROM classes WHERE class_name = %s", (CLASS_NAME,))
-            class_id = cur.fetchone()[0]
-            
-            # Find ANY existing session
-            cur.execute("SELECT id FROM attendance_sessions WHERE class_id = %s AND DATE(start_time AT TIME ZONE 'UTC') = %s LIMIT 1", (class_id, date_str))
-            res = cur.fetchone()
-            
-            if res:
-                target_session_id = res[0]
-            else:
-                # If no session existed, create a "Dummy/Manual" session so we can attach the record
-                cur.execute("""
-                    INSERT INTO attendance_sessions (class_id, controller_id, session_token, start_time, end_time, is_active, batch_filter)
-                    VALUES (%s, %s, 'MANUAL_EDIT', %s::date + interval '12 hours', %s::date + interval '12 hours', FALSE, 'ALL')
-                    RETURNING id
-                """, (class_id, session['user_id'], date_str, date_str))
-                target_session_id = cur.fetchone()[0]
-
-            if is_present:
-                cur.execute("INSERT INTO attendance_records (session_id, student_id, timestamp, ip_address) VALUES (%s, %s, NOW(), 'Manual Edit') ON CONFLICT (session_id, student_id) DO NOTHING", (target_session_id, student_id))
-            else:
-                cur.execute("""
-                    DELETE FROM attendance_records 
-                    WHERE student_id = %s AND session_id IN (
-                        SELECT id FROM attendance_sessions WHERE class_id = %s AND DATE(start_time AT TIME ZONE 'UTC') = %s
-                    )
-                """, (student_id, class_id, date_str))
-                
+            class_id, _ = controller_class(cur, data.get('class_id'))
+            term = archived_term(cur, date_str)
+            if term: return jsonify({'success': False, 'message': f'{date_str} is in {term}, which has been archived.'})
+            sid = int(student_id)
+            apply_day_changes(cur, class_id, date_str, [sid] if is_present else [], [] if is_present else [sid], session['user_id'])
+            bump_report_version(cur, [class_id])
             conn.commit()
             return jsonify({'success': True})
     finally: conn.close()
 
+@app.route('/api/update_daily_attendance/bulk', methods=['POST'])
+def update_daily_attendance_bulk():
+    """Apply the whole present/absent diff for one or more dates in a single transaction.
+    Body: {"date", "present": [ids], "absent": [ids]} or {"days": [{...}, ...]}, plus optional "class_id"."""
+    if session.get('role') != 'controller': return jsonify({'success': False})
+    data = request.json or {}
+    try:
+        days = parse_day_changes(data['days'] if 'days' in data else [data])
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({'success': False, 'message': f'Invalid request: {e}'}), 400
+    
+    conn = get_db()
+    if not conn: return jsonify({'success': False, 'message': 'System unavailable'})
+    try:
+        with conn.cursor() as cur:
+            class_id, _ = controller_class(cur, data.get('class_id'))
+            archived = {d: archived_term(cur, d) for d in days}
+            if any(archived.values()):
+                return jsonify({'success': False, 'message': ', '.join(f'{d} is in {t}, which has been archived.' for d, t in archived.items() if t)})
+            results = {d: apply_day_changes(cur, class_id, d, present, absent, session['user_id']) for d, (present, absent) in days.items()}
+            bump_report_version(cur, [class_id])
+            conn.commit()
+            return jsonify({'success': True, 'results': results})
+    finally: conn.close()
+
 @app.route('/report')
 def report():
+    """Student x date matrix. Optional ?from=&to= or ?weeks= window and ?batch=; cached per report version."""
     if session.get('role') != 'controller': return redirect(url_for('controller_login'))
+    try: window = report_window(request.args)
+    except ValueError: return 'Dates must be YYYY-MM-DD', 400
     conn = get_db()
+    if not conn: return 'System unavailable', 503
     try:
-        with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
-            cur.execute("SELECT id FROM classes WHERE class_name = %s", (CLASS_NAME,))
-            class_id = cur.fetchone()[0]
-            
-            # Get Dates
-            cur.execute("SELECT DISTINCT DATE(start_time AT TIME ZONE 'UTC') as s_date FROM attendance_sessions WHERE class_id = %s ORDER BY s_date DESC", (class_id,))
-            dates = [row['s_date'].strftime('%Y-%m-%d') for row in cur.fetchall()]
-            
-            # FAST QUERY: Get all attendance at once
-            cur.execute("""
-                SELECT s.name, s.enrollment_no, s.batch,
-                       ARRAY_AGG(DISTINCT DATE(ses.start_time AT TIME ZONE 'UTC')) FILTER (WHERE r.session_id IS NOT NULL) as present_dates
-                FROM students s
-                LEFT JOIN attendance_records r ON s.id = r.student_id
-                LEFT JOIN attendance_sessions ses ON r.session_id = ses.id AND ses.class_id = %s
-                GROUP BY s.id
-                ORDER BY s.batch, s.enrollment_no
-            """, (class_id,))
-            
-            students = cur.fetchall()
-            
-            report_data = []
-            for s in students:
-                present_set = set([d.strftime('%Y-%m-%d') for d in s['present_dates']]) if s['present_dates'] else set()
-                attendance_map = []
-                days_present = 0
-                for d in dates:
-                    if d in present_set:
-                        attendance_map.append('P')
-                        days_present += 1
-                    else:
-                        attendance_map.append('A')
-                
-                total = len(dates)
-                percent = round((days_present / total * 100)) if total > 0 else 0
-                report_data.append({
-                    'name': s['name'], 'roll': s['enrollment_no'], 'batch': s['batch'],
-                    'attendance': attendance_map, 'total_present': days_present, 'percent': percent
-                })
-
-            return render_template('attendance_report.html', dates=[d[5:] for d in dates], full_dates=dates, report=report_data, class_name=CLASS_NAME)
+        with conn.cursor() as cur:
+            class_id, class_name = controller_class(cur)
+            def build():
+                dates, rows = report_matrix(cur, class_id, *window)
+                start, end, batch = window
+                older, newer = report_pager(start, end, datetime.now(timezone.utc).date())
+                batches = sorted({r[3] for r in get_roster(cur, class_id)})
+                return render_template('attendance_report.html', dates=[d[5:] for d in dates], full_dates=dates, report=rows,
+                                       class_name=class_name, class_id=class_id, start=start, end=end, batch=batch,
+                                       batches=batches, older=older, newer=newer, report_weeks=REPORT_WEEKS)
+            return cached_report(cur, class_id, 'html', window, build, 'text/html')
+    finally: conn.close()
+
+@app.route('/api/report')
+def report_json():
+    """The /report matrix as JSON, with the same window/batch parameters, caching and validators."""
+    if session.get('role') != 'controller': return jsonify({'success': False})
+    try: window = report_window(request.args)
+    except ValueError: return jsonify({'success': False, 'message': 'Dates must be YYYY-MM-DD'}), 400
+    conn = get_db()
+    if not conn: return jsonify({'success': False, 'message': 'System unavailable'})
+    try:
+        with conn.cursor() as cur:
+            class_id, class_name = controller_class(cur)
+            def build():
+                dates, rows = report_matrix(cur, class_id, *window)
+                start, end, batch = window
+                return json.dumps({'success': True, 'class_id': class_id, 'class_name': class_name,
+                                   'from': start and start.isoformat(), 'to': end and end.isoformat(), 'batch': batch,
+                                   'dates': dates, 'students': rows})
+            return cached_report(cur, class_id, 'json', window, build, 'application/json')
+    finally: conn.close()
+
+@app.route('/report/export')
+def report_export():
+    """Same matrix as /report as CSV or XLSX, streamed. Optional ?from=&to= (YYYY-MM-DD) or ?weeks=, and ?batch=."""
+    if session.get('role') != 'controller': return redirect(url_for('controller_login'))
+    fmt = request.args.get('format', 'csv').lower()
+    if fmt not in EXPORT_FORMATS: return 'Unsupported format', 400
+    try: start, end, batch = report_window(request.args)
+    except ValueError: return 'Dates must be YYYY-MM-DD', 400
+    
+    conn = get_db()
+    if not conn: return 'System unavailable', 503
+    try:
+        with conn.cursor() as cur:
+            class_id, class_name = controller_class(cur)
+            dates = get_report_dates(cur, class_id, start, end, batch)
+    except Exception:
+        conn.close()
+        raise
+    
+    writer, mimetype = EXPORT_FORMATS[fmt]
+    header = ['Name', 'Roll No', 'Batch', *dates, 'Days Present', 'Percent']
+    def generate(): yield from writer(header, export_rows(conn, class_id, dates, start, end, batch))
+    
+    filename = f"attendance_{secure_filename(class_name)}_{start or 'start'}_{end or 'today'}{'_' + batch if batch else ''}.{fmt}"
+    resp = Response(generate(), mimetype=mimetype, headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+    # The connection stays checked out until the last chunk is sent or the client goes away. Released
+    # when the server closes the response (once), not in generate(): a HEAD never starts the generator.
+    resp.call_on_close(conn.close)
+    return resp
+
+@app.route('/api/audit/geofence')
+def geofence_audit_view():
+    """Per-session GPS audit of stored marks. ?session_id= or ?from=&to=, optional ?radius= to
+    re-validate against a different geofence."""
+    if session.get('role') != 'controller': return jsonify({'success': False})
+    try:
+        start, end = [datetime.strptime(request.args[k], '%Y-%m-%d').date() if request.args.get(k) else None for k in ('from', 'to')]
+        session_id = request.args.get('session_id', type=int)
+        radius = float(request.args.get('radius', GEOFENCE_RADIUS))
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Invalid filters.'}), 400
+    
+    conn = get_db()
+    if not conn: return jsonify({'success': False, 'message': 'System unavailable'})
+    try:
+        with conn.cursor() as cur:
+            records, session_dates = load_audit_records(cur, controller_class(cur)[0], session_id, start, end)
     finally: conn.close()
+    dist, flags = geofence_audit(records, radius)
+    return jsonify({'success': True, 'radius': radius, 'marks': len(dist),
+                    'totals': {name: int(f.sum()) for name, f in flags.items()},
+                    'sessions': geofence_report(records, session_dates, dist, flags)})
 
 @app.route('/api/get_students_for_manual_edit/<int:session_id>')
 def get_students_manual(session_id):
     if session.get('role') != 'controller': return jsonify({'success': False})
     conn = get_db()
+    if not conn: return jsonify({'success': False, 'message': 'System unavailable'})
     try:
         with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
-            cur.execute("SELECT id, name, enrollment_no FROM students ORDER BY enrollment_no")
-            all_students = cur.fetchall()
+            cur.execute("SELECT class_id FROM attendance_sessions WHERE id = %s", (session_id,))
+            row = cur.fetchone()
+            if not row: return jsonify({'success': False, 'message': 'Session not found.'})
             cur.execute("SELECT student_id FROM attendance_records WHERE session_id = %s", (session_id,))
             present_ids = {row['student_id'] for row in cur.fetchall()}
-            student_list = [{'id': s['id'], 'name': s['name'], 'enrollment_no': s['enrollment_no'], 'is_present': s['id'] in present_ids} for s in all_students]
+            student_list = [{'id': sid, 'name': name, 'enrollment_no': roll, 'is_present': sid in present_ids} for sid, roll, name, batch in get_roster(cur, row['class_id'])]
             return jsonify({'success': True, 'students': student_list})
     finally: conn.close()
 
@@ -416,17 +2221,326 @@ def manual_mark_attendance():
     if session.get('role') != 'controller': return jsonify({'success': False})
     data = request.json
     conn = get_db()
+    if not conn: return jsonify({'success': False, 'message': 'System unavailable'})
     try:
         with conn.cursor() as cur:
             cur.execute("INSERT INTO attendance_records (session_id, student_id, timestamp, ip_address) VALUES (%s, %s, NOW(), 'Manual') ON CONFLICT DO NOTHING", (data['session_id'], data['student_id']))
+            rollup_add(cur, data['session_id'], [data['student_id']])
+            publish_mark_counts(cur, [data['session_id']])
+            bump_report_version(cur, session_ids=[data['session_id']])
             conn.commit()
             return jsonify({'success': True})
     finally: conn.close()
 
+@app.route('/api/pool_stats')
+def pool_stats():
+    if session.get('role') != 'controller': return jsonify({'success': False})
+    return jsonify({'success': True, 'pool': get_pool().stats()})
+
+@app.route('/api/mark_writer_stats')
+def mark_writer_stats():
+    if session.get('role') != 'controller': return jsonify({'success': False})
+    writer = get_mark_writer()
+    if writer is None: return jsonify({'success': True, 'enabled': False})
+    return jsonify({'success': True, 'enabled': True, 'queued': writer.queue.qsize(), **writer.counters})
+
+@app.route('/api/cache_stats')
+def cache_stats():
+    if session.get('role') != 'controller': return jsonify({'success': False})
+    return jsonify({'success': True, 'cache': cache.stats()})
+
+@app.route('/metrics')
+def metrics_endpoint():
+    if not METRICS: return 'Metrics are disabled (set METRICS=1).', 404
+    auth = request.headers.get('Authorization', '')
+    scraper = METRICS_TOKEN and hmac.compare_digest(auth.encode(), f'Bearer {METRICS_TOKEN}'.encode())
+    if not scraper and session.get('role') != 'controller':
+        return Response('Unauthorized', 401, {'WWW-Authenticate': 'Bearer'})
+    pool = get_pool().stats()  # this worker's pool only; counters and histograms cover every worker with METRICS_DIR
+    gauges = [('app_db_pool_size', 'Open pooled connections.', pool['size']),
+              ('app_db_pool_in_use', 'Pooled connections checked out.', pool['in_use']),
+              ('app_db_pool_timeouts', 'Checkouts that gave up after DB_POOL_TIMEOUT.', pool['timeouts'])]
+    return Response(render_metrics(metrics.collect(), gauges), mimetype='text/plain; version=0.0.4')
+
 @app.route('/student/logout')
 def logout():
     session.clear()
     return redirect(url_for('home'))
 
+# --- Maintenance Commands ---
+
+@app.cli.command('rollup-rebuild')
+def rollup_rebuild_command():
+    """Recompute the attendance rollup from attendance_records / attendance_sessions."""
+    conn = get_db()
+    if not conn: sys.exit("System unavailable")
+    try:
+        with conn.cursor() as cur:
+            cur.execute(ROLLUP_SCHEMA)
+            cur.execute("LOCK TABLE attendance_records, attendance_sessions IN SHARE MODE")  # no marks land mid-rebuild
+            cur.execute("TRUNCATE daily_attendance, attendance_totals, class_days")
+            for table, source in ROLLUP_SOURCES.items():
+                cur.execute(f"INSERT INTO {table} ({ROLLUP_COLUMNS[table]}) {source}")
+                click.echo(f"{table}: {cur.rowcount} rows")
+            cur.execute("SELECT id FROM classes")
+            bump_report_version(cur, [row[0] for row in cur.fetchall()])
+            conn.commit()
+    finally: conn.close()
+
+@app.cli.command('rollup-verify')
+@click.option('--repair', is_flag=True, help='Rebuild the rollup if any drift is found.')
+@click.pass_context
+def rollup_verify_command(ctx, repair):
+    """Compare the rollup against the raw tables; exits non-zero on drift."""
+    conn = get_db()
+    if not conn: sys.exit("System unavailable")
+    try:
+        with conn.cursor() as cur: drift = rollup_drift(cur)
+    finally: conn.close()
+    for table, d in drift.items(): click.echo(f"{table}: {d['missing']} missing, {d['extra']} extra")
+    if any(d['missing'] or d['extra'] for d in drift.values()):
+        if repair: ctx.invoke(rollup_rebuild_command)
+        else: sys.exit(1)
+
+# Brings a database created before enrollments up to date; fresh ones get this from database_setup_anthro.sql
+CLASS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS enrollments (
+    class_id INT NOT NULL REFERENCES classes(id) ON DELETE CASCADE,
+    student_id INT NOT NULL REFERENCES students(id) ON DELETE CASCADE,
+    PRIMARY KEY (class_id, student_id)
+);
+CREATE INDEX IF NOT EXISTS enrollments_student_idx ON enrollments (student_id);
+CREATE UNIQUE INDEX IF NOT EXISTS attendance_sessions_active_class ON attendance_sessions (class_id) WHERE is_active;
+"""
+
+@app.cli.command('class-enroll')
+@click.argument('class_name')
+@click.argument('enrollment_nos', nargs=-1)
+@click.option('--batch', help='Also select every student of this batch (BA, BSC, or ALL for everyone).')
+@click.option('--remove', is_flag=True, help='Unenroll the selected students instead.')
+def class_enroll_command(class_name, enrollment_nos, batch, remove):
+    """Create CLASS_NAME if it doesn't exist and enroll students by enrollment number and/or --batch."""
+    enrollment_nos = [e.strip().upper() for e in enrollment_nos]
+    batch = batch.upper() if batch else None
+    conn = get_db()
+    if not conn: sys.exit("System unavailable")
+    try:
+        with conn.cursor() as cur:
+            cur.execute(CLASS_SCHEMA)
+            cur.execute("INSERT INTO classes (class_name) VALUES (%s) ON CONFLICT (class_name) DO NOTHING", (class_name,))
+            cur.execute("SELECT id FROM classes WHERE class_name = %s", (class_name,))
+            class_id = cur.fetchone()[0]
+            cur.execute("SELECT e FROM unnest(%s::text[]) AS e EXCEPT SELECT enrollment_no FROM students", (enrollment_nos,))
+            for (missing,) in cur.fetchall(): click.echo(f"Unknown enrollment number: {missing}")
+            selected = "SELECT id FROM students WHERE enrollment_no = ANY(%s::text[]) OR %s::text = 'ALL' OR batch = %s"
+            if remove:
+                cur.execute(f"DELETE FROM enrollments WHERE class_id = %s AND student_id IN ({selected})", (class_id, enrollment_nos, batch, batch))
+            else:
+                cur.execute(f"INSERT INTO enrollments (class_id, student_id) SELECT %s, id FROM ({selected}) s ON CONFLICT DO NOTHING", (class_id, enrollment_nos, batch, batch))
+            changed = cur.rowcount
+            invalidate(cur, 'classes', 'roster', 'enrollment')
+            bump_report_version(cur, [class_id])
+            conn.commit()
+            cur.execute("SELECT COUNT(*) FROM enrollments WHERE class_id = %s", (class_id,))
+            click.echo(f"{class_name}: {changed} {'removed' if remove else 'added'}, {cur.fetchone()[0]} enrolled")
+    finally: conn.close()
+
+# Session indexes for a database created before them; fresh ones get these from database_setup_anthro.sql
+SESSION_SCHEMA = """
+CREATE UNIQUE INDEX IF NOT EXISTS attendance_sessions_active_class ON attendance_sessions (class_id) WHERE is_active;
+CREATE INDEX IF NOT EXISTS attendance_sessions_active_end ON attendance_sessions (end_time) WHERE is_active;
+CREATE INDEX IF NOT EXISTS attendance_sessions_class_day ON attendance_sessions (class_id, (DATE(start_time AT TIME ZONE 'UTC')));
+"""
+
+@app.cli.command('sweep-sessions')
+@click.option('--batch', default=SESSION_SWEEP_BATCH, show_default=True, help='Sessions closed per transaction.')
+def sweep_sessions_command(batch):
+    """Close every session past its end_time now (workers also do this every SESSION_SWEEP_INTERVAL seconds)."""
+    click.echo(f"{sweep_sessions(batch)} expired sessions closed")
+
+# Lookups that must stay index probes however much history piles up: (name, statement, sample parameters)
+PLAN_CHECKS = [
+    ('active session', ACTIVE_SESSIONS_SQL, (1,)),
+    ('session by id', SESSION_BY_ID_SQL, (1,)),
+    ('expired sessions', EXPIRED_SESSIONS_SQL, (SESSION_SWEEP_BATCH,)),
+    ('expired class session', EXPIRED_CLASS_SESSION_SQL, (1,)),
+    ('day present', DAY_PRESENT_SQL, (1, '2000-01-01')),
+    ('day session', DAY_SESSION_SQL, (1, '2000-01-01')),
+    ('session marks', SESSION_MARKS_SQL, (1, 1)),
+    ('student login', STUDENT_LOGIN_SQL, ('X',)),
+    ('student classes', STUDENT_CLASSES_SQL, (1,)),
+    ('dashboard stats', DASHBOARD_STATS_SQL, (1, 'ALL', 1, 1)),
+]
+
+def plan_scans(plan, partial_indexes=()):
+    """(node type, relation, index, probed) of every table/index scan in an EXPLAIN (FORMAT JSON) plan tree.
+    probed is False for a Seq Scan or for walking a whole index without an index condition, unless the
+    index is partial (e.g. live sessions only), which keeps the walk as small as its predicate."""
+    scans = []
+    if plan['Node Type'].endswith('Scan') and ('Relation Name' in plan or 'Index Name' in plan):
+        probed = 'Index Cond' in plan or plan['Node Type'] == 'Bitmap Heap Scan' or plan.get('Index Name') in partial_indexes
+        scans.append((plan['Node Type'], plan.get('Relation Name'), plan.get('Index Name'), probed))
+    for child in plan.get('Plans', ()): scans += plan_scans(child, partial_indexes)
+    return scans
+
+def explain_plan_checks(cur):
+    """[(name, scans, ok)] for the PLAN_CHECKS lookups, EXPLAINed with sequential scans (and hash/merge joins,
+    which tempt the planner into whole-index walks on small tables) disabled for the rest of the transaction.
+    ok is False if the lookup still scans a whole table or index, i.e. no index can serve it."""
+    for setting in ('enable_seqscan', 'enable_hashjoin', 'enable_mergejoin'): cur.execute(f"SET LOCAL {setting} = off")
+    cur.execute("SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE i.indpred IS NOT NULL")
+    partial = {row[0] for row in cur.fetchall()}
+    results = []
+    for name, sql, params in PLAN_CHECKS:
+        cur.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+        scans = plan_scans(cur.fetchone()[0][0]['Plan'], partial)
+        results.append((name, scans, all(probed for *_, probed in scans)))
+    return results
+
+@app.cli.command('check-plans')
+@click.option('--fix', is_flag=True, help='Create the session indexes if missing before checking.')
+def check_plans_command(fix):
+    """EXPLAIN the PLAN_CHECKS lookups (see explain_plan_checks); exits non-zero if no index serves one of them."""
+    conn = get_db()
+    if not conn: sys.exit("System unavailable")
+    failed = []
+    try:
+        with conn.cursor() as cur:
+            if fix:
+                cur.execute(SESSION_SCHEMA)
+                conn.commit()
+            for name, scans, ok in explain_plan_checks(cur):
+                if not ok: failed.append(name)
+                click.echo(f"{'ok' if ok else 'FAIL':<4}  {name:<22} " + ', '.join(
+                    f"{node} on {rel or index}" + (f" using {index}" if rel and index else '') + ('' if probed else ' (full)')
+                    for node, rel, index, probed in scans))
+        conn.rollback()
+    finally: conn.close()
+    if failed: sys.exit(f"No index serves: {', '.join(failed)}")
+
+# --- Terms & Archive ---
+# The live tables hold the open term(s) only, so every query above (reports, dashboards, day edits)
+# works on the current term without naming it. term-archive moves a closed term into its own
+# partition of each archive table, marked read-only; the live rollup forgets it at the same time.
+ARCHIVE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS terms (
+    id SERIAL PRIMARY KEY,
+    name VARCHAR(50) UNIQUE NOT NULL,
+    starts DATE NOT NULL,
+    ends DATE NOT NULL CHECK (ends >= starts),
+    archived_at TIMESTAMPTZ
+);
+CREATE TABLE IF NOT EXISTS archived_sessions (
+    term_id INT NOT NULL REFERENCES terms(id),
+    id INT NOT NULL,
+    class_id INT NOT NULL REFERENCES classes(id),
+    start_time TIMESTAMPTZ NOT NULL,
+    end_time TIMESTAMPTZ NOT NULL,
+    session_lat REAL,
+    session_lon REAL,
+    batch_filter VARCHAR(10) NOT NULL,
+    PRIMARY KEY (term_id, id)
+) PARTITION BY LIST (term_id);
+CREATE TABLE IF NOT EXISTS archived_records (
+    term_id INT NOT NULL,
+    session_id INT NOT NULL,
+    student_id INT NOT NULL REFERENCES students(id),
+    timestamp TIMESTAMPTZ NOT NULL,
+    latitude REAL,
+    longitude REAL,
+    PRIMARY KEY (term_id, session_id, student_id),
+    FOREIGN KEY (term_id, session_id) REFERENCES archived_sessions (term_id, id)
+) PARTITION BY LIST (term_id);
+CREATE TABLE IF NOT EXISTS archived_attendance (
+    term_id INT NOT NULL,
+    class_id INT NOT NULL REFERENCES classes(id),
+    att_date DATE NOT NULL,
+    student_id INT NOT NULL REFERENCES students(id),
+    PRIMARY KEY (term_id, class_id, att_date, student_id)
+) PARTITION BY LIST (term_id);
+CREATE OR REPLACE FUNCTION archive_read_only() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    RAISE EXCEPTION 'archived terms are read-only (%)', TG_TABLE_NAME;
+END $$;
+CREATE OR REPLACE TRIGGER archived_sessions_read_only BEFORE UPDATE OR DELETE ON archived_sessions FOR EACH ROW EXECUTE FUNCTION archive_read_only();
+CREATE OR REPLACE TRIGGER archived_records_read_only BEFORE UPDATE OR DELETE ON archived_records FOR EACH ROW EXECUTE FUNCTION archive_read_only();
+CREATE OR REPLACE TRIGGER archived_attendance_read_only BEFORE UPDATE OR DELETE ON archived_attendance FOR EACH ROW EXECUTE FUNCTION archive_read_only();
+"""
+ARCHIVE_TABLES = ('archived_sessions', 'archived_records', 'archived_attendance')
+
+# Each statement gets (term_id, starts, ends); a term's days are the sessions' UTC start dates, as everywhere else
+ARCHIVE_STEPS = {
+    'sessions': """
+        INSERT INTO archived_sessions (term_id, id, class_id, start_time, end_time, session_lat, session_lon, batch_filter)
+        SELECT %(term_id)s, id, class_id, start_time, end_time, session_lat, session_lon, batch_filter FROM attendance_sessions
+        WHERE DATE(start_time AT TIME ZONE 'UTC') BETWEEN %(starts)s AND %(ends)s""",
+    'records': """
+        WITH moved AS (
+            DELETE FROM attendance_records r USING attendance_sessions s
+            WHERE r.session_id = s.id AND DATE(s.start_time AT TIME ZONE 'UTC') BETWEEN %(starts)s AND %(ends)s
+            RETURNING r.session_id, r.student_id, r.timestamp, r.latitude, r.longitude
+        )
+        INSERT INTO archived_records (term_id, session_id, student_id, timestamp, latitude, longitude)
+        SELECT %(term_id)s, * FROM moved""",
+    'attendance totals': """
+        WITH moved AS (
+            DELETE FROM daily_attendance WHERE att_date BETWEEN %(starts)s AND %(ends)s RETURNING student_id, class_id, att_date
+        ), archived AS (
+            INSERT INTO archived_attendance (term_id, class_id, att_date, student_id) SELECT %(term_id)s, class_id, att_date, student_id FROM moved
+        )
+        UPDATE attendance_totals t SET days_present = t.days_present - m.n
+        FROM (SELECT student_id, class_id, COUNT(*) AS n FROM moved GROUP BY student_id, class_id) m
+        WHERE t.student_id = m.student_id AND t.class_id = m.class_id""",
+    'class days': "DELETE FROM class_days WHERE att_date BETWEEN %(starts)s AND %(ends)s",
+}
+
+@app.cli.command('term-archive')
+@click.argument('name')
+@click.option('--starts', type=click.DateTime(['%Y-%m-%d']), help='First day of the term (needed the first time NAME is used).')
+@click.option('--ends', type=click.DateTime(['%Y-%m-%d']), help='Last day of the term.')
+def term_archive_command(name, starts, ends):
+    """Move the closed term NAME out of the live tables into its own read-only archive partitions.
+    Idempotent: the move is one transaction, and re-running it for an archived term does nothing."""
+    starts, ends = (d.date() if d else None for d in (starts, ends))
+    sweep_sessions()  # sessions left open past end_time still count towards their day
+    conn = get_db()
+    if not conn: sys.exit("System unavailable")
+    try:
+        with conn.cursor() as cur:
+            cur.execute(ARCHIVE_SCHEMA)
+            cur.execute("SELECT id, starts, ends, archived_at FROM terms WHERE name = %s FOR UPDATE", (name,))
+            term = cur.fetchone()
+            if term is None:
+                if not (starts and ends): sys.exit(f"Unknown term {name}: give --starts and --ends")
+                cur.execute("INSERT INTO terms (name, starts, ends) VALUES (%s, %s, %s) RETURNING id, starts, ends, archived_at", (name, starts, ends))
+                term = cur.fetchone()
+            term_id, term_starts, term_ends, archived_at = term
+            if (starts or term_starts, ends or term_ends) != (term_starts, term_ends):
+                sys.exit(f"{name} runs {term_starts} to {term_ends}, not {starts or term_starts} to {ends or term_ends}")
+            if archived_at:
+                click.echo(f"{name} was archived on {archived_at:%Y-%m-%d}; nothing to do")
+                return
+            if term_ends >= datetime.now(timezone.utc).date(): sys.exit(f"{name} has not ended yet (last day {term_ends})")
+            cur.execute("SELECT name FROM terms WHERE id <> %s AND starts <= %s AND ends >= %s", (term_id, term_ends, term_starts))
+            overlapping = [row[0] for row in cur.fetchall()]
+            if overlapping: sys.exit(f"{name} overlaps {', '.join(overlapping)}")
+
+            cur.execute("LOCK TABLE attendance_records, attendance_sessions IN SHARE ROW EXCLUSIVE MODE")  # no marks or edits land mid-move
+            for table in ARCHIVE_TABLES:
+                cur.execute(f"CREATE TABLE IF NOT EXISTS {table}_t{term_id} PARTITION OF {table} FOR VALUES IN ({term_id})")
+            params = {'term_id': term_id, 'starts': term_starts, 'ends': term_ends}
+            for step, sql in ARCHIVE_STEPS.items():
+                cur.execute(sql, params)
+                click.echo(f"{step}: {cur.rowcount} rows")
+            cur.execute("""DELETE FROM attendance_sessions WHERE DATE(start_time AT TIME ZONE 'UTC') BETWEEN %(starts)s AND %(ends)s
+                           RETURNING class_id""", params)
+            class_ids = {row[0] for row in cur.fetchall()}
+            cur.execute("UPDATE terms SET archived_at = NOW() WHERE id = %s", (term_id,))
+            invalidate(cur, 'terms', 'active_session')
+            bump_report_version(cur, class_ids)
+            conn.commit()
+            click.echo(f"{name} ({term_starts} to {term_ends}) archived: {len(class_ids)} classes")
+    finally: conn.close()
+
 if __name__ == '__main__':
     app.run(port=5000)
\ No newline at end of file
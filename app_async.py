@@ -0,0 +1,432 @@
+"""Asyncio serving mode for the student hot paths, and the procfile's web process.
+
+    uvicorn app_async:app --host 0.0.0.0 --port $PORT --timeout-graceful-shutdown 10
+
+(uvicorn otherwise waits out every open event stream on shutdown; cut off, EventSource reconnects.) The worker
+count comes from WEB_CONCURRENCY, as does each worker's share of DB_CONN_LIMIT, so don't pass --workers.
+
+api_login, student_dashboard, mark_attendance and the live-session event stream run as coroutines on
+an asyncpg pool, so while a burst of students waits on Postgres the worker keeps accepting requests
+instead of parking a thread per request, and an open stream costs a coroutine rather than a thread
+(LIVE_STREAM is on by default here). Every other URL is the Flask app (app_anthro) mounted underneath on a thread pool. The
+URLs, the session cookie (Flask's own session interface signs and reads it) and the JSON bodies are
+the same as the sync app's, so templates and main.js don't change and the two can serve side by side
+(e.g. a proxy sending only the hot paths here). The statements and the checks are app_anthro's.
+MARK_BATCHING does not apply here: each mark is its own short transaction on the pool.
+The worker's share of DB_CONN_LIMIT is split between the two pools (and the LISTEN connection).
+"""
+import asyncio
+import contextlib
+import functools
+import itertools
+import math
+import os
+import re
+import time
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import asyncpg
+from a2wsgi import WSGIMiddleware
+from flask import render_template
+from starlette.applications import Starlette
+from starlette.responses import HTMLResponse, JSONResponse, PlainTextResponse, RedirectResponse, StreamingResponse
+from starlette.routing import Mount, Route
+
+import app_anthro
+from app_anthro import (
+    ACTIVE_SESSIONS_SQL, ACTIVE_SESSION_TTL, BUMP_REPORT_SQL, CACHE_CHANNEL, CACHE_TTL, CLASSES_SQL,
+    DASHBOARD_STATS_SQL, DATABASE_URL, DB_POOL_TIMEOUT, DB_QUERY_COUNT_HEADER, DB_WORKER_CONNS,
+    EVENTS_CHANNEL, LOGIN_INDEX_SQL, MARK_COUNTS_SQL, MARK_INSERT_SQL, METRICS, MISSING, NOTIFY_SQL,
+    PASSWORD_UPGRADE_SQL, ROLLUP_ADD_SQL, ROSTER_SQL, SESSION_BY_ID_SQL, SESSION_MARKS_SQL, SSE_HEARTBEAT,
+    SSE_MAX_STREAM, STUDENT_CLASSES_SQL, STUDENT_LOGIN_SQL, ClassRefused, Overloaded, PoolTimeout, RequestStats,
+    _request_stats, active_session_row, build_login_index, busy_body, cache, check_login, check_mark,
+    choose_class, controller_class_ids, get_kdf_pool, hash_password, hub, login_keys, login_throttle,
+    match_session, metrics, record_statement, refused_body, report_bumps, snapshot_dict, sse_message,
+    sse_visible, start_listener, student_session, throttle_message, verify_password, verify_session_token,
+)
+from app_anthro import app as flask_app
+
+# The worker's connections, less the listener's, are split: a quarter for the Flask pool behind the
+# mounted routes, the rest for the asyncpg pool serving the hot paths. Either side can be set instead.
+if 'DB_POOL_MAX' not in os.environ: app_anthro.DB_POOL_MAX = max(1, (DB_WORKER_CONNS - 1) // 4)
+ASYNC_DB_POOL_MAX = int(os.environ.get('ASYNC_DB_POOL_MAX', max(1, DB_WORKER_CONNS - 1 - app_anthro.DB_POOL_MAX)))
+ASYNC_DB_POOL_MIN = min(int(os.environ.get('ASYNC_DB_POOL_MIN', 2)), ASYNC_DB_POOL_MAX)
+app_anthro.LIVE_STREAM = os.environ.get('LIVE_STREAM', '1') == '1'  # streams are cheap on the event loop
+ASYNC_WSGI_THREADS = int(os.environ.get('ASYNC_WSGI_THREADS', 10))  # threads for the mounted Flask routes
+
+# --- Database ---
+@functools.lru_cache(maxsize=None)
+def pg(sql):
+    """psycopg2 placeholders (%s, %%) to asyncpg's ($1, $2, ...)."""
+    n = itertools.count(1)
+    return re.sub(r'%([s%])', lambda m: f'${next(n)}' if m.group(1) == 's' else '%', sql)
+
+def asyncpg_dsn(url):
+    """DATABASE_URL for asyncpg, which takes libpq's `options=-c name=value` as server settings instead."""
+    parts = urlsplit(url)
+    query, settings = [], {}
+    for key, value in parse_qsl(parts.query):
+        if key == 'options': settings.update(re.findall(r'-c\s*([^=\s]+)=(\S+)', value))
+        else: query.append((key, value))
+    return urlunsplit(parts._replace(query=urlencode(query))), settings
+
+class AsyncDB:
+    """A checked-out asyncpg connection running app_anthro's statements, counted and timed like its cursors."""
+    def __init__(self, conn): self.conn = conn
+
+    async def _run(self, method, sql, args):
+        stats = _request_stats.get()
+        start = time.perf_counter()
+        result = await getattr(self.conn, method)(pg(sql), *args)
+        if METRICS: record_statement(sql, self._rows(method, result), time.perf_counter() - start, stats)
+        elif stats is not None: stats.queries += 1
+        return result
+
+    @staticmethod
+    def _rows(method, result):
+        if method == 'fetch': return len(result)
+        if method == 'fetchrow': return int(result is not None)
+        tail = result.rsplit(' ', 1)[-1]  # execute() returns the command status, e.g. 'INSERT 0 1'
+        return int(tail) if tail.isdigit() else 0
+
+    async def fetch(self, sql, *args): return await self._run('fetch', sql, args)
+    async def fetchrow(self, sql, *args): return await self._run('fetchrow', sql, args)
+    async def execute(self, sql, *args): return await self._run('execute', sql, args)
+    def transaction(self): return self.conn.transaction()
+
+@contextlib.asynccontextmanager
+async def checkout(request):
+    """AsyncDB from the worker's pool, or None if the database is unreachable (like get_db())."""
+    state = request.app.state
+    start = time.perf_counter()
+    try:
+        # asyncpg's own wait queue lets a newcomer take a connection ahead of a woken waiter, which
+        # starves some requests under a burst; the (FIFO) semaphore hands connections out in order.
+        await asyncio.wait_for(state.gate.acquire(), DB_POOL_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise PoolTimeout()
+    try:
+        try: conn = await state.pool.acquire()
+        except (OSError, asyncpg.PostgresError) as e:
+            print(f"DB Connection Error: {e}")
+            yield None
+            return
+        if METRICS: metrics.observe('app_db_checkout_seconds', (), time.perf_counter() - start)
+        try: yield AsyncDB(conn)
+        finally: await state.pool.release(conn)
+    finally: state.gate.release()
+
+async def invalidate(db, *kinds):
+    cache.invalidate(*kinds)
+    await db.execute(NOTIFY_SQL, CACHE_CHANNEL, ','.join(kinds))
+
+async def bump_report_after_mark(db, class_ids):
+    """app_anthro.bump_report_after_mark() on an asyncpg connection; the claims are shared with the Flask app's marks."""
+    with report_bumps.bumping(class_ids) as mine:
+        if not mine: return
+        async with db.transaction():
+            await db.execute(BUMP_REPORT_SQL, mine, [])
+            await invalidate(db, 'report_version')
+            report_bumps.release(mine)
+
+# --- Cached reads (same keys and shapes as app_anthro's, so both fill one per-worker cache) ---
+async def cached(key, ttl, load):
+    value = cache.lookup(key)
+    if value is MISSING:
+        generation = cache.generation(key[0])
+        value = await load()
+        cache.put(key, value, ttl, generation=generation)
+    return value
+
+async def get_classes(db):
+    async def load(): return [tuple(row) for row in await db.fetch(CLASSES_SQL)]
+    return await cached(('classes',), CACHE_TTL, load)
+
+async def get_roster(db, class_id):
+    async def load(): return [tuple(row) for row in await db.fetch(ROSTER_SQL, class_id)]
+    return await cached(('roster', class_id), CACHE_TTL, load)
+
+async def get_student_classes(db, student_id):
+    async def load(): return [row[0] for row in await db.fetch(STUDENT_CLASSES_SQL, student_id)]
+    return await cached(('enrollment', student_id), CACHE_TTL, load)
+
+async def get_active_sessions(db, class_id):
+    async def load(): return [active_session_row(r, class_id) for r in await db.fetch(ACTIVE_SESSIONS_SQL, class_id)]
+    return await cached(('active_session', class_id), ACTIVE_SESSION_TTL, load)
+
+async def get_login_index(db, lock):
+    index = cache.lookup(('login_index',))
+    if index is MISSING:
+        async with lock:  # one load per worker, however many logins arrive at once
+            async def load(): return build_login_index(await db.fetch(LOGIN_INDEX_SQL))
+            index = await cached(('login_index',), CACHE_TTL, load)
+    return index
+
+async def find_student(db, lock, enrollment):
+    student = (await get_login_index(db, lock))[0].get(enrollment)
+    if student is None:
+        row = await db.fetchrow(STUDENT_LOGIN_SQL, enrollment)
+        student = build_login_index([row])[0][enrollment] if row else None
+    return student
+
+async def find_active_session(db, class_id, batch=None, session_id=None):
+    return match_session(await get_active_sessions(db, class_id), batch, session_id)
+
+async def session_snapshot(db, class_id, batch=None, student_id=None):
+    sess = await find_active_session(db, class_id, batch=batch)
+    if not sess: return None
+    marked_count, marked = await db.fetchrow(SESSION_MARKS_SQL, student_id, sess['id'])
+    return snapshot_dict(sess, class_id, await get_roster(db, class_id), marked_count, marked)
+
+# --- Class choice (app_anthro.current_class and friends, around the shared choose_class()) ---
+async def current_class(db, session, allowed, requested, live_batch=None):
+    names = dict(await get_classes(db))
+    live_ids = ()
+    if live_batch is not None and requested in (None, ''):
+        live_ids = {cid for cid in allowed if cid in names and await find_active_session(db, cid, batch=live_batch)}
+    return choose_class(names, allowed, requested, session, live_ids)
+
+async def controller_class(db, session, requested):
+    return await current_class(db, session, controller_class_ids(await get_classes(db)), requested)
+
+async def student_class(db, session, requested, live_batch=None):
+    enrolled = await get_student_classes(db, session['student_id'])
+    if session.get('class_ids') != enrolled: session['class_ids'] = enrolled  # /api/mark checks tokens against this
+    return await current_class(db, session, enrolled, requested, live_batch)
+
+# --- Live events ---
+class HubWaiter:
+    """EventHub.wait() for coroutines. The listener thread wakes the loop once per event however many
+    streams are open; they all wait on one asyncio.Event, replaced by the next on every wake."""
+    def __init__(self, loop):
+        self.loop, self.event = loop, asyncio.Event()
+
+    def wake(self):
+        try: self.loop.call_soon_threadsafe(self._set)
+        except RuntimeError: pass  # the loop is closed (worker shutting down)
+
+    def _set(self):
+        event, self.event = self.event, asyncio.Event()
+        event.set()
+
+    async def wait(self, seq, timeout):
+        event = self.event
+        if hub.seq <= seq:
+            try: await asyncio.wait_for(event.wait(), timeout)
+            except asyncio.TimeoutError: pass
+        return hub.since(seq)
+
+# --- Requests ---
+class _CookieResponse:
+    """Enough of a werkzeug response for Flask's session interface to write its cookie onto a Starlette one."""
+    def __init__(self, response): self.response, self.vary = response, set()
+
+    def set_cookie(self, key, value, samesite=None, **kwargs):
+        self.response.set_cookie(key, value, samesite=samesite.lower() if samesite else None, **kwargs)
+
+    def delete_cookie(self, key, samesite=None, **kwargs):
+        self.response.delete_cookie(key, samesite=samesite.lower() if samesite else None, **kwargs)
+
+def body_response(body, status, headers=None):
+    """A Starlette response for the body of one of app_anthro's error answers (a dict is JSON)."""
+    return (JSONResponse if isinstance(body, dict) else PlainTextResponse)(body, status, headers)
+
+def busy(request):
+    # app_anthro.pool_exhausted
+    return body_response(busy_body(request.url.path), 503, {'Retry-After': '1'})
+
+def refused(request, e):
+    # app_anthro.class_refused
+    return body_response(refused_body(request.url.path, e), e.status)
+
+def hot_path(endpoint):
+    """Runs a coroutine view with the Flask session loaded and saved around it, plus the sync app's
+    X-DB-Queries header and request metrics under the same endpoint name."""
+    def wrap(view):
+        @functools.wraps(view)
+        async def handler(request):
+            token = _request_stats.set(RequestStats() if DB_QUERY_COUNT_HEADER or METRICS else None)
+            start = time.perf_counter()
+            try:
+                session = flask_app.session_interface.open_session(flask_app, request)
+                try: resp = await view(request, session)
+                except Overloaded: resp = busy(request)
+                except ClassRefused as e: resp = refused(request, e)
+                cookie = _CookieResponse(resp)
+                flask_app.session_interface.save_session(flask_app, session, cookie)
+                if cookie.vary: resp.headers.append('Vary', 'Cookie')
+                stats = _request_stats.get()
+                if stats is not None and DB_QUERY_COUNT_HEADER: resp.headers['X-DB-Queries'] = str(stats.queries)
+                if METRICS:
+                    labels = (('endpoint', endpoint),)
+                    metrics.inc('app_requests_total', (*labels, ('method', request.method), ('status', str(resp.status_code))))
+                    metrics.observe('app_request_duration_seconds', labels, time.perf_counter() - start)
+                    metrics.observe('app_request_db_queries', labels, stats.queries)
+                    metrics.observe('app_request_db_seconds', labels, stats.db_seconds)
+                    metrics.maybe_flush()
+                return resp
+            finally: _request_stats.reset(token)
+        return handler
+    return wrap
+
+async def json_body(request):
+    try: data = await request.json()
+    except ValueError: return None
+    return data if isinstance(data, dict) else None
+
+def login_redirect(session):
+    if 'student_id' not in session and session.get('role') != 'controller': return RedirectResponse('/student/auth', 302)
+    return None
+
+@hot_path('api_login')
+async def api_login(request, session):
+    data = await json_body(request)
+    if data is None: return JSONResponse({'success': False, 'message': 'Invalid request.'}, 400)
+    enrollment, password, device_id = (data.get('enrollment') or '').strip().upper(), data.get('password'), data.get('device_id')
+    keys = login_keys(enrollment, device_id)
+    wait = login_throttle.retry_after(*keys)
+    if wait: return JSONResponse({'success': False, 'message': throttle_message(wait)}, 429, {'Retry-After': str(math.ceil(wait))})
+
+    async with checkout(request) as db:
+        if db is None: return JSONResponse({'success': False, 'message': 'System unavailable'})
+        student = await find_student(db, request.app.state.login_index_lock, enrollment)
+        error = check_login(student, device_id)
+        class_ids = await get_student_classes(db, student['id']) if not error else None
+
+    kdf = get_kdf_pool()
+    if not error:
+        matches, rehash = await asyncio.wrap_future(kdf.submit(verify_password, student['password'], password))
+        if not matches: error = 'Wrong password.'
+    if error:
+        login_throttle.failed(*keys)
+        return JSONResponse({'success': False, 'message': error})
+    login_throttle.reset(*keys)
+    if rehash:
+        hashed = await asyncio.wrap_future(kdf.submit(hash_password, password))
+        async with checkout(request) as db:
+            if db is not None:
+                await db.execute(PASSWORD_UPGRADE_SQL, hashed, student['id'], student['password'])
+                student['password'] = hashed
+
+    session.permanent = True
+    session.update(student_session(student, class_ids))
+    return JSONResponse({'success': True})
+
+@hot_path('student_dashboard')
+async def student_dashboard(request, session):
+    redirect = login_redirect(session)
+    if redirect: return redirect
+    if session.get('role') == 'controller': return RedirectResponse('/controller', 302)
+
+    stats = {'total': 0, 'present': 0, 'percent': 0}
+    active_session = None
+    class_id, class_name, classes = None, None, []
+    async with checkout(request) as db:
+        if db is not None:
+            student_batch = session.get('student_batch', 'ALL')
+            class_id, class_name = await student_class(db, session, request.query_params.get('class_id'), live_batch=student_batch)
+            names = dict(await get_classes(db))
+            classes = [(cid, names[cid]) for cid in session['class_ids'] if cid in names]
+
+            if class_id is not None:
+                total, present = await db.fetchrow(DASHBOARD_STATS_SQL, class_id, student_batch, session['student_id'], class_id)
+                stats['total'], stats['present'] = total, present or 0
+                if stats['total'] > 0: stats['percent'] = round((stats['present'] / stats['total']) * 100)
+
+                active_session = await session_snapshot(db, class_id, batch=student_batch, student_id=session['student_id'])
+
+    with flask_app.test_request_context(request.url.path):  # url_for() in the template
+        page = render_template('student_attendance.html', class_name=class_name, class_id=class_id, classes=classes, stats=stats,
+                               active_session=active_session, name=session['student_name'], is_monitor=session.get('is_monitor', False))
+    return HTMLResponse(page)
+
+@hot_path('mark_attendance')
+async def mark_attendance(request, session):
+    redirect = login_redirect(session)
+    if redirect: return redirect
+    data = await json_body(request)
+    if data is None: return JSONResponse({'success': False, 'message': 'Invalid request.'}, 400)
+    lat, lon, sid = data.get('lat'), data.get('lon'), data.get('session_id')
+    try: sid = int(sid)
+    except (TypeError, ValueError): return JSONResponse({'success': False, 'message': 'Session expired.'})
+
+    # Token fast path as in the sync app; the connection is only needed for the write
+    enrolled = session.get('class_ids')
+    sess = verify_session_token(data.get('token'), sid) if enrolled is not None else None
+    async with checkout(request) as db:
+        if db is None: return JSONResponse({'success': False})
+        if sess is None:
+            if enrolled is None: enrolled = session['class_ids'] = await get_student_classes(db, session['student_id'])
+            for cid in enrolled:
+                sess = await find_active_session(db, cid, session_id=sid)
+                if sess: break
+            if not sess: sess = await db.fetchrow(SESSION_BY_ID_SQL, sid)
+            if not sess: return JSONResponse({'success': False, 'message': 'Session expired.'})
+
+        error = check_mark(sess, enrolled, session.get('student_batch'), lat, lon)
+        if error: return JSONResponse({'success': False, 'message': error})
+
+        async with db.transaction():
+            await db.execute(MARK_INSERT_SQL, sid, session['student_id'], lat, lon)
+            await db.execute(ROLLUP_ADD_SQL, sid, [session['student_id']])
+            if app_anthro.LIVE_STREAM: await db.execute(MARK_COUNTS_SQL, EVENTS_CHANNEL, [sid])
+        await bump_report_after_mark(db, [sess['class_id']])
+    return JSONResponse({'success': True})
+
+@hot_path('session_events')
+async def session_events(request, session):
+    """app_anthro.session_events on the event loop; the database is only needed for the opening snapshot."""
+    redirect = login_redirect(session)
+    if redirect: return redirect
+    if not app_anthro.LIVE_STREAM: return PlainTextResponse('', 204)
+    is_controller = session.get('role') == 'controller'
+    batch = None if is_controller else session.get('student_batch', 'ALL')
+    start_listener()
+
+    since = hub.parse_id(request.headers.get('Last-Event-ID'))
+    snapshot = None
+    async with checkout(request) as db:
+        if db is None: return PlainTextResponse('System unavailable', 503)
+        requested = request.query_params.get('class_id')
+        if is_controller: class_id, _ = await controller_class(db, session, requested)
+        else: class_id, _ = await student_class(db, session, requested, live_batch=batch)
+        if since is None:
+            since = hub.seq  # before the query, so nothing committed meanwhile is missed
+            snapshot = {'session': class_id and await session_snapshot(db, class_id, batch=batch, student_id=session.get('student_id'))}
+
+    waiter = request.app.state.hub_waiter
+    async def stream(since):
+        yield "retry: 3000\n\n"
+        if snapshot is not None: yield sse_message(since, 'snapshot', snapshot)
+        deadline = time.monotonic() + SSE_MAX_STREAM
+        while time.monotonic() < deadline:
+            events = await waiter.wait(since, SSE_HEARTBEAT)
+            if not events:
+                yield ": ping\n\n"
+                continue
+            for seq, data in events:
+                since = seq
+                if sse_visible(data, class_id, batch): yield sse_message(seq, data['type'], data)
+
+    return StreamingResponse(stream(since), media_type='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    dsn, settings = asyncpg_dsn(DATABASE_URL)
+    app.state.pool = await asyncpg.create_pool(dsn, server_settings=settings, min_size=ASYNC_DB_POOL_MIN, max_size=ASYNC_DB_POOL_MAX)
+    app.state.gate = asyncio.Semaphore(ASYNC_DB_POOL_MAX)
+    app.state.login_index_lock = asyncio.Lock()
+    app.state.hub_waiter = HubWaiter(asyncio.get_running_loop())
+    hub.add_waker(app.state.hub_waiter.wake)
+    try: yield
+    finally:
+        hub.remove_waker(app.state.hub_waiter.wake)
+        await app.state.pool.close()
+
+app = Starlette(routes=[
+    Route('/api/student/login', api_login, methods=['POST']),
+    Route('/student/dashboard', student_dashboard, methods=['GET']),
+    Route('/api/mark', mark_attendance, methods=['POST']),
+    Route('/api/session/events', session_events, methods=['GET']),
+    Mount('/', app=WSGIMiddleware(flask_app, workers=ASYNC_WSGI_THREADS)),
+], lifespan=lifespan)
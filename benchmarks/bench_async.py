@@ -0,0 +1,142 @@
+"""Student hot paths on the sync workers (gunicorn app_anthro:app) vs the asyncio mode (uvicorn app_async:app).
+
+For each server the controller starts a session, then every student logs in, opens the dashboard
+and marks, --concurrency students at a time. Both servers get the same database connections per
+worker (DB_CONN_LIMIT / workers, which each divides between its pools and its LISTEN connection);
+the resident memory of the server's whole process tree is sampled during the run and reported next
+to requests/sec and p99, so runs can be compared at equal memory (the default gives both the same
+number of worker processes; adjust --sync-workers/--threads/--async-workers to trade them off).
+
+    python benchmarks/bench_async.py --students 2000 --concurrency 200 --sync-workers 2 --threads 8 --async-workers 2
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from loadtest import LIVE_SESSION, Client, Recorder, free_port, start_server, student_login
+from seed import CAMPUS_LAT, CAMPUS_LON, connect, create_schema, database_url, drop_schema, schema_url, seed_semester
+
+CONTROLLER_USER, CONTROLLER_PASS = 'bench_admin', 'bench_pass'
+
+
+def tree_rss_mb(pid):
+    """Resident memory of a process and all its descendants, in MB (Linux /proc)."""
+    children = {}
+    for status in Path('/proc').glob('[0-9]*/status'):
+        try: fields = dict(line.split(':\t', 1) for line in status.read_text().splitlines() if ':\t' in line)
+        except OSError: continue
+        children.setdefault(int(fields['PPid']), []).append((int(fields['Pid']), int(fields.get('VmRSS', '0 kB').split()[0])))
+    total, stack = 0, [pid]
+    try: total = int(next(l for l in Path(f'/proc/{pid}/status').read_text().splitlines() if l.startswith('VmRSS')).split()[1])
+    except (OSError, StopIteration): pass
+    while stack:
+        for child, rss in children.get(stack.pop(), []):
+            total += rss
+            stack.append(child)
+    return total / 1024
+
+
+class MemorySampler(threading.Thread):
+    def __init__(self, pid, every=0.25):
+        super().__init__(daemon=True)
+        self.pid, self.every, self.peak, self.stopped = pid, every, 0.0, threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.every): self.peak = max(self.peak, tree_rss_mb(self.pid))
+
+
+def run_burst(port, students, concurrency):
+    recorder = Recorder()
+    controller = Client(port, recorder)
+    controller.request('controller_login', 'POST', '/login', {'username': CONTROLLER_USER, 'password': CONTROLLER_PASS}, form=True)
+    controller.request('start_session', 'POST', '/api/session/start', {'lat': CAMPUS_LAT, 'lon': CAMPUS_LON, 'batch': 'ALL'})
+
+    def student(row):
+        sid, enrollment = row
+        c = Client(port, recorder)
+        student_login(c, sid, enrollment)
+        _, page = c.request('student_dashboard', 'GET', '/student/dashboard')
+        found = LIVE_SESSION.search(page.decode(errors='replace'))
+        live = json.loads(found.group(1)) if found else None
+        if not live: return recorder.add('mark_attendance', 0, False, None)
+        c.request('mark_attendance', 'POST', '/api/mark', {'lat': CAMPUS_LAT, 'lon': CAMPUS_LON, 'session_id': live['id'], 'token': live['token']})
+        c.conn.close()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool: list(pool.map(student, students))
+    wall = time.perf_counter() - start
+    controller.request('end_session', 'POST', '/api/session/end', {})
+    return wall, recorder.summary()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--students', type=int, default=2000)
+    parser.add_argument('--days', type=int, default=60)
+    parser.add_argument('--concurrency', type=int, default=200, help='students in flight at once')
+    parser.add_argument('--sync-workers', type=int, default=2, help='gunicorn worker processes')
+    parser.add_argument('--threads', type=int, default=8, help='gunicorn threads per worker')
+    parser.add_argument('--async-workers', type=int, default=2, help='uvicorn worker processes')
+    parser.add_argument('--pool', type=int, default=10, help='database connections per worker, both servers')
+    parser.add_argument('--schema', default='bench')
+    parser.add_argument('--keep', action='store_true', help='Leave the benchmark schema in place.')
+    parser.add_argument('--json', help='Write results to this file.')
+    args = parser.parse_args()
+
+    url = database_url()
+    os.environ['DATABASE_URL'] = schema_url(url, args.schema)  # before seed_semester() imports the app
+    create_schema(url, args.schema)
+    conn = connect(url, args.schema)
+    try:
+        seed_semester(conn, students=args.students, days=args.days)
+        with conn.cursor() as cur:
+            cur.execute("SELECT id, enrollment_no FROM students ORDER BY id")
+            students = cur.fetchall()
+    finally: conn.close()
+
+    servers = {
+        'sync': (args.sync_workers, [sys.executable, '-m', 'gunicorn', '-w', str(args.sync_workers), '--threads', str(args.threads),
+                                     '--timeout', '120', '-b', '127.0.0.1:{port}', 'app_anthro:app']),
+        'async': (args.async_workers, [sys.executable, '-m', 'uvicorn', 'app_async:app', '--workers', str(args.async_workers),
+                                       '--log-level', 'warning', '--no-access-log', '--port', '{port}']),
+    }
+    results = {}
+    try:
+        for name, (workers, cmd) in servers.items():
+            port = free_port()
+            env = dict(os.environ, WEB_CONCURRENCY=str(workers), DB_CONN_LIMIT=str(args.pool * workers), DB_POOL_TIMEOUT='30',
+                       CONTROLLER_USER=CONTROLLER_USER, CONTROLLER_PASS=CONTROLLER_PASS)
+            proc = start_server([part.format(port=port) for part in cmd], env, port)
+            sampler = MemorySampler(proc.pid)
+            try:
+                time.sleep(1)  # let every worker finish booting
+                sampler.start()
+                wall, routes = run_burst(port, students, args.concurrency)
+            finally:
+                sampler.stopped.set()
+                proc.terminate()
+                proc.wait(30)
+            total = sum(r['requests'] for route, r in routes.items() if route in ('api_login', 'student_dashboard', 'mark_attendance'))
+            results[name] = {'workers': workers, 'peak_rss_mb': round(sampler.peak, 1), 'wall_s': round(wall, 2),
+                             'requests_per_s': round(total / wall, 1), 'routes': routes}
+    finally:
+        if not args.keep: drop_schema(url, args.schema)
+
+    print(f"{args.students} students, {args.concurrency} in flight, {args.pool} connections/worker")
+    print(f"{'server':<7} {'workers':>7} {'RSS MB':>7} {'req/s':>7}   {'route':<18} {'p50 ms':>7} {'p99 ms':>8} {'errors':>6}")
+    for name, r in results.items():
+        for i, route in enumerate(('api_login', 'student_dashboard', 'mark_attendance')):
+            rr = r['routes'].get(route, {'p50_ms': 0, 'p99_ms': 0, 'errors': 0})
+            head = f"{name:<7} {r['workers']:>7} {r['peak_rss_mb']:>7.0f} {r['requests_per_s']:>7.0f}" if i == 0 else ' ' * 31
+            print(f"{head}   {route:<18} {rr['p50_ms']:>7.1f} {rr['p99_ms']:>8.1f} {rr['errors']:>6}")
+    if args.json:
+        with open(args.json, 'w') as f: json.dump({'params': vars(args), 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
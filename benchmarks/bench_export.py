@@ -0,0 +1,76 @@
+"""Peak Python memory and latency of the HTML report vs the streamed CSV/XLSX export.
+
+    DATABASE_URL=postgres://... python benchmarks/bench_export.py --students 1000 --days 365
+"""
+import argparse
+import json
+import os
+import time
+import tracemalloc
+
+from seed import connect, create_schema, database_url, drop_schema, schema_url, seed_semester
+
+PATHS = {
+    'html': '/report',
+    'csv': '/report/export?format=csv',
+    'xlsx': '/report/export?format=xlsx',
+}
+
+
+def measure(client, path):
+    tracemalloc.start()
+    start = time.perf_counter()
+    first_byte = None
+    size = 0
+    resp = client.get(path, buffered=False)
+    for chunk in resp.response:
+        if first_byte is None: first_byte = time.perf_counter() - start
+        size += len(chunk)
+    resp.close()
+    total = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'status': resp.status_code, 'bytes': size, 'first_byte_ms': round((first_byte or total) * 1000, 1),
+            'total_ms': round(total * 1000, 1), 'peak_mb': round(peak / 2**20, 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--students', type=int, default=1000)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--schema', default='bench')
+    parser.add_argument('--keep', action='store_true', help='Leave the benchmark schema in place.')
+    parser.add_argument('--json', help='Write results to this file.')
+    args = parser.parse_args()
+
+    url = database_url()
+    os.environ['DATABASE_URL'] = schema_url(url, args.schema)  # before seed_semester() imports the app
+    create_schema(url, args.schema)
+    conn = connect(url, args.schema)
+    try:
+        seed_semester(conn, students=args.students, days=args.days)
+    finally: conn.close()
+
+    from app_anthro import app
+    client = app.test_client()
+    with client.session_transaction() as s: s['role'] = 'controller'
+
+    results = {'students': args.students, 'days': args.days}
+    try:
+        for name, path in PATHS.items():
+            measure(client, path)  # warm the pool and caches
+            results[name] = measure(client, path)
+    finally:
+        if not args.keep: drop_schema(url, args.schema)
+
+    print(f"{args.students} students x {args.days} days")
+    for name in PATHS:
+        r = results[name]
+        print(f"  {name:<5} {r['total_ms']:>9.1f} ms total  {r['first_byte_ms']:>9.1f} ms to first byte"
+              f"  {r['peak_mb']:>8.2f} MB peak  {r['bytes'] / 2**20:>7.2f} MB body")
+    if args.json:
+        with open(args.json, 'w') as f: json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
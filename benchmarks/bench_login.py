@@ -0,0 +1,144 @@
+"""A login storm at the start of a practical: --storm students log in at the same instant while
+students already in the live session keep marking.
+
+Passwords are scrypt hashes at the app's cost (PASSWORD_SCRYPT_N), checked on the per-worker KDF
+pool. A --new-phones share of the storm logs in from an unregistered device and is turned away by
+the device check before any hashing. The server is started once per --kdf-workers value, so you
+can see what bounding the pool does to mark latency and what it costs in login throughput.
+
+    python benchmarks/bench_login.py --storm 200 --workers 2 --threads 16 --kdf-workers 1,2,4
+
+Logins that find the KDF queue full get a 503 and retry on the login page's schedule, so the login
+times include the retries; marks should hold their idle latency throughout.
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+from loadtest import LIVE_SESSION, Client, Recorder, free_port, login, start_server, student_login
+from seed import CAMPUS_LAT, CAMPUS_LON, connect, create_schema, database_url, drop_schema, schema_url, seed_semester
+
+CONTROLLER_USER, CONTROLLER_PASS = 'bench_admin', 'bench_pass'
+
+
+def keep_marking(port, markers, recorder, route, stop, pause):
+    """Every marker re-marks the live session every `pause` seconds (the insert is a no-op after the first)."""
+    def run(row):
+        client = Client(port, recorder)
+        login(client, 'marker_login', *row)
+        _, page = client.request('marker_dashboard', 'GET', '/student/dashboard')
+        found = LIVE_SESSION.search(page.decode(errors='replace'))
+        live = json.loads(found.group(1)) if found else None
+        while live and not stop.wait(pause):
+            client.request(route(), 'POST', '/api/mark', {'lat': CAMPUS_LAT, 'lon': CAMPUS_LON, 'session_id': live['id'], 'token': live['token']})
+    threads = [threading.Thread(target=run, args=(row,)) for row in markers]
+    for t in threads: t.start()
+    return threads
+
+
+def run_storm(port, markers, stormers, new_phones, idle_seconds, pause):
+    recorder = Recorder()
+    controller = Client(port, recorder)
+    controller.request('controller_login', 'POST', '/login', {'username': CONTROLLER_USER, 'password': CONTROLLER_PASS}, form=True)
+    controller.request('start_session', 'POST', '/api/session/start', {'lat': CAMPUS_LAT, 'lon': CAMPUS_LON, 'batch': 'ALL'})
+
+    phase = ['mark_idle']
+    stop = threading.Event()
+    marking = keep_marking(port, markers, recorder, lambda: phase[0], stop, pause)
+    time.sleep(idle_seconds)
+
+    barrier = threading.Barrier(len(stormers) + 1)
+    def storm(i, row):
+        client = Client(port, recorder)
+        barrier.wait()
+        if i < new_phones: return login(client, 'login_new_phone', *row, device=f'dev_new_{row[0]}')
+        student_login(client, *row)
+    threads = [threading.Thread(target=storm, args=(i, row)) for i, row in enumerate(stormers)]
+    for t in threads: t.start()
+    phase[0] = 'mark_storm'
+    barrier.wait()
+    start = time.perf_counter()
+    for t in threads: t.join()
+    wall = time.perf_counter() - start
+    stop.set()
+    for t in marking: t.join()
+    controller.request('end_session', 'POST', '/api/session/end', {})
+    return wall, recorder.summary()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--storm', type=int, default=200, help='students logging in at the same instant')
+    parser.add_argument('--new-phones', type=float, default=0.2, help='share of the storm on an unregistered device')
+    parser.add_argument('--markers', type=int, default=20, help='students marking throughout')
+    parser.add_argument('--mark-every', type=float, default=0.1, help='seconds between a marker\'s requests')
+    parser.add_argument('--idle-seconds', type=float, default=3, help='marking before the storm, for the baseline')
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn worker processes')
+    parser.add_argument('--threads', type=int, default=16, help='gunicorn threads per worker')
+    parser.add_argument('--kdf-workers', default='1,2', help='comma-separated KDF_WORKERS values to run')
+    parser.add_argument('--kdf-queue', type=int, help='KDF_QUEUE_MAX (default: half of --threads)')
+    parser.add_argument('--pool', type=int, default=10, help='DB_POOL_MAX per worker')
+    parser.add_argument('--schema', default='bench')
+    parser.add_argument('--keep', action='store_true', help='Leave the benchmark schema in place.')
+    parser.add_argument('--json', help='Write results to this file.')
+    args = parser.parse_args()
+
+    url = database_url()
+    os.environ['DATABASE_URL'] = schema_url(url, args.schema)  # before seed_semester() imports the app
+    create_schema(url, args.schema)
+    conn = connect(url, args.schema)
+    try:
+        seed_semester(conn, students=args.markers + args.storm, days=args.days)
+        with conn.cursor() as cur:
+            cur.execute("SELECT id, enrollment_no FROM students ORDER BY id")
+            students = cur.fetchall()
+    finally: conn.close()
+    markers, stormers = students[:args.markers], students[args.markers:]
+    new_phones = int(len(stormers) * args.new_phones)
+
+    kdf_queue = args.threads // 2 if args.kdf_queue is None else args.kdf_queue
+    results = {}
+    try:
+        for kdf_workers in [int(k) for k in args.kdf_workers.split(',')]:
+            port = free_port()
+            env = dict(os.environ, WEB_CONCURRENCY=str(args.workers), DB_POOL_MAX=str(args.pool), DB_POOL_TIMEOUT='30',
+                       KDF_WORKERS=str(kdf_workers), KDF_QUEUE_MAX=str(kdf_queue), CONTROLLER_USER=CONTROLLER_USER, CONTROLLER_PASS=CONTROLLER_PASS)
+            proc = start_server([sys.executable, '-m', 'gunicorn', '-w', str(args.workers), '--threads', str(args.threads),
+                                 '--timeout', '120', '-b', f'127.0.0.1:{port}', 'app_anthro:app'], env, port)
+            try:
+                time.sleep(1)  # let every worker finish booting
+                wall, routes = run_storm(port, markers, stormers, new_phones, args.idle_seconds, args.mark_every)
+            finally:
+                proc.terminate()
+                proc.wait(30)
+            logins = routes.get('api_login', {'requests': 0, 'errors': 0})
+            results[kdf_workers] = {'wall_s': round(wall, 2), 'logins_per_s': round((logins['requests'] - logins['errors']) / wall, 1), 'routes': routes}
+
+        with connect(url, args.schema) as conn, conn.cursor() as cur:
+            cur.execute("SELECT COUNT(*) FILTER (WHERE password LIKE 'scrypt$%%'), COUNT(*) FROM students")
+            hashed, total = cur.fetchone()
+    finally:
+        if not args.keep: drop_schema(url, args.schema)
+
+    print(f"{len(stormers)} logins at once ({new_phones} from new phones), {len(markers)} students marking; "
+          f"{args.workers} workers x {args.threads} threads, KDF queue {kdf_queue}; {hashed}/{total} passwords hashed")
+    print("login times include 503 retries; 'failed' gave up after the last retry")
+    print(f"{'KDF':>3} {'logins/s':>9} {'login p50':>10} {'p99':>8} {'failed':>6} {'503s':>5} {'new phone p50':>14}"
+          f" {'mark idle p50':>14} {'p99':>8} {'mark storm p50':>15} {'p99':>8}")
+    empty = {'p50_ms': 0, 'p99_ms': 0, 'errors': 0}
+    for kdf_workers, r in results.items():
+        logins, attempts = r['routes'].get('api_login', empty), r['routes'].get('login_attempt', empty)
+        phone = r['routes'].get('login_new_phone', empty)
+        idle, storm = r['routes'].get('mark_idle', empty), r['routes'].get('mark_storm', empty)
+        print(f"{kdf_workers:>3} {r['logins_per_s']:>9.1f} {logins['p50_ms']:>10.1f} {logins['p99_ms']:>8.1f} {logins['errors']:>6} {attempts['errors']:>5}"
+              f" {phone['p50_ms']:>14.1f} {idle['p50_ms']:>14.1f} {idle['p99_ms']:>8.1f} {storm['p50_ms']:>15.1f} {storm['p99_ms']:>8.1f}")
+    if args.json:
+        with open(args.json, 'w') as f: json.dump({'params': vars(args), 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""Mark path with and without a signed session token.
+
+Always times issuing and verifying a token in-process. With DATABASE_URL set it also times full
+/api/mark requests without a token (cached/DB session lookup) and with one (no session lookup).
+
+    python benchmarks/bench_mark_token.py
+    DATABASE_URL=postgres://... python benchmarks/bench_mark_token.py --requests 2000
+"""
+import argparse
+import json
+import os
+import statistics
+import time
+import timeit
+from datetime import datetime, timedelta, timezone
+
+from seed import CAMPUS_LAT, CAMPUS_LON, connect, create_schema, drop_schema, schema_url, seed_semester
+
+
+def time_requests(client, body, n):
+    samples = []
+    for _ in range(n):
+        start = time.perf_counter()
+        resp = client.post('/api/mark', json=body)
+        samples.append((time.perf_counter() - start) * 1e6)
+        assert resp.get_json().get('success'), resp.get_json()
+    samples.sort()
+    return {'median_us': round(statistics.median(samples), 1), 'p99_us': round(samples[int(len(samples) * 0.99) - 1], 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--schema', default='bench')
+    parser.add_argument('--keep', action='store_true', help='Leave the benchmark schema in place.')
+    parser.add_argument('--json', help='Write results to this file.')
+    args = parser.parse_args()
+
+    url = os.environ.get('DATABASE_URL')
+    if url:
+        create_schema(url, args.schema)
+        os.environ['DATABASE_URL'] = schema_url(url, args.schema)
+    import app_anthro
+
+    sess = {'id': 1, 'batch_filter': 'ALL', 'session_lat': CAMPUS_LAT, 'session_lon': CAMPUS_LON,
+            'end_time': datetime.now(timezone.utc) + timedelta(minutes=5)}
+    token = app_anthro.issue_session_token(sess, 1)
+    app_anthro.start_listener = lambda: None
+    app_anthro.revocations.ready = True
+    n = 100000
+    results = {
+        'issue_us': round(timeit.timeit(lambda: app_anthro.issue_session_token(sess, 1), number=n) / n * 1e6, 2),
+        'verify_us': round(timeit.timeit(lambda: app_anthro.verify_session_token(token, 1), number=n) / n * 1e6, 2),
+    }
+
+    if url:
+        conn = connect(url, args.schema)
+        try:
+            seed_semester(conn, students=1, days=1)
+            with conn.cursor() as cur:
+                cur.execute("""
+                    INSERT INTO attendance_sessions (class_id, session_token, start_time, end_time, is_active, session_lat, session_lon, batch_filter)
+                    SELECT id, 'bench-live', NOW(), NOW() + interval '5 minutes', TRUE, %s, %s, 'ALL' FROM classes LIMIT 1
+                    RETURNING id, end_time, session_lat, session_lon, class_id
+                """, (CAMPUS_LAT, CAMPUS_LON))
+                sid, end_time, lat, lon, class_id = cur.fetchone()
+                cur.execute("SELECT id, batch FROM students LIMIT 1")
+                student_id, batch = cur.fetchone()
+            conn.commit()
+            live_token = app_anthro.issue_session_token({'id': sid, 'batch_filter': 'ALL', 'session_lat': lat, 'session_lon': lon, 'end_time': end_time}, class_id)
+            client = app_anthro.app.test_client()
+            with client.session_transaction() as s: s.update(student_id=student_id, student_name='Bench', student_batch=batch)
+            body = {'lat': CAMPUS_LAT, 'lon': CAMPUS_LON, 'session_id': sid}
+            time_requests(client, body, 50)  # warm the pool
+            results['mark_without_token'] = time_requests(client, body, args.requests)
+            results['mark_token'] = time_requests(client, {**body, 'token': live_token}, args.requests)
+        finally:
+            conn.close()
+            if not args.keep: drop_schema(url, args.schema)
+
+    print(f"issue token     {results['issue_us']:>8.2f} us")
+    print(f"verify token    {results['verify_us']:>8.2f} us")
+    for name in ('mark_without_token', 'mark_token'):
+        if name in results: print(f"{name:<19} median {results[name]['median_us']:>9.1f} us   p99 {results[name]['p99_us']:>9.1f} us")
+    if args.json:
+        with open(args.json, 'w') as f: json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""/api/mark burst: per-request commit vs group commit (MARK_BATCHING).
+
+Every concurrency level opens a fresh session and releases that many students at once through
+a barrier, the way a class hits the button when the session starts.
+
+    DATABASE_URL=postgres://... python benchmarks/bench_marks.py --concurrency 50 150 500
+"""
+import argparse
+import json
+import os
+import threading
+import time
+
+from seed import CAMPUS_LAT, CAMPUS_LON, connect, create_schema, database_url, drop_schema, schema_url, seed_semester
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+
+def start_session(conn):
+    with conn.cursor() as cur:
+        cur.execute("UPDATE attendance_sessions SET is_active = FALSE WHERE is_active = TRUE")
+        cur.execute("""
+            INSERT INTO attendance_sessions (class_id, session_token, start_time, end_time, is_active, session_lat, session_lon, batch_filter)
+            SELECT id, md5(random()::text), NOW(), NOW() + interval '5 minutes', TRUE, %s, %s, 'ALL' FROM classes LIMIT 1
+            RETURNING id
+        """, (CAMPUS_LAT, CAMPUS_LON))
+        sid = cur.fetchone()[0]
+    conn.commit()
+    return sid
+
+
+def burst(app_module, students, session_id):
+    """Fire one mark per student simultaneously; returns (latencies in ms, wall seconds, failures)."""
+    clients = []
+    for student_id, batch in students:
+        client = app_module.app.test_client()
+        with client.session_transaction() as s:
+            s.update(student_id=student_id, student_name='Bench', student_batch=batch)
+        clients.append(client)
+    barrier = threading.Barrier(len(clients) + 1)
+    latencies, failures = [], []
+
+    def run(client):
+        barrier.wait()
+        start = time.perf_counter()
+        resp = client.post('/api/mark', json={'lat': CAMPUS_LAT, 'lon': CAMPUS_LON, 'session_id': session_id})
+        latencies.append((time.perf_counter() - start) * 1000)
+        if resp.status_code != 200 or not resp.get_json().get('success'): failures.append(resp.status_code)
+
+    threads = [threading.Thread(target=run, args=(c,)) for c in clients]
+    for t in threads: t.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for t in threads: t.join()
+    return latencies, time.perf_counter() - start, len(failures)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[50, 150, 500])
+    parser.add_argument('--pool', type=int, default=10, help='DB_POOL_MAX for the app under test.')
+    parser.add_argument('--schema', default='bench')
+    parser.add_argument('--keep', action='store_true', help='Leave the benchmark schema in place.')
+    parser.add_argument('--json', help='Write results to this file.')
+    args = parser.parse_args()
+
+    url = database_url()
+    # The app reads these at import, which seed_semester() triggers
+    os.environ['DATABASE_URL'] = schema_url(url, args.schema)
+    os.environ['DB_POOL_MAX'] = str(args.pool)
+    os.environ['DB_POOL_TIMEOUT'] = '30'
+    create_schema(url, args.schema)
+    conn = connect(url, args.schema)
+    seed_semester(conn, students=max(args.concurrency), days=1)
+    with conn.cursor() as cur:
+        cur.execute("SELECT id, batch FROM students ORDER BY id")
+        students = cur.fetchall()
+
+    import app_anthro
+
+    results = []
+    try:
+        for n in args.concurrency:
+            for mode in ('per_request', 'group_commit'):
+                app_anthro.MARK_BATCHING = mode == 'group_commit'
+                session_id = start_session(conn)
+                app_anthro.cache.clear()
+                latencies, wall, failures = burst(app_anthro, students[:n], session_id)
+                results.append({'concurrency': n, 'mode': mode, 'throughput_rps': round(n / wall, 1),
+                                'p50_ms': round(percentile(latencies, 0.50), 1), 'p99_ms': round(percentile(latencies, 0.99), 1),
+                                'failures': failures})
+    finally:
+        conn.close()
+        if not args.keep: drop_schema(url, args.schema)
+
+    print(f"{'markers':>8} {'mode':<13} {'marks/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'failed':>7}")
+    for r in results:
+        print(f"{r['concurrency']:>8} {r['mode']:<13} {r['throughput_rps']:>9.1f} {r['p50_ms']:>9.1f} {r['p99_ms']:>9.1f} {r['failures']:>7}")
+    if args.json:
+        with open(args.json, 'w') as f: json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""Dashboard and report query times, raw-table aggregation vs the attendance rollup.
+
+    DATABASE_URL=postgres://... python benchmarks/bench_rollup.py --students 300 --days 120
+"""
+import argparse
+import json
+import random
+import statistics
+import time
+
+from seed import connect, create_schema, database_url, drop_schema, seed_semester
+
+# Queries as they were before the rollup existed
+LEGACY = {
+    'dashboard': [
+        ("""SELECT COUNT(DISTINCT DATE(start_time AT TIME ZONE 'UTC')) FROM attendance_sessions
+            WHERE class_id = %(class_id)s AND is_active = FALSE AND (batch_filter = 'ALL' OR batch_filter = %(batch)s)"""),
+        ("""SELECT COUNT(DISTINCT DATE(s.start_time AT TIME ZONE 'UTC')) FROM attendance_records r
+            JOIN attendance_sessions s ON r.session_id = s.id WHERE r.student_id = %(student_id)s AND s.class_id = %(class_id)s"""),
+    ],
+    'report': [
+        ("""SELECT DISTINCT DATE(start_time AT TIME ZONE 'UTC') as s_date FROM attendance_sessions
+            WHERE class_id = %(class_id)s ORDER BY s_date DESC"""),
+        ("""SELECT s.name, s.enrollment_no, s.batch,
+                   ARRAY_AGG(DISTINCT DATE(ses.start_time AT TIME ZONE 'UTC')) FILTER (WHERE r.session_id IS NOT NULL) as present_dates
+            FROM students s
+            LEFT JOIN attendance_records r ON s.id = r.student_id
+            LEFT JOIN attendance_sessions ses ON r.session_id = ses.id AND ses.class_id = %(class_id)s
+            GROUP BY s.id ORDER BY s.batch, s.enrollment_no"""),
+    ],
+}
+
+# Same reads served from the rollup (mirrors student_dashboard / report in app_anthro.py)
+ROLLUP = {
+    'dashboard': [
+        ("""SELECT (SELECT COUNT(DISTINCT att_date) FROM class_days
+                    WHERE class_id = %(class_id)s AND (batch_filter = 'ALL' OR batch_filter = %(batch)s)),
+                   (SELECT days_present FROM attendance_totals WHERE student_id = %(student_id)s AND class_id = %(class_id)s)"""),
+    ],
+    'report': [
+        "SELECT DISTINCT att_date FROM class_days WHERE class_id = %(class_id)s",
+        "SELECT student_id, att_date FROM daily_attendance WHERE class_id = %(class_id)s",
+        "SELECT id, enrollment_no, name, batch FROM students ORDER BY enrollment_no",
+    ],
+}
+
+
+def time_queries(cur, queries, params, repeat):
+    samples = []
+    for _ in range(repeat):
+        p = params()
+        start = time.perf_counter()
+        for q in queries:
+            cur.execute(q, p)
+            cur.fetchall()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {'median_ms': round(statistics.median(samples), 3), 'p95_ms': round(samples[int(len(samples) * 0.95) - 1], 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--students', type=int, default=300)
+    parser.add_argument('--days', type=int, default=120)
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--schema', default='bench')
+    parser.add_argument('--keep', action='store_true', help='Leave the benchmark schema in place.')
+    parser.add_argument('--json', help='Write results to this file.')
+    args = parser.parse_args()
+
+    url = database_url()
+    create_schema(url, args.schema)
+    conn = connect(url, args.schema)
+    try:
+        seed_semester(conn, students=args.students, days=args.days)
+        with conn.cursor() as cur:
+            cur.execute("SELECT id FROM classes LIMIT 1")
+            class_id = cur.fetchone()[0]
+            cur.execute("SELECT id, batch FROM students")
+            students = cur.fetchall()
+            def params():
+                student_id, batch = random.choice(students)
+                return {'class_id': class_id, 'student_id': student_id, 'batch': batch}
+
+            results = {'students': args.students, 'days': args.days, 'repeat': args.repeat}
+            for view in ('dashboard', 'report'):
+                results[view] = {
+                    'legacy': time_queries(cur, LEGACY[view], params, args.repeat),
+                    'rollup': time_queries(cur, ROLLUP[view], params, args.repeat),
+                }
+        conn.rollback()
+    finally:
+        conn.close()
+        if not args.keep: drop_schema(url, args.schema)
+
+    print(f"{args.students} students x {args.days} days, {args.repeat} runs each")
+    for view in ('dashboard', 'report'):
+        legacy, rollup = results[view]['legacy'], results[view]['rollup']
+        print(f"  {view:<10} legacy {legacy['median_ms']:>9.2f} ms (p95 {legacy['p95_ms']:.2f})"
+              f"   rollup {rollup['median_ms']:>9.2f} ms (p95 {rollup['p95_ms']:.2f})"
+              f"   x{legacy['median_ms'] / max(rollup['median_ms'], 1e-6):.1f}")
+    if args.json:
+        with open(args.json, 'w') as f: json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
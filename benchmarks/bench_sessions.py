@@ -0,0 +1,168 @@
+"""Dozens of classes running sessions at once.
+
+Seeds --classes classes with their own rosters and --days of history each, then, through the app:
+every class's controller starts a session at the same moment, every student opens the dashboard
+(picking up their class's live session) and marks, and every controller ends their session.
+While the sessions are live it also times the per-class "find active session" query with and
+without the partial index on active sessions, to show the lookup stays flat as history grows.
+
+    DATABASE_URL=postgres://... python benchmarks/bench_sessions.py --classes 40 --students-per-class 60 --days 90
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from seed import CAMPUS_LAT, CAMPUS_LON, SEED_PASSWORD, connect, create_schema, database_url, drop_schema, schema_url, seed_semester
+
+ACTIVE_LOOKUP = "SELECT id FROM attendance_sessions WHERE class_id = %s AND is_active = TRUE AND end_time > NOW()"
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p))] if samples else 0.0
+
+
+class Timings:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.phases = {}  # phase -> {'ms': [], 'failures': n}
+
+    def timed(self, phase, fn):
+        start = time.perf_counter()
+        resp = fn()
+        ms = (time.perf_counter() - start) * 1000
+        ok = resp.status_code == 200 and (resp.mimetype != 'application/json' or resp.get_json().get('success'))
+        with self.lock:
+            p = self.phases.setdefault(phase, {'ms': [], 'failures': 0})
+            p['ms'].append(ms)
+            p['failures'] += 0 if ok else 1
+        return resp
+
+
+def together(fns):
+    """Run the callables at the same instant (one thread each, released by a barrier); returns wall seconds."""
+    barrier = threading.Barrier(len(fns) + 1)
+    def run(fn):
+        barrier.wait()
+        fn()
+    threads = [threading.Thread(target=run, args=(fn,)) for fn in fns]
+    for t in threads: t.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for t in threads: t.join()
+    return time.perf_counter() - start
+
+
+def lookup_us(conn, class_ids, rounds):
+    with conn.cursor() as cur:
+        cur.execute("EXPLAIN " + ACTIVE_LOOKUP, (class_ids[0],))
+        plan = cur.fetchone()[0].split('  (')[0]
+        start = time.perf_counter()
+        for i in range(rounds):
+            cur.execute(ACTIVE_LOOKUP, (class_ids[i % len(class_ids)],))
+            cur.fetchall()
+        return (time.perf_counter() - start) / rounds * 1e6, plan
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--classes', type=int, default=40)
+    parser.add_argument('--students-per-class', type=int, default=60)
+    parser.add_argument('--days', type=int, default=90, help='days of session history per class')
+    parser.add_argument('--concurrency', type=int, default=100, help='students opening the dashboard and marking at once')
+    parser.add_argument('--pool', type=int, default=20, help='DB_POOL_MAX for the app under test.')
+    parser.add_argument('--lookups', type=int, default=2000)
+    parser.add_argument('--schema', default='bench')
+    parser.add_argument('--keep', action='store_true', help='Leave the benchmark schema in place.')
+    parser.add_argument('--json', help='Write results to this file.')
+    args = parser.parse_args()
+
+    url = database_url()
+    # The app reads these at import, which seed_semester() triggers
+    os.environ['DATABASE_URL'] = schema_url(url, args.schema)
+    os.environ['DB_POOL_MAX'] = str(args.pool)
+    os.environ['DB_POOL_TIMEOUT'] = '30'
+    create_schema(url, args.schema)
+    conn = connect(url, args.schema)
+    with conn.cursor() as cur:
+        cur.execute("INSERT INTO classes (class_name) SELECT 'Bench Class ' || lpad(i::text, 3, '0') FROM generate_series(2, %s) i", (args.classes,))
+    seed_semester(conn, students=args.classes * args.students_per_class, days=args.days, spread=True)
+    with conn.cursor() as cur:
+        cur.execute("SELECT id FROM classes ORDER BY id")
+        class_ids = [row[0] for row in cur.fetchall()]
+        cur.execute("SELECT id, enrollment_no FROM students ORDER BY id")
+        students = cur.fetchall()
+        cur.execute("SELECT COUNT(*) FROM attendance_sessions")
+        history = cur.fetchone()[0]
+    conn.commit()
+
+    import app_anthro
+
+    timings, walls, lookups = Timings(), {}, {}
+    try:
+        controllers = {}
+        for cid in class_ids:
+            client = app_anthro.app.test_client()
+            with client.session_transaction() as s: s.update(role='controller', user_id=1)
+            controllers[cid] = client
+        walls['start_session'] = together([
+            lambda c=c, cid=cid: timings.timed('start_session', lambda: c.post('/api/session/start', json={'lat': CAMPUS_LAT, 'lon': CAMPUS_LON, 'batch': 'ALL', 'class_id': cid}))
+            for cid, c in controllers.items()])
+        with conn.cursor() as cur:
+            cur.execute("SELECT COUNT(*) FROM attendance_sessions WHERE is_active")
+            live = cur.fetchone()[0]
+        conn.commit()
+
+        def student(row):
+            sid, enrollment = row
+            client = app_anthro.app.test_client()
+            timings.timed('api_login', lambda: client.post('/api/student/login', json={'enrollment': enrollment, 'password': SEED_PASSWORD, 'device_id': f'dev_bench_{sid}'}))
+            resp = timings.timed('student_dashboard', lambda: client.get('/student/dashboard'))
+            page = resp.get_data(as_text=True)
+            live_session = json.loads(page.split('let liveSession = ', 1)[1].split(';</script>', 1)[0])
+            if not live_session: return timings.timed('mark_attendance', lambda: app_anthro.app.response_class('{}', 404))
+            timings.timed('mark_attendance', lambda: client.post('/api/mark', json={
+                'lat': CAMPUS_LAT, 'lon': CAMPUS_LON, 'session_id': live_session['id'], 'token': live_session['token']}))
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool: list(pool.map(student, students))
+        walls['students'] = time.perf_counter() - start
+
+        # Lookup cost with dozens of live sessions in a table holding the whole history
+        lookups['partial_index'] = lookup_us(conn, class_ids, args.lookups)
+        with conn.cursor() as cur: cur.execute("DROP INDEX attendance_sessions_active_class")
+        lookups['no_index'] = lookup_us(conn, class_ids, args.lookups)
+        conn.rollback()
+
+        walls['end_session'] = together([
+            lambda c=c, cid=cid: timings.timed('end_session', lambda: c.post('/api/session/end', json={'class_id': cid}))
+            for cid, c in controllers.items()])
+        with conn.cursor() as cur:
+            cur.execute("SELECT COUNT(*) FROM attendance_records r JOIN attendance_sessions s ON s.id = r.session_id WHERE s.start_time > NOW() - interval '1 hour'")
+            marked = cur.fetchone()[0]
+    finally:
+        conn.close()
+        if not args.keep: drop_schema(url, args.schema)
+
+    print(f"{len(class_ids)} classes x {args.students_per_class} students, {history} sessions of history; "
+          f"{live} sessions live at once, {marked} of {len(students)} students marked")
+    print(f"{'phase':<18} {'reqs':>6} {'failed':>7} {'p50 ms':>8} {'p99 ms':>8}")
+    results = {'classes': len(class_ids), 'students': len(students), 'history_sessions': history, 'live_sessions': live,
+               'marked': marked, 'wall_s': {k: round(v, 2) for k, v in walls.items()}, 'phases': {}, 'active_lookup': {}}
+    for phase, p in timings.phases.items():
+        results['phases'][phase] = {'requests': len(p['ms']), 'failures': p['failures'],
+                                    'p50_ms': round(percentile(p['ms'], 0.50), 2), 'p99_ms': round(percentile(p['ms'], 0.99), 2)}
+        r = results['phases'][phase]
+        print(f"{phase:<18} {r['requests']:>6} {r['failures']:>7} {r['p50_ms']:>8.1f} {r['p99_ms']:>8.1f}")
+    print("\nactive-session lookup per class:")
+    for name, (us, plan) in lookups.items():
+        results['active_lookup'][name] = {'mean_us': round(us, 1), 'plan': plan}
+        print(f"  {name:<14} {us:>8.1f} us   {plan}")
+    if args.json:
+        with open(args.json, 'w') as f: json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
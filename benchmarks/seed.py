@@ -0,0 +1,95 @@
+"""Synthetic semester data shared by the benchmark scripts.
+
+Everything lives in its own schema (default ``bench``) built from database_setup_anthro.sql, and the app
+under test, on schema_url(), LISTENs and NOTIFYs on channels prefixed with that schema. Even so, point the
+benchmarks at a database of their own, not production: the load they generate is shared.
+"""
+import os
+import sys
+from datetime import date
+from pathlib import Path
+
+import psycopg2
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+CAMPUS_LAT, CAMPUS_LON = 23.8388, 78.7378  # session centre for every synthetic session
+SEED_PASSWORD = 'pw'  # every synthetic student's; hashed once per seed, at the app's full cost
+
+
+def database_url():
+    url = os.environ.get('DATABASE_URL')
+    if not url: sys.exit("Set DATABASE_URL to a Postgres you can create schemas in.")
+    return url
+
+
+def schema_url(url, schema):
+    """DATABASE_URL variant whose connections default to the benchmark schema (used by the app itself)."""
+    sep = '&' if '?' in url else '?'
+    return f"{url}{sep}options=-csearch_path%3D{schema}"
+
+
+def connect(url, schema):
+    return psycopg2.connect(url, options=f'-c search_path={schema}')
+
+
+def create_schema(url, schema):
+    conn = psycopg2.connect(url)
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+            cur.execute(f"CREATE SCHEMA {schema}")
+            cur.execute(f"SET search_path TO {schema}")
+            cur.execute((ROOT / 'database_setup_anthro.sql').read_text())
+        conn.commit()
+    finally: conn.close()
+
+
+def drop_schema(url, schema):
+    conn = psycopg2.connect(url)
+    try:
+        with conn.cursor() as cur: cur.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+        conn.commit()
+    finally: conn.close()
+
+
+def seed_semester(conn, students=300, days=120, rate=0.8, start=date(2026, 1, 5), seed=0.42, spread=False):
+    """Replace the roster with `students` synthetic students and add one ended session per class per
+    day for `days` days, each attended by roughly `rate` of the class. Students are enrolled in every
+    class, or with `spread` in one class each (round robin). Rebuilds the rollup afterwards."""
+    from app_anthro import ROLLUP_SOURCES, ROLLUP_COLUMNS, hash_password
+
+    with conn.cursor() as cur:
+        cur.execute("SELECT setseed(%s)", (seed,))
+        cur.execute("TRUNCATE students RESTART IDENTITY CASCADE")
+        cur.execute("""
+            INSERT INTO students (enrollment_no, name, batch, password, device_id)
+            SELECT 'B' || lpad(i::text, 8, '0'), 'Student ' || i, CASE WHEN i %% 2 = 0 THEN 'BA' ELSE 'BSC' END,
+                   %s, 'dev_bench_' || i
+            FROM generate_series(1, %s) i
+        """, (hash_password(SEED_PASSWORD), students))
+        cur.execute("""
+            INSERT INTO enrollments (class_id, student_id)
+            SELECT c.id, s.id FROM (SELECT id, row_number() OVER (ORDER BY id) - 1 AS n FROM classes) c
+            CROSS JOIN students s WHERE NOT %s OR s.id %% (SELECT COUNT(*) FROM classes) = c.n
+        """, (spread,))
+        cur.execute("""
+            INSERT INTO attendance_sessions (class_id, session_token, start_time, end_time, is_active, session_lat, session_lon, batch_filter)
+            SELECT c.id, 'bench-' || c.id || '-' || d, %s::date + d + interval '9 hours', %s::date + d + interval '9 hours 5 minutes',
+                   FALSE, %s, %s, 'ALL'
+            FROM classes c, generate_series(0, %s - 1) d
+        """, (start, start, CAMPUS_LAT, CAMPUS_LON, days))
+        # ~30 m of GPS jitter around the session centre
+        cur.execute("""
+            INSERT INTO attendance_records (session_id, student_id, timestamp, latitude, longitude, ip_address)
+            SELECT ses.id, s.id, ses.start_time + random() * interval '5 minutes',
+                   ses.session_lat + (random() - 0.5) * 0.0006, ses.session_lon + (random() - 0.5) * 0.0006, 'Bench'
+            FROM attendance_sessions ses JOIN enrollments e ON e.class_id = ses.class_id JOIN students s ON s.id = e.student_id
+            WHERE random() < %s
+        """, (rate,))
+        cur.execute("TRUNCATE daily_attendance, attendance_totals, class_days")
+        for table, source in ROLLUP_SOURCES.items():
+            cur.execute(f"INSERT INTO {table} ({ROLLUP_COLUMNS[table]}) {source}")
+        cur.execute("ANALYZE")
+    conn.commit()
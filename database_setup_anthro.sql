@@ -1,8 +1,18 @@
 -- Database Setup for "Practical 4th Sem" (Merged Batch: B.Sc. + B.A.)
 -- Run this in your Supabase SQL Editor to reset and repopulate the database.
+-- This wipes all history. To close a term and keep it, run `flask --app app_anthro term-archive` instead.
 
+DROP TABLE IF EXISTS archived_attendance CASCADE;
+DROP TABLE IF EXISTS archived_records CASCADE;
+DROP TABLE IF EXISTS archived_sessions CASCADE;
+DROP TABLE IF EXISTS terms CASCADE;
+DROP TABLE IF EXISTS report_versions CASCADE;
+DROP TABLE IF EXISTS daily_attendance CASCADE;
+DROP TABLE IF EXISTS attendance_totals CASCADE;
+DROP TABLE IF EXISTS class_days CASCADE;
 DROP TABLE IF EXISTS attendance_records CASCADE;
 DROP TABLE IF EXISTS attendance_sessions CASCADE;
+DROP TABLE IF EXISTS enrollments CASCADE;
 DROP TABLE IF EXISTS classes CASCADE;
 DROP TABLE IF EXISTS students CASCADE;
 DROP TABLE IF EXISTS users CASCADE;
@@ -21,7 +31,8 @@ CREATE TABLE students (
     name VARCHAR(100) NOT NULL,
     batch VARCHAR(50) NOT NULL,
     password TEXT,              -- Stores password after registration
-    device_id TEXT UNIQUE       -- Locks account to specific device
+    device_id TEXT UNIQUE,      -- Locks account to specific device
+    can_start_session BOOLEAN NOT NULL DEFAULT FALSE  -- Class monitors
 );
 
 -- 3. Class Table
@@ -31,7 +42,15 @@ CREATE TABLE classes (
     controller_id INTEGER REFERENCES users(id)
 );
 
--- 4. Sessions Table
+-- 4. Enrollments (which students belong to which class)
+CREATE TABLE enrollments (
+    class_id INT NOT NULL REFERENCES classes(id) ON DELETE CASCADE,
+    student_id INT NOT NULL REFERENCES students(id) ON DELETE CASCADE,
+    PRIMARY KEY (class_id, student_id)
+);
+CREATE INDEX enrollments_student_idx ON enrollments (student_id);
+
+-- 5. Sessions Table
 CREATE TABLE attendance_sessions (
     id SERIAL PRIMARY KEY,
     class_id INT REFERENCES classes(id) ON DELETE CASCADE,
@@ -41,10 +60,17 @@ CREATE TABLE attendance_sessions (
     end_time TIMESTAMPTZ NOT NULL,
     is_active BOOLEAN NOT NULL DEFAULT TRUE,
     session_lat REAL,
-    session_lon REAL
+    session_lon REAL,
+    batch_filter VARCHAR(10) NOT NULL DEFAULT 'ALL'  -- 'BA', 'BSC' or 'ALL'
 );
+-- One live session per class; every "find active session" lookup is a probe of this small index
+CREATE UNIQUE INDEX attendance_sessions_active_class ON attendance_sessions (class_id) WHERE is_active;
+-- Sessions past end_time still marked active, for the sweeper that closes them
+CREATE INDEX attendance_sessions_active_end ON attendance_sessions (end_time) WHERE is_active;
+-- Per-day lookups (edit attendance, audits) filter on this exact expression
+CREATE INDEX attendance_sessions_class_day ON attendance_sessions (class_id, (DATE(start_time AT TIME ZONE 'UTC')));
 
--- 5. Attendance Records Table
+-- 6. Attendance Records Table
 CREATE TABLE attendance_records (
     id SERIAL PRIMARY KEY,
     session_id INT REFERENCES attendance_sessions(id) ON DELETE CASCADE,
@@ -56,6 +82,90 @@ CREATE TABLE attendance_records (
     UNIQUE (session_id, student_id)
 );
 
+-- 7. Attendance Rollup (maintained by the app; `flask --app app_anthro rollup-rebuild` repairs it)
+-- One row per student per class per day present
+CREATE TABLE daily_attendance (
+    student_id INT NOT NULL REFERENCES students(id) ON DELETE CASCADE,
+    class_id INT NOT NULL REFERENCES classes(id) ON DELETE CASCADE,
+    att_date DATE NOT NULL,
+    PRIMARY KEY (class_id, att_date, student_id)
+);
+CREATE INDEX daily_attendance_student_idx ON daily_attendance (student_id, class_id);
+
+-- Running count of days present
+CREATE TABLE attendance_totals (
+    student_id INT NOT NULL REFERENCES students(id) ON DELETE CASCADE,
+    class_id INT NOT NULL REFERENCES classes(id) ON DELETE CASCADE,
+    days_present INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (student_id, class_id)
+);
+
+-- Days with at least one ended session, per batch filter
+CREATE TABLE class_days (
+    class_id INT NOT NULL REFERENCES classes(id) ON DELETE CASCADE,
+    att_date DATE NOT NULL,
+    batch_filter VARCHAR(10) NOT NULL,
+    PRIMARY KEY (class_id, att_date, batch_filter)
+);
+
+-- Bumped by every write that changes a class's report; the cached report and its ETag are keyed by it
+CREATE TABLE report_versions (
+    class_id INT PRIMARY KEY REFERENCES classes(id) ON DELETE CASCADE,
+    version BIGINT NOT NULL DEFAULT 1,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+-- 8. Terms & Archive (filled by `flask --app app_anthro term-archive`)
+-- The tables above hold the open term only; a closed term's sessions, marks and days present move
+-- into its own read-only partition of each archive table (archived_records_t<term id>, ...)
+CREATE TABLE terms (
+    id SERIAL PRIMARY KEY,
+    name VARCHAR(50) UNIQUE NOT NULL,
+    starts DATE NOT NULL,
+    ends DATE NOT NULL CHECK (ends >= starts),
+    archived_at TIMESTAMPTZ
+);
+
+CREATE TABLE archived_sessions (
+    term_id INT NOT NULL REFERENCES terms(id),
+    id INT NOT NULL,  -- the attendance_sessions id
+    class_id INT NOT NULL REFERENCES classes(id),
+    start_time TIMESTAMPTZ NOT NULL,
+    end_time TIMESTAMPTZ NOT NULL,
+    session_lat REAL,
+    session_lon REAL,
+    batch_filter VARCHAR(10) NOT NULL,
+    PRIMARY KEY (term_id, id)
+) PARTITION BY LIST (term_id);
+
+CREATE TABLE archived_records (
+    term_id INT NOT NULL,
+    session_id INT NOT NULL,
+    student_id INT NOT NULL REFERENCES students(id),
+    timestamp TIMESTAMPTZ NOT NULL,
+    latitude REAL,
+    longitude REAL,
+    PRIMARY KEY (term_id, session_id, student_id),
+    FOREIGN KEY (term_id, session_id) REFERENCES archived_sessions (term_id, id)
+) PARTITION BY LIST (term_id);
+
+-- The term's daily_attendance, for its reports
+CREATE TABLE archived_attendance (
+    term_id INT NOT NULL,
+    class_id INT NOT NULL REFERENCES classes(id),
+    att_date DATE NOT NULL,
+    student_id INT NOT NULL REFERENCES students(id),
+    PRIMARY KEY (term_id, class_id, att_date, student_id)
+) PARTITION BY LIST (term_id);
+
+CREATE OR REPLACE FUNCTION archive_read_only() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    RAISE EXCEPTION 'archived terms are read-only (%)', TG_TABLE_NAME;
+END $$;
+CREATE TRIGGER archived_sessions_read_only BEFORE UPDATE OR DELETE ON archived_sessions FOR EACH ROW EXECUTE FUNCTION archive_read_only();
+CREATE TRIGGER archived_records_read_only BEFORE UPDATE OR DELETE ON archived_records FOR EACH ROW EXECUTE FUNCTION archive_read_only();
+CREATE TRIGGER archived_attendance_read_only BEFORE UPDATE OR DELETE ON archived_attendance FOR EACH ROW EXECUTE FUNCTION archive_read_only();
+
 -- === DATA SEEDING ===
 
 -- Create Admin
@@ -185,4 +295,13 @@ INSERT INTO students (enrollment_no, name, batch) VALUES
 ('Y24109015', 'Aryan Patel', 'BSC'), ('Y24109017', 'Hans Raj Singh', 'BSC'),
 ('Y24109019', 'Namrata Raja Bundela', 'BSC'), ('Y24109020', 'Sanu Tiwari', 'BSC')
 
-ON CONFLICT (enrollment_no) DO NOTHING;
\ No newline at end of file
+ON CONFLICT (enrollment_no) DO NOTHING;
+
+-- Enroll everyone in the class
+INSERT INTO enrollments (class_id, student_id)
+SELECT c.id, s.id FROM classes c CROSS JOIN students s
+ON CONFLICT DO NOTHING;
+
+-- Start every class's report at version 1
+INSERT INTO report_versions (class_id) SELECT id FROM classes
+ON CONFLICT DO NOTHING;
@@ -6,6 +6,16 @@ function showMsg(txt, type='error') {
     setTimeout(() => { el.style.display = 'none'; }, 4000);
 }
 
+// Retries when the server sheds load (503 + Retry-After) instead of failing the action
+async function postJSON(url, body, attempts = 4) {
+    for(let i = 1; ; i++) {
+        const res = await fetch(url, {method: 'POST', headers: {'Content-Type': 'application/json'}, body: JSON.stringify(body)});
+        if(res.status !== 503 || i >= attempts) return res;
+        const wait = (parseFloat(res.headers.get('Retry-After')) || 1) * 1000 * i;
+        await new Promise(r => setTimeout(r, wait + Math.random() * 500));
+    }
+}
+
 function getDevId() {
     let id = localStorage.getItem('did');
     if(!id) { id = 'dev_' + Math.random().toString(36).substr(2,9) + Date.now().toString(36); localStorage.setItem('did', id); }
@@ -29,11 +39,8 @@ async function auth(e, type) {
     data.device_id = getDevId();
     
     try {
-        const res = await fetch(`/api/student/${type}`, {
-            method: 'POST',
-            headers: {'Content-Type': 'application/json'},
-            body: JSON.stringify(data)
-        });
+        // Logins queue for the password hash at the start of a class; keep retrying for ~30s
+        const res = await postJSON(`/api/student/${type}`, data, 8);
         const json = await res.json();
         
         if(json.success) {
@@ -58,13 +65,9 @@ function mark(sid) {
     navigator.geolocation.getCurrentPosition(async (pos) => {
         btn.textContent = "Verifying...";
         try {
-            const res = await fetch('/api/mark', {
-                method: 'POST',
-                headers: {'Content-Type': 'application/json'},
-                body: JSON.stringify({lat: pos.coords.latitude, lon: pos.coords.longitude, session_id: sid})
-            });
+            const res = await postJSON('/api/mark', {lat: pos.coords.latitude, lon: pos.coords.longitude, session_id: sid, token: liveSession && liveSession.token});
             const json = await res.json();
-            if(json.success) { showMsg("Marked!", 'success'); setTimeout(() => location.reload(), 1500); }
+            if(json.success) { showMsg("Marked!", 'success'); renderSession({...liveSession, marked: true}); btn.disabled = false; btn.textContent = originalText; }
             else { showMsg(json.message, 'error'); btn.disabled = false; btn.textContent = originalText; if(txt) txt.textContent = json.message; }
         } catch(e) { showMsg("Server Error", 'error'); btn.disabled = false; btn.textContent = originalText; }
     }, (err) => { showMsg("Location denied/unavailable.", 'error'); btn.disabled = false; btn.textContent = "Retry"; }, {enableHighAccuracy: true});
@@ -84,20 +87,23 @@ async function startSession(batchType = 'ALL') {
                 body: JSON.stringify({
                     lat: pos.coords.latitude, 
                     lon: pos.coords.longitude,
-                    batch: batchType
+                    batch: batchType,
+                    class_id: liveClassId
                 })
             });
             const json = await res.json();
-            if(json.success) location.reload();
-            else alert("Error: " + json.message);
+            if(!json.success) alert("Error: " + json.message);
+            else if(livePoll) refreshLive();
+            else if(!window.EventSource) location.reload();  // otherwise the live stream updates the panel
         } catch(e) { alert("Network Error"); }
     }, (err) => { alert("Location access denied."); }, {enableHighAccuracy: true});
 }
 
 async function endSession() {
     if(!confirm("End session?")) return;
-    await fetch('/api/session/end', {method:'POST'});
-    location.reload();
+    await fetch('/api/session/end', {method:'POST', headers: {'Content-Type': 'application/json'}, body: JSON.stringify({class_id: liveClassId})});
+    if(livePoll) refreshLive();
+    else if(!window.EventSource) location.reload();
 }
 
 // Admin Manual Edit
@@ -139,19 +145,64 @@ function filterStudents() {
     document.querySelectorAll('.student-row').forEach(row => { row.style.display = row.innerText.toLowerCase().includes(term) ? 'flex' : 'none'; });
 }
 
-// Timer
-if(typeof endTime !== 'undefined' && endTime) {
-    const end = new Date(endTime).getTime();
+// Live session: rendered in place from the page's initial state and the event stream
+function renderSession(sess) {
+    liveSession = sess;
+    const cards = {marked: 'card-marked', active: 'card-active', inactive: 'card-inactive'};
+    if(document.getElementById('card-active')) {
+        const state = !sess ? 'inactive' : (sess.marked ? 'marked' : 'active');
+        Object.entries(cards).forEach(([k, id]) => document.getElementById(id).classList.toggle('hidden', k !== state));
+    }
+    if(document.getElementById('panel-live')) {
+        document.getElementById('panel-live').classList.toggle('hidden', !sess);
+        document.getElementById('panel-idle').classList.toggle('hidden', !!sess);
+        if(sess) document.getElementById('live-batch').textContent = sess.batch;
+    }
+    renderCount();
+}
+
+function renderCount() {
+    const el = document.getElementById('live-count');
+    if(el) el.textContent = liveSession ? `${liveSession.marked_count} / ${liveSession.roster} marked` : '';
+}
+
+function connectLive() {
+    const es = new EventSource('/api/session/events' + (liveClassId ? `?class_id=${liveClassId}` : ''));
+    const on = (type, fn) => es.addEventListener(type, e => fn(JSON.parse(e.data)));
+    on('snapshot', d => renderSession(d.session));
+    on('start', d => renderSession(d));
+    on('end', d => { if(liveSession && d.ids.includes(liveSession.id)) renderSession(null); });
+    on('count', d => {
+        if(liveSession && d.session_id === liveSession.id) { liveSession.marked_count = Math.max(liveSession.marked_count, d.marked_count); renderCount(); }
+    });
+    on('resync', () => { es.close(); connectLive(); });  // a fresh connection starts from a snapshot
+}
+
+// Without a stream (sync workers) the same snapshot is polled
+async function refreshLive() {
+    try {
+        const res = await fetch('/api/session/live' + (liveClassId ? `?class_id=${liveClassId}` : ''));
+        const json = await res.json();
+        if(!json.success) return;
+        const sess = json.session;
+        if(sess && liveSession && sess.id === liveSession.id && liveSession.marked) sess.marked = true;  // a mark may still be committing
+        renderSession(sess);
+    } catch(e) {}
+}
+
+if(typeof liveSession !== 'undefined') {
+    renderSession(liveSession);
+    if(livePoll) setInterval(refreshLive, livePoll * 1000);
+    else if(window.EventSource) connectLive();
+
+    // Timer
     setInterval(() => {
-        const diff = end - new Date().getTime();
         const el = document.getElementById('timer') || document.getElementById('admin-timer');
-        if(el) {
-            if(diff < 0) { el.textContent = "00:00"; if(diff > -3000) setTimeout(() => location.reload(), 1000); }
-            else {
-                const m = Math.floor((diff % (1000*60*60))/(1000*60));
-                const s = Math.floor((diff % (1000*60))/1000);
-                el.textContent = `${m.toString().padStart(2,'0')}:${s.toString().padStart(2,'0')}`;
-            }
-        }
+        if(!el || !liveSession) return;
+        const diff = new Date(liveSession.end_time).getTime() - new Date().getTime();
+        if(diff < 0) { el.textContent = "00:00"; return; }
+        const m = Math.floor((diff % (1000*60*60))/(1000*60));
+        const s = Math.floor((diff % (1000*60))/1000);
+        el.textContent = `${m.toString().padStart(2,'0')}:${s.toString().padStart(2,'0')}`;
     }, 1000);
-}
\ No newline at end of file
+}
@@ -0,0 +1,47 @@
+"""The PLAN_CHECKS lookups stay index probes, on a semester of synthetic history in a throwaway schema.
+
+Needs a Postgres to create the schema in: DATABASE_URL=... python -m pytest tests
+(skipped when DATABASE_URL is unset). Same check as `flask --app app_anthro check-plans`.
+"""
+import os
+import secrets
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / 'benchmarks'))
+
+DATABASE_URL = os.environ.get('DATABASE_URL')
+pytestmark = pytest.mark.skipif(not DATABASE_URL, reason='DATABASE_URL not set')
+
+if DATABASE_URL:
+    from seed import connect, create_schema, drop_schema, seed_semester  # also puts the repo root on sys.path
+    from app_anthro import PLAN_CHECKS, explain_plan_checks
+else:
+    PLAN_CHECKS = []
+
+
+@pytest.fixture(scope='module')
+def plans():
+    """{name: (scans, ok)} from explain_plan_checks(). The schema gets some history first: on empty
+    tables a walk of a whole (empty) index is the planner's right call and proves nothing."""
+    schema = f'plan_test_{secrets.token_hex(4)}'
+    create_schema(DATABASE_URL, schema)
+    conn = connect(DATABASE_URL, schema)
+    try:
+        seed_semester(conn, students=100, days=60)
+        with conn.cursor() as cur:
+            yield {name: (scans, ok) for name, scans, ok in explain_plan_checks(cur)}
+        conn.rollback()
+    finally:
+        conn.close()
+        drop_schema(DATABASE_URL, schema)
+
+
+@pytest.mark.parametrize('name', [name for name, _, _ in PLAN_CHECKS])
+def test_lookup_is_an_index_probe(plans, name):
+    scans, ok = plans[name]
+    assert scans, f"{name}: no table or index scan in the plan"
+    assert ok, f"{name} scans a whole table or index: {[scan for scan in scans if not scan[-1]]}"